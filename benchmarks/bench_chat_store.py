@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""
+会话设置存储基准：批量写入与启动载入的耗时
+
+用法：python benchmarks/bench_chat_store.py [--chats 100000]
+chat_settings_store 只依赖标准库，可脱离 MaiBot 直接运行；数据库写在临时目录中。
+"""
+import argparse
+import importlib.util
+import os
+import tempfile
+import time
+
+_CORE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "core")
+
+
+def _load_store_module():
+    spec = importlib.util.spec_from_file_location(
+        "nai_chat_settings_store", os.path.join(_CORE_DIR, "chat_settings_store.py")
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def main():
+    parser = argparse.ArgumentParser(description="会话设置存储写入 / 载入耗时基准")
+    parser.add_argument("--chats", type=int, default=100000, help="会话数量")
+    parser.add_argument("--batch", type=int, default=500, help="每次写入事务包含的会话数")
+    args = parser.parse_args()
+
+    store_module = _load_store_module()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "chat_settings.db")
+        store = store_module.ChatSettingsStore(path)
+
+        entries = [
+            ("qq", str(100000 + i), {"model": "nai-diffusion-4-5-full", "size": "832x1216", "artist_preset": i % 5 + 1})
+            for i in range(args.chats)
+        ]
+        started = time.perf_counter()
+        for offset in range(0, len(entries), args.batch):
+            store.write_many(entries[offset:offset + args.batch])
+        write_s = time.perf_counter() - started
+        print(f"写入 {args.chats} 个会话（每批 {args.batch}）: {write_s * 1000:.0f}ms，"
+              f"{args.chats / write_s:,.0f} 会话/秒")
+        store.close()
+
+        # 重新打开，模拟插件重启后的启动载入
+        for limit in (10000, None):
+            store = store_module.ChatSettingsStore(path)
+            started = time.perf_counter()
+            loaded = sum(1 for _ in store.load_recent(limit))
+            load_s = time.perf_counter() - started
+            print(f"载入 {loaded} 个会话（limit={limit}）: {load_s * 1000:.0f}ms")
+            store.close()
+
+        store = store_module.ChatSettingsStore(path)
+        started = time.perf_counter()
+        for i in range(0, args.chats, max(1, args.chats // 1000)):
+            store.get("qq", str(100000 + i))
+        lookups = len(range(0, args.chats, max(1, args.chats // 1000)))
+        print(f"单个会话补载: {(time.perf_counter() - started) / lookups * 1_000_000:.1f}us/次")
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+"""
+热点函数基准：测量一次请求中插件自身的 CPU 开销，并与仓库中的基线比较
+
+用法：python benchmarks/bench_hot_paths.py [--filter save_image] [--threshold 0.3] [--runs 3] [--update]
+组件在 devtools.fake_host 提供的宿主替身中运行，无需 MaiBot。
+
+不同机器的绝对耗时不可比，因此每轮都测一段固定的纯 Python 校准负载，
+基线与比较都使用 耗时 / 校准耗时 的相对值，取 --runs 轮中的最小值（干扰只会让耗时变长，
+真正的退化在每一轮都会出现）。相对值比基线慢超过 --threshold（涉及磁盘的项目使用
+--io-threshold，基线不足 10us 的项目使用 --small-threshold），且按本次校准换算的绝对增量
+超过 --min-delta-us 时才视为退化，进程以状态码 1 退出；几微秒的项目 30% 的波动只是噪声。
+--update 把本次结果写入 benchmarks/baselines.json。
+"""
+import argparse
+import base64
+import importlib
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import timeit
+from typing import Callable, Dict, List, Tuple
+
+_BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+_REPO_DIR = os.path.dirname(_BENCH_DIR)
+_BASELINE_PATH = os.path.join(_BENCH_DIR, "baselines.json")
+
+sys.path.insert(0, _REPO_DIR)
+from devtools import fake_host  # noqa: E402
+from devtools.fake_upstream import make_png  # noqa: E402
+
+
+def _calibration():
+    """固定的纯 Python 负载：字典、字符串与整数运算"""
+    table = {}
+    for i in range(2000):
+        key = f"k{i % 97}"
+        table[key] = table.get(key, 0) + i * i
+    return sorted(table.items())
+
+
+def _per_call_us(func: Callable[[], object], repeat: int = 5) -> float:
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat, number)) / number * 1_000_000
+
+
+def _core(name: str):
+    return importlib.import_module(f"{fake_host.PACKAGE_NAME}.core.{name}")
+
+
+def _make_messages() -> List[Dict[str, object]]:
+    """与 message_api 返回形态相同的消息：普通文本、长文本、图片标记与消息段"""
+    long_text = "今天的作业好多啊，" * 40
+    return [
+        {"message_id": "1001", "time": 1.0, "user_id": "20001", "processed_plain_text": "早上好", "is_picid": False},
+        {"message_id": "1002", "time": 2.0, "user_id": "20002", "processed_plain_text": long_text,
+         "display_message": long_text, "raw_message": long_text},
+        {"message_id": "1003", "time": 3.0, "user_id": "10000", "processed_plain_text": "[图片]"},
+        {"message_id": "1004", "time": 4.0, "user_id": "10000", "is_picid": True},
+        {"message_id": "1005", "time": 5.0, "user_id": "10000",
+         "message_segment": {"type": "seglist", "data": [{"type": "text"}, {"type": "imageurl"}]}},
+    ]
+
+
+def _bench_save_image(image_helper, payload_mb: int) -> Callable[[], object]:
+    image_b64 = base64.b64encode(make_png(payload_mb * 1024)).decode()
+
+    def run():
+        path = image_helper.save_base64_image_to_file(image_b64)
+        os.remove(path)
+
+    return run
+
+
+def _time_cleanup(image_helper, out_dir: str, files: int, repeat: int = 3) -> float:
+    """每轮重新创建 files 个文件（不计时），再计时一次清理"""
+    best = float("inf")
+    for _ in range(repeat):
+        now = time.time()
+        for i in range(files):
+            path = os.path.join(out_dir, f"nai_{i}.png")
+            with open(path, "wb"):
+                pass
+            # 一半超过保留时间，其余按创建顺序递增
+            mtime = now - 3600 if i % 2 else now - files + i
+            os.utime(path, (mtime, mtime))
+        started = time.perf_counter()
+        image_helper._cleanup_generated_files(now)
+        best = min(best, time.perf_counter() - started)
+    for entry in os.scandir(out_dir):
+        os.remove(entry.path)
+    return best * 1_000_000
+
+
+def collect(name_filter: str) -> Tuple[List[Tuple[str, bool, Callable[[], float]]], Callable[[], None]]:
+    """返回 [(名称, 是否涉及磁盘, 测量一次每次调用耗时 us 的函数)] 与结束时的清理函数"""
+    fake_host.install()
+    loaded = fake_host.load_plugin({
+        "model": {"base_url": "http://127.0.0.1:9", "api_key": "bench", "custom_prompt_add": "masterpiece"},
+        "chat_state": {"persist": False},
+        "config_reload": {"enabled": False},
+    })
+    config = loaded.plugin.config
+    stream = fake_host.make_chat_stream()
+    command = fake_host.create_command(loaded.components["NaiDrawCommand"], "/nai 初音未来", config, stream)
+    action = fake_host.create_action(loaded.components["NaiPicAction"], {"description": "初音未来"}, config, stream)
+
+    model_config_cache = _core("model_config_cache").model_config_cache
+    nai_web_client = _core("nai_web_client")
+    image_helper = _core("image_url_helper")
+    plugin_settings = _core("plugin_settings")
+    recall_matching = _core("recall_matching")
+    template = _core("prompt_templates").get_prompt_generator_template("command")
+
+    model_config = command._get_model_config()
+    base64_result = base64.b64encode(make_png(64)).decode()
+    presets = [{"name": f"风格{i}", "prompt": f"1.2::artist:example{i}::, 1.0::artist:other{i}::"} for i in range(8)]
+    messages = _make_messages()
+    request_text = "画一张初音未来，穿着制服在樱花树下，微笑看着镜头"
+
+    def model_config_miss():
+        model_config_cache.invalidate_all()
+        return command._get_model_config()
+
+    out_dir = tempfile.mkdtemp(prefix="nai_bench_")
+    image_helper._IMAGE_OUTPUT_DIR = out_dir
+    image_helper._output_dir_ready = False
+    # 不让保存图片时顺带触发清理
+    image_helper._last_cleanup_ts = float("inf")
+
+    cases: List[Tuple[str, bool, Callable[[], object]]] = [
+        ("model_config.cached", False, command._get_model_config),
+        ("model_config.rebuild", False, model_config_miss),
+        ("web_client.build_request", False, lambda: nai_web_client.build_request(request_text, model_config, "832x1216")),
+        ("process_api_response.base64", False, lambda: action._process_api_response(base64_result)),
+        ("process_api_response.url", False, lambda: action._process_api_response("https://images.invalid/a.png")),
+        ("process_api_response.data_uri", False,
+         lambda: action._process_api_response(f"data:image/png;base64,{base64_result}")),
+        ("is_image_message.batch5", False, lambda: [recall_matching.is_image_message(m) for m in messages]),
+        ("parse_artist_presets.8", False, lambda: plugin_settings.parse_artist_presets(presets)),
+        ("render_generator_prompt", False, lambda: command._render_generator_prompt(template, request_text, True)),
+    ]
+    for payload_mb in (1, 4, 8):
+        cases.append((f"save_image.{payload_mb}mb", True, _bench_save_image(image_helper, payload_mb)))
+
+    measures: List[Tuple[str, bool, Callable[[], float]]] = [
+        (name, io_bound, lambda func=func: _per_call_us(func)) for name, io_bound, func in cases if name_filter in name
+    ]
+    if name_filter in "cleanup_generated_files.10k":
+        measures.append(("cleanup_generated_files.10k", True, lambda: _time_cleanup(image_helper, out_dir, 10_000)))
+    return measures, lambda: os.rmdir(out_dir)
+
+
+def measure(name_filter: str, runs: int) -> Tuple[float, List[Tuple[str, bool, float, float]]]:
+    """
+    测量 runs 轮，返回 (校准耗时 us 的中位数, [(名称, 是否涉及磁盘, 耗时 us 最小值, 相对值最小值)])
+
+    每轮的相对值用该轮前后两次校准中的较小值换算，减少频率调节等干扰。
+    """
+    measures, cleanup = collect(name_filter)
+    calibrations: List[float] = []
+    samples: Dict[str, List[Tuple[float, float]]] = {name: [] for name, _, _ in measures}
+    try:
+        calibration_us = _per_call_us(_calibration, repeat=7)
+        for _ in range(max(1, runs)):
+            timings = [(name, run()) for name, _, run in measures]
+            after = _per_call_us(_calibration, repeat=7)
+            round_calibration = min(calibration_us, after)
+            calibration_us = after
+            calibrations.append(round_calibration)
+            for name, us in timings:
+                samples[name].append((us, us / round_calibration))
+    finally:
+        cleanup()
+    results = [
+        (name, io_bound, min(us for us, _ in samples[name]), min(relative for _, relative in samples[name]))
+        for name, io_bound, _ in measures
+    ]
+    return statistics.median(calibrations), results
+
+
+def _regressed(change: float, delta_us: float, limit: float, min_delta_us: float) -> bool:
+    return change > limit and delta_us > min_delta_us
+
+
+def main():
+    parser = argparse.ArgumentParser(description="插件热点函数基准与退化检查")
+    parser.add_argument("--filter", default="", help="只运行名称包含该字符串的项目")
+    parser.add_argument("--threshold", type=float, default=0.3, help="允许的相对退化比例")
+    parser.add_argument("--io-threshold", type=float, default=1.0, help="涉及磁盘的项目允许的相对退化比例")
+    parser.add_argument("--small-threshold", type=float, default=0.6,
+                        help="基线不足 --small-us 的项目允许的相对退化比例")
+    parser.add_argument("--small-us", type=float, default=10.0, help="按本次校准换算的基线低于该值（微秒）时视为小项目")
+    parser.add_argument("--min-delta-us", type=float, default=1.0,
+                        help="绝对增量（按本次校准换算的微秒数）不超过该值时不视为退化")
+    parser.add_argument("--runs", type=int, default=3, help="测量轮数，每项取各轮的最小值（相对值同样取最小值）")
+    parser.add_argument("--update", action="store_true", help="把本次结果写入基线文件")
+    args = parser.parse_args()
+
+    calibration_us, results = measure(args.filter, args.runs)
+
+    baseline = {}
+    if os.path.exists(_BASELINE_PATH):
+        with open(_BASELINE_PATH, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    baseline_items = baseline.get("benchmarks", {})
+
+    print(f"校准负载 {calibration_us:.1f}us（基线 {baseline.get('calibration_us', 0):.1f}us）")
+    print(f"{'benchmark':<32} {'us/call':>12} {'relative':>10} {'baseline':>10} {'change':>8}")
+    regressions = []
+    for name, io_bound, us, relative in results:
+        previous = baseline_items.get(name, {}).get("relative")
+        if previous:
+            change = relative / previous - 1
+            expected_us = previous * calibration_us
+            if io_bound:
+                limit = args.io_threshold
+            elif expected_us < args.small_us:
+                limit = args.small_threshold
+            else:
+                limit = args.threshold
+            delta_us = (relative - previous) * calibration_us
+            flag = "  退化" if _regressed(change, delta_us, limit, args.min_delta_us) else ""
+            if flag:
+                regressions.append(name)
+            print(f"{name:<32} {us:>12.2f} {relative:>10.4f} {previous:>10.4f} {change:>+7.0%}{flag}")
+        else:
+            print(f"{name:<32} {us:>12.2f} {relative:>10.4f} {'-':>10} {'-':>8}")
+
+    if args.update:
+        items = dict(baseline_items)
+        for name, io_bound, us, relative in results:
+            items[name] = {"us": round(us, 3), "relative": round(relative, 6), "io": io_bound}
+        baseline = {
+            "calibration_us": round(calibration_us, 3),
+            "python": platform.python_version(),
+            "benchmarks": dict(sorted(items.items())),
+        }
+        with open(_BASELINE_PATH, "w", encoding="utf-8") as f:
+            json.dump(baseline, f, ensure_ascii=False, indent=2)
+            f.write("\n")
+        print(f"\n基线已写入 {os.path.relpath(_BASELINE_PATH, _REPO_DIR)}")
+    elif regressions:
+        print(f"\n{len(regressions)} 项超过退化阈值: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+撤回消息ID解析基准：对比逐次重建账号映射 / 逐标记子串扫描与缓存映射 / 单次标记扫描的耗时
+
+用法：python benchmarks/bench_recall_resolution.py [--number 20000]
+recall_matching 不依赖宿主程序，可脱离 MaiBot 直接运行。
+"""
+import argparse
+import importlib.util
+import os
+import timeit
+from types import SimpleNamespace
+
+_CORE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "core")
+
+_LEGACY_TAGS = ("[图片", "[image", "[imageurl", "[picid", "picid:")
+
+
+def _load_recall_matching():
+    spec = importlib.util.spec_from_file_location("nai_recall_matching", os.path.join(_CORE_DIR, "recall_matching.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def _parse_platform_accounts(platforms):
+    """模拟宿主的 "平台:账号" 列表解析"""
+    result = {}
+    for item in platforms:
+        platform, _, account = str(item).partition(":")
+        result[platform] = account
+    return result
+
+
+def _legacy_account_lookup(global_config, platform):
+    """优化前：每次调用都重新解析配置并构建映射"""
+    bot_config = global_config.bot
+    account_map = {
+        k.strip().lower(): str(v).strip()
+        for k, v in _parse_platform_accounts(bot_config.platforms).items()
+        if v
+    }
+    qq_account = str(bot_config.qq_account or "").strip()
+    if qq_account:
+        account_map.setdefault("qq", qq_account)
+    return account_map.get((platform or "").strip().lower(), qq_account)
+
+
+def _legacy_is_image(msg):
+    """优化前：每个文本字段逐个标记做子串扫描"""
+    if msg.get("is_picid"):
+        return True
+    for key in ("processed_plain_text", "display_message", "raw_message"):
+        text_val = msg.get(key)
+        if isinstance(text_val, str) and any(tag in text_val for tag in _LEGACY_TAGS):
+            return True
+    return False
+
+
+def _make_message(text_len: int, image: bool):
+    text = "普通聊天内容" * (text_len // 6)
+    if image:
+        text += "[picid:abcdef]"
+    return {"is_picid": False, "processed_plain_text": text, "display_message": text, "raw_message": text}
+
+
+def _per_call_us(func, number):
+    return min(timeit.repeat(func, number=number, repeat=3)) / number * 1_000_000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="撤回消息ID解析耗时基准")
+    parser.add_argument("--number", type=int, default=20000, help="每项测量的调用次数")
+    args = parser.parse_args()
+
+    recall_matching = _load_recall_matching()
+
+    print("账号映射（每次查询）")
+    print(f"{'platforms':>10} {'legacy us':>10} {'cached us':>10}")
+    for platform_count in (1, 8, 64):
+        platforms = [f"platform{i}:{10000 + i}" for i in range(platform_count)]
+        global_config = SimpleNamespace(
+            bot=SimpleNamespace(platforms=platforms, qq_account="10000", telegram_account="")
+        )
+        cache = recall_matching.AccountMapCache(lambda: global_config, _parse_platform_accounts)
+        legacy = _per_call_us(lambda: _legacy_account_lookup(global_config, "platform0"), args.number)
+        cached = _per_call_us(lambda: cache.get("platform0"), args.number)
+        print(f"{platform_count:>10} {legacy:>10.2f} {cached:>10.2f}")
+
+    print()
+    print("图片消息识别（每条消息）")
+    print(f"{'text len':>10} {'image':>6} {'legacy us':>10} {'scan us':>12}")
+    for text_len in (30, 300, 3000):
+        for image in (False, True):
+            msg = _make_message(text_len, image)
+            assert _legacy_is_image(msg) == recall_matching.is_image_message(msg) == image
+            legacy = _per_call_us(lambda: _legacy_is_image(msg), args.number)
+            scanned = _per_call_us(lambda: recall_matching.is_image_message(msg), args.number)
+            print(f"{text_len:>10} {str(image):>6} {legacy:>10.2f} {scanned:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""
+插件配置读取基准：对比按点分键遍历配置字典与读取编译后配置对象的耗时
+
+用法：python benchmarks/bench_settings.py [--number 100000] [--admins 50]
+plugin_settings 只依赖标准库，可脱离 MaiBot 直接运行。
+"""
+import argparse
+import importlib.util
+import os
+import timeit
+
+_CORE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "core")
+
+
+def _load_settings_module():
+    spec = importlib.util.spec_from_file_location("nai_plugin_settings", os.path.join(_CORE_DIR, "plugin_settings.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def _get_config(config, key, default=None):
+    """与宿主 get_config 相同的点分键遍历"""
+    current = config
+    for part in key.split("."):
+        if isinstance(current, dict) and part in current:
+            current = current[part]
+        else:
+            return default
+    return current
+
+
+def _make_config(admins: int):
+    presets = [{"name": f"风格{i}", "prompt": f"1.2::artist:example{i}::, 1.0::artist:other{i}::"} for i in range(8)]
+    version = {
+        "artist_presets": presets,
+        "nai_size": "竖图",
+        "default_size": "1024x1280",
+        "draft_size": "512x768",
+        "num_inference_steps": 28,
+        "nai_extra_params": {},
+    }
+    return {
+        "model": {"default_model": "nai-diffusion-4-5-full", "base_url": "https://example.invalid", "api_key": "k"},
+        "model_nai3": dict(version),
+        "model_nai4": dict(version),
+        "model_nai4_5": dict(version),
+        "components": {"enable_debug_info": False},
+        "image_postprocess": {"enabled": True, "strip_metadata": True, "transcode_format": "",
+                              "transcode_quality": 90, "transcode_threshold_kb": 1024, "worker_processes": 1},
+        "upscale": {"enabled": True, "presets": {"竖图": "576x832", "横图": "832x576"}, "resample": "lanczos"},
+        "batch": {"max_count": 4, "max_grid_side": 2048},
+        "auto_recall": {"enabled": True, "delay_seconds": 5, "allowed_groups": [f"qq:{i}" for i in range(admins)]},
+        "admin": {"admin_users": [str(100000 + i) for i in range(admins)], "default_admin_mode": True},
+        "prompt_generator": {"model_name": "", "temperature": 0.2},
+    }
+
+
+def _dict_request(config, settings_module, user_id):
+    """优化前一次生图请求中的配置读取"""
+    admin_mode = _get_config(config, "admin.default_admin_mode", False)
+    allowed = not admin_mode or user_id in _get_config(config, "admin.admin_users", [])
+    _get_config(config, "prompt_generator", None) or _get_config(config, "prompt_fallback", None)
+    base = _get_config(config, "model", {})
+    version = _get_config(config, "model_nai4_5", {})
+    presets = settings_module.parse_artist_presets(_get_config(config, "model_nai4_5.artist_presets", []))
+    _get_config(config, "components.enable_debug_info", False)
+    _get_config(config, "upscale.enabled", False)
+    upscale = {
+        settings_module.SIZE_MAPPINGS.get(k, k): v for k, v in (_get_config(config, "upscale.presets", {}) or {}).items()
+    }
+    _get_config(config, "image_postprocess.enabled", False)
+    _get_config(config, "image_postprocess.strip_metadata", True)
+    _get_config(config, "image_postprocess.transcode_format", "")
+    _get_config(config, "image_postprocess.worker_processes", 1)
+    _get_config(config, "auto_recall.enabled", False)
+    _get_config(config, "auto_recall.delay_seconds", 5)
+    return allowed, base, version, presets, upscale
+
+
+def _compiled_request(settings, user_id):
+    """读取编译后的配置对象"""
+    allowed = not settings.admin.default_admin_mode or settings.is_admin(user_id)
+    settings.prompt_generator
+    base = settings.model
+    version = settings.version_for("nai-diffusion-4-5-full")
+    presets = version.artist_presets
+    settings.components.enable_debug_info
+    upscale = settings.upscale
+    upscale.enabled
+    upscale.presets
+    postprocess = settings.image_postprocess
+    postprocess.enabled
+    postprocess.strip_metadata
+    postprocess.transcode_format
+    postprocess.worker_processes
+    settings.auto_recall.enabled
+    settings.auto_recall.delay_seconds
+    return allowed, base, version, presets, upscale
+
+
+def _per_call_us(func, number):
+    return min(timeit.repeat(func, number=number, repeat=3)) / number * 1_000_000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="插件配置读取耗时基准")
+    parser.add_argument("--number", type=int, default=100000, help="每项测量的调用次数")
+    parser.add_argument("--admins", type=int, default=50, help="管理员 / 白名单条目数")
+    args = parser.parse_args()
+
+    settings_module = _load_settings_module()
+    config = _make_config(args.admins)
+    compile_us = _per_call_us(lambda: settings_module.compile_settings(config), max(1, args.number // 100))
+    settings = settings_module.compile_settings(config)
+    print(f"编译配置: {compile_us:.1f}us/次（加载与重新加载时各一次）")
+
+    last_admin = str(100000 + args.admins - 1)
+    print()
+    print(f"{'读取项':<24} {'dict us':>10} {'compiled us':>12}")
+    rows = (
+        ("管理员检查（末位）", lambda: last_admin in _get_config(config, "admin.admin_users", []),
+         lambda: settings.is_admin(last_admin)),
+        ("画师串预设", lambda: settings_module.parse_artist_presets(_get_config(config, "model_nai4_5.artist_presets", [])),
+         lambda: settings.version_for("nai-diffusion-4-5-full").artist_presets),
+        ("单个标量配置", lambda: _get_config(config, "auto_recall.delay_seconds", 5),
+         lambda: settings.auto_recall.delay_seconds),
+        ("一次生图请求合计", lambda: _dict_request(config, settings_module, last_admin),
+         lambda: _compiled_request(settings, last_admin)),
+    )
+    for label, legacy, compiled in rows:
+        legacy_us = _per_call_us(legacy, args.number)
+        compiled_us = _per_call_us(compiled, args.number)
+        print(f"{label:<24} {legacy_us:>10.2f} {compiled_us:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+插件启动基准：统计导入插件及各组件模块的耗时
+
+用法：python benchmarks/bench_startup.py --host-root /path/to/MaiBot [--repeat 5]
+在子进程中以 python -X importtime 导入插件包与全部组件模块（与注册组件时相同），
+每个模块取多次运行中的最小值；同时列出导入耗时最高的第三方 / 标准库模块。
+插件模块依赖宿主的 src 包，--host-root 为包含 src 目录的宿主根目录。
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+from collections import defaultdict
+
+_REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_PACKAGE = "nai_pic_plugin"
+
+# 与 NaiPicPlugin.get_plugin_components 导入的模块一致
+_COMPONENT_MODULES = (
+    "core.nai_pic_action",
+    "core.nai_recall_command",
+    "core.nai_draw_command",
+    "core.nai_0_draw_command",
+    "core.nai_admin_command",
+    "core.chat_state",
+    "core.config_watcher",
+    "core.nai_message_event_handler",
+)
+
+
+def _run_importtime(host_root: str, link_dir: str):
+    imports = "; ".join(f"import {_PACKAGE}.{module}" for module in ("plugin",) + _COMPONENT_MODULES)
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, (link_dir, host_root, env.get("PYTHONPATH"))))
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", imports],
+        cwd=host_root, env=env, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        tail = result.stderr.strip().splitlines()[-1:] or ["未知错误"]
+        raise RuntimeError(f"导入失败: {tail[0]}")
+
+    timings = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        head, cumulative_us, name = line.split("|", 2)
+        self_us = head.split(":", 1)[1].strip()
+        cumulative_us = cumulative_us.strip()
+        if not self_us.isdigit() or not cumulative_us.isdigit():
+            continue  # 表头
+        timings.setdefault(name.strip(), (int(self_us), int(cumulative_us)))
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="插件导入耗时基准")
+    parser.add_argument("--host-root", default=os.getcwd(), help="宿主根目录（包含 src 包）")
+    parser.add_argument("--repeat", type=int, default=5, help="重复运行次数，每个模块取最小值")
+    parser.add_argument("--top", type=int, default=10, help="列出耗时最高的外部模块数量")
+    args = parser.parse_args()
+
+    if not os.path.isdir(os.path.join(args.host_root, "src")):
+        parser.error(f"{args.host_root} 下没有 src 目录，请用 --host-root 指定宿主根目录")
+
+    best = defaultdict(lambda: (float("inf"), float("inf")))
+    with tempfile.TemporaryDirectory() as link_dir:
+        # 以固定包名导入，不依赖仓库目录名
+        os.symlink(_REPO_DIR, os.path.join(link_dir, _PACKAGE))
+        for _ in range(max(1, args.repeat)):
+            for name, (self_us, cumulative_us) in _run_importtime(args.host_root, link_dir).items():
+                prev_self, prev_cumulative = best[name]
+                best[name] = (min(prev_self, self_us), min(prev_cumulative, cumulative_us))
+
+    plugin_modules = sorted(
+        ((name, timing) for name, timing in best.items() if name == _PACKAGE or name.startswith(f"{_PACKAGE}.")),
+        key=lambda item: -item[1][1],
+    )
+    print(f"插件模块（{args.repeat} 次取最小值，单位 ms）")
+    print(f"{'module':<48} {'self':>8} {'cumulative':>11}")
+    for name, (self_us, cumulative_us) in plugin_modules:
+        print(f"{name:<48} {self_us / 1000:>8.2f} {cumulative_us / 1000:>11.2f}")
+
+    external = sorted(
+        ((name, timing) for name, timing in best.items()
+         if not name.startswith(_PACKAGE) and not name.startswith("src") and "." not in name),
+        key=lambda item: -item[1][1],
+    )[:args.top]
+    print()
+    print("耗时最高的外部顶层模块（含宿主启动时可能已导入的模块）")
+    for name, (_, cumulative_us) in external:
+        print(f"{name:<48} {cumulative_us / 1000:>20.2f}")
+
+
+if __name__ == "__main__":
+    main()
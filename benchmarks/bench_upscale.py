@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""
+本地放大基准：统计各放大预设、各放大算法的每百万像素耗时
+
+用法：python benchmarks/bench_upscale.py [--repeat 5]
+需要安装 Pillow；image_ops 不依赖宿主程序，可脱离 MaiBot 直接运行。
+"""
+import argparse
+import importlib.util
+import os
+import statistics
+import time
+from io import BytesIO
+
+_CORE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "core")
+
+PRESETS = [
+    ("832x1216", "576x832"),
+    ("1216x832", "832x576"),
+    ("1024x1024", "704x704"),
+]
+
+
+def _load_image_ops():
+    spec = importlib.util.spec_from_file_location("nai_image_ops", os.path.join(_CORE_DIR, "image_ops.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def _make_source(width: int, height: int) -> bytes:
+    """生成带渐变与噪声的测试图，避免纯色图的压缩/缩放捷径"""
+    from PIL import Image
+
+    image = Image.effect_noise((width, height), 64).convert("RGB")
+    gradient = Image.linear_gradient("L").resize((width, height)).convert("RGB")
+    blended = Image.blend(image, gradient, 0.5)
+    output = BytesIO()
+    blended.save(output, format="PNG")
+    return output.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地放大每百万像素耗时基准")
+    parser.add_argument("--repeat", type=int, default=5, help="每个组合重复次数")
+    args = parser.parse_args()
+
+    image_ops = _load_image_ops()
+    print(f"{'target':>10} {'upstream':>10} {'resample':>9} {'median ms':>10} {'ms/MP':>8}")
+    for target, upstream in PRESETS:
+        target_w, target_h = image_ops.parse_size(target)
+        source = _make_source(*image_ops.parse_size(upstream))
+        megapixels = target_w * target_h / 1_000_000
+        for resample in ("lanczos", "bicubic", "bilinear"):
+            samples = []
+            for _ in range(args.repeat):
+                started = time.perf_counter()
+                image_ops.upscale_image(source, target_w, target_h, resample)
+                samples.append((time.perf_counter() - started) * 1000)
+            median_ms = statistics.median(samples)
+            print(f"{target:>10} {upstream:>10} {resample:>9} {median_ms:>10.1f} {median_ms / megapixels:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
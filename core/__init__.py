@@ -2,7 +2,15 @@
 NovelAI Web 图片生成插件核心模块
 """
 
-from .nai_web_client import NaiWebClient
-from .nai_pic_action import NaiPicAction
-
 __all__ = ['NaiWebClient', 'NaiPicAction']
+
+
+def __getattr__(name):
+    # 按需导入，避免导入任一子模块时连带加载全部组件
+    if name == 'NaiWebClient':
+        from .nai_web_client import NaiWebClient
+        return NaiWebClient
+    if name == 'NaiPicAction':
+        from .nai_pic_action import NaiPicAction
+        return NaiPicAction
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
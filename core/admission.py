@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+准入控制：上游排队过长时在生成提示词之前拒绝新请求，并回复预计等待时间
+
+预计等待 = 排在前面的上游调用中超出并发上限的部分 ÷ 上游吞吐 + 一次调用的耗时，
+吞吐由上游耗时的 EWMA 与并发上限得出（见 upstream_limiter）。排在前面的调用数取
+已准入但尚未结束的请求张数（包括仍在生成提示词的）与上游正在进行和等待的调用数中的较大者。
+/nai 与 Action、/nai0（没有 LLM 步骤）和管理员分别使用各自的等待上限，0 为不限制。
+"""
+import functools
+import time
+from typing import Any, Dict, Iterator, Optional
+
+from src.common.logger import get_logger
+
+from . import runtime_stats
+from .plugin_settings import AdmissionSettings, plugin_settings
+from .quota import format_duration
+from .upstream_limiter import find_upstream_limiter, format_limit
+
+logger = get_logger("nai_pic_plugin")
+
+ENTRIES = ("nai", "nai0", "action")
+
+
+class AdmissionController:
+    """按上游统计已准入的请求，估算新请求的等待时间"""
+
+    def __init__(self):
+        # 上游 base_url -> 已准入但尚未结束的请求张数
+        self._outstanding: Dict[str, int] = {}
+
+    @property
+    def settings(self) -> Optional[AdmissionSettings]:
+        current = plugin_settings.current
+        return current.admission if current is not None else None
+
+    @staticmethod
+    def _upstream_key() -> str:
+        current = plugin_settings.current
+        return str(current.model.get("base_url") or "").rstrip("/") if current is not None else ""
+
+    @staticmethod
+    def _max_wait(settings: AdmissionSettings, entry: str, user_id: str) -> float:
+        current = plugin_settings.current
+        if user_id and current is not None and current.is_admin(user_id):
+            return settings.admin_max_wait_seconds
+        return settings.nai0_max_wait_seconds if entry == "nai0" else settings.max_wait_seconds
+
+    def estimate(self, key: str, cost: int = 1) -> Optional[float]:
+        """新请求在 key 对应上游完成 cost 次调用的预计秒数；上游还没有耗时样本时返回 None"""
+        limiter = find_upstream_limiter(key)
+        if limiter is None:
+            return None
+        ahead = max(self._outstanding.get(key, 0), limiter.in_flight + limiter.waiting)
+        return limiter.estimate_wait(ahead, cost)
+
+    def admit(self, component: Any, entry: str, cost: int = 1) -> Optional[str]:
+        """准入时登记并返回 None，预计等待超过上限时返回提示文本"""
+        settings = self.settings
+        if settings is None or not settings.enabled:
+            return None
+        cost = max(1, int(cost))
+        _, _, user_id = component._get_chat_identity()
+        key = self._upstream_key()
+        max_wait = self._max_wait(settings, entry, str(user_id or ""))
+        wait = self.estimate(key, cost) if max_wait > 0 else None
+        if wait is not None and wait > max_wait:
+            runtime_stats.incr(f"admission.shed.{entry}")
+            logger.info(f"{component.log_prefix} 预计等待 {wait:.0f}s 超过上限 {max_wait:g}s，拒绝请求")
+            return f"🚦 当前生图排队较多，预计约 {format_duration(wait)}后才能出图，请稍后再试"
+        self._outstanding[key] = self._outstanding.get(key, 0) + cost
+        component._admission = (key, cost)
+        return None
+
+    def release(self, component: Any) -> None:
+        admitted = getattr(component, "_admission", None)
+        if admitted is None:
+            return
+        component._admission = None
+        key, cost = admitted
+        self._outstanding[key] = max(0, self._outstanding.get(key, 0) - cost)
+
+    def status_lines(self) -> Iterator[str]:
+        """当前负载与启动以来的拒绝次数，用于 /nai report"""
+        key = self._upstream_key()
+        limiter = find_upstream_limiter(key)
+        if limiter is not None and limiter.latency_ewma is not None:
+            wait = self.estimate(key)
+            yield (f"  上游进行中 {limiter.in_flight}/{format_limit(limiter.limit)}，排队 {limiter.waiting}，"
+                   f"已准入 {self._outstanding.get(key, 0)}，单次耗时 EWMA {limiter.latency_ewma:.1f}s，"
+                   f"新请求预计 {wait:.1f}s")
+        else:
+            yield "  上游尚无耗时样本"
+        if limiter is not None and len(limiter.history) > 1:
+            changes = list(limiter.history)[-6:]
+            yield "  并发上限变化：" + "，".join(
+                f"{time.strftime('%H:%M', time.localtime(ts))} {format_limit(limit)}（{reason}）" for ts, limit, reason in changes
+            )
+        shed = [(entry, runtime_stats.get_counter(f"admission.shed.{entry}")) for entry in ENTRIES]
+        yield "  启动以来排队拒绝：" + "，".join(f"{entry} {count}" for entry, count in shed)
+
+
+# 进程内共享的准入控制
+admission = AdmissionController()
+
+
+def admission_request(entry: str):
+    """装饰组件的 execute：请求结束时释放准入登记"""
+
+    def decorator(execute):
+        @functools.wraps(execute)
+        async def wrapper(self, *args, **kwargs):
+            try:
+                return await execute(self, *args, **kwargs)
+            finally:
+                admission.release(self)
+
+        return wrapper
+
+    return decorator
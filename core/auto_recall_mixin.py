@@ -1,92 +1,63 @@
 import asyncio
-import time
-from typing import Any, Dict, Optional
+from typing import Any, Dict, Optional, Tuple
 
 from src.chat.utils.utils import parse_platform_accounts
 from src.common.logger import get_logger
-from src.config.config import global_config
+from src.config import config as host_config
+
+from . import runtime_stats
+from .message_id_resolver import resolver as message_resolver
+from .plugin_settings import PluginSettingsMixin
+from .recall_matching import AccountMapCache, extract_message_field, is_image_message
+from .recall_commands import selector as recall_selector
+from .recall_scheduler import scheduler as recall_scheduler
+from .tracing import current_span, traced
 
 recall_logger = get_logger("pic_auto_recall")
 
+# 消息时间早于发送时间的容差（秒）
+_TIMESTAMP_TOLERANCE = 0.2
+
+
+# 平台 -> 机器人账号映射，宿主配置重新加载时自动重建
+_bot_accounts = AccountMapCache(lambda: host_config.global_config, parse_platform_accounts)
+
 
 def _get_bot_account_for_platform(platform: str) -> str:
     """根据平台获取机器人自身账号"""
-    platform_key = (platform or "").strip().lower()
-    bot_config = getattr(global_config, "bot", None)
-    if not bot_config:
-        return ""
-
-    account_map_raw = parse_platform_accounts(getattr(bot_config, "platforms", []) or [])
-    account_map = {
-        k.strip().lower(): str(v).strip()
-        for k, v in account_map_raw.items()
-        if v
-    }
-
-    qq_account = str(getattr(bot_config, "qq_account", "") or "").strip()
-    if qq_account:
-        account_map.setdefault("qq", qq_account)
-
-    telegram_account = str(getattr(bot_config, "telegram_account", "") or "").strip()
-    if telegram_account:
-        account_map.setdefault("telegram", telegram_account)
-        account_map.setdefault("tg", telegram_account)
-
-    if platform_key in account_map:
-        return account_map[platform_key]
-
-    return qq_account
-
-
-def _extract_message_field(msg: Any, field: str):
-    """兼容 DatabaseMessages 与 dict 的字段访问"""
-    if isinstance(msg, dict):
-        return msg.get(field)
-    return getattr(msg, field, None)
-
-
-def _is_image_message(msg: Any) -> bool:
-    """判断消息是否为bot发送的图片"""
-    try:
-        if isinstance(msg, dict):
-            if msg.get("is_picid"):
-                return True
-            seg = msg.get("message_segment")
-            if isinstance(seg, dict):
-                seg_type = seg.get("type")
-                if seg_type in {"image", "imageurl"}:
-                    return True
-                if seg_type == "seglist":
-                    for child in seg.get("data") or []:
-                        if isinstance(child, dict) and child.get("type") in {"image", "imageurl"}:
-                            return True
-            for key in ("processed_plain_text", "display_message", "raw_message"):
-                text_val = msg.get(key)
-                if isinstance(text_val, str) and any(
-                    tag in text_val
-                    for tag in ("[图片", "[image", "[imageurl", "[picid", "picid:")
-                ):
-                    return True
-            return False
-
-        if getattr(msg, "is_picid", False):
-            return True
-        text_candidates = [
-            getattr(msg, "processed_plain_text", None),
-            getattr(msg, "display_message", None),
-            getattr(msg, "raw_message", None),
-        ]
-        for text in text_candidates:
-            if isinstance(text, str) and any(
-                tag in text for tag in ("[图片", "[image", "[imageurl", "[picid", "picid:")
-            ):
-                return True
-        return False
-    except Exception:
-        return False
-
-
-class AutoRecallMixin:
+    return _bot_accounts.get(platform)
+
+
+def poll_recent_image_messages(stream_id: str, limit: int = 5) -> int:
+    """兜底：查询一次最近消息，把其中的图片消息写入消息ID索引"""
+    from src.plugin_system import message_api
+
+    msgs = message_api.get_recent_messages(
+        chat_id=stream_id,
+        hours=0.05,
+        limit=limit,
+        limit_mode="latest",
+        filter_mai=False
+    ) or []
+    runtime_stats.incr("recall.id_queries")
+
+    for msg in msgs:
+        if not is_image_message(msg):
+            continue
+        message_id = extract_message_field(msg, "message_id")
+        if not message_id:
+            continue
+        msg_time = extract_message_field(msg, "time")
+        try:
+            msg_time_val = float(msg_time) if msg_time is not None else None
+        except (TypeError, ValueError):
+            msg_time_val = None
+        msg_user_id = str(extract_message_field(msg, "user_id") or "")
+        message_resolver.observe(stream_id, str(message_id), msg_time_val, msg_user_id)
+    return len(msgs)
+
+
+class AutoRecallMixin(PluginSettingsMixin):
     """提供自动撤回相关的通用方法"""
 
     def _get_recall_context(self) -> Dict[str, Any]:
@@ -134,6 +105,7 @@ class AutoRecallMixin:
             "chat_stream": getattr(self, "chat_stream", None),
         }
 
+    @traced("recall.schedule")
     async def _schedule_auto_recall(self, placeholder_message_id: Optional[str] = None):
         """计划自动撤回任务"""
         try:
@@ -154,59 +126,32 @@ class AutoRecallMixin:
                 recall_logger.debug(f"{self.log_prefix} 会话未启用自动撤回")
                 return
 
-            delay_seconds = self.get_config("auto_recall.delay_seconds", 5)
-            id_wait_seconds = max(0, self.get_config("auto_recall.id_wait_seconds", 15))
-            poll_interval = min(1.0, max(0.2, id_wait_seconds / 10)) if id_wait_seconds else 0
-
-            await asyncio.sleep(1.0)
-
-            message_id = await self._get_last_message_id()
-            if not message_id and placeholder_message_id:
-                recall_logger.debug(f"{self.log_prefix} 使用占位消息ID作为兜底: {placeholder_message_id}")
-                message_id = placeholder_message_id
-            if not message_id:
-                recall_logger.warning(f"{self.log_prefix} 未能获取消息ID，无法自动撤回")
+            stream_id, bot_account, send_timestamp = self._get_message_lookup_context()
+            if not stream_id:
+                recall_logger.warning(f"{self.log_prefix} 缺少聊天流ID，无法自动撤回")
                 return
 
-            recall_logger.info(f"{self.log_prefix} 计划在 {delay_seconds} 秒后撤回消息: {message_id}")
-            initial_message_id = message_id
-
-            async def _resolve_message_id(initial_id: Optional[str]) -> Optional[str]:
-                candidate = initial_id or placeholder_message_id
-                if not candidate:
-                    return None
-                if not candidate.startswith("send_api_"):
-                    return candidate
-                if id_wait_seconds <= 0:
-                    return candidate
-                deadline = time.monotonic() + id_wait_seconds
-                while time.monotonic() < deadline:
-                    refreshed_id = await self._get_last_message_id()
-                    if refreshed_id and not refreshed_id.startswith("send_api_"):
-                        recall_logger.debug(f"{self.log_prefix} 占位ID替换为正式ID: {refreshed_id}")
-                        return refreshed_id
-                    await asyncio.sleep(poll_interval or 0.5)
-                recall_logger.debug(f"{self.log_prefix} 在限定时间内未获取正式ID，继续使用占位ID")
-                return candidate
-
-            async def _delayed_recall():
-                await asyncio.sleep(delay_seconds)
-                target_message_id = await _resolve_message_id(initial_message_id)
-                if not target_message_id:
-                    recall_logger.warning(f"{self.log_prefix} 撤回失败：缺少消息ID")
-                    return
-                try:
-                    success = await self._try_recall_message(target_message_id)
-                    if success:
-                        recall_logger.info(f"{self.log_prefix} 消息 {target_message_id} 已成功撤回")
-                    else:
-                        recall_logger.warning(f"{self.log_prefix} 消息 {target_message_id} 撤回失败")
-                except Exception as exc:
-                    recall_logger.error(f"{self.log_prefix} 撤回消息时出错: {exc!r}")
-
-            task = asyncio.create_task(_delayed_recall())
-            if hasattr(self, "plugin") and hasattr(self.plugin, "_track_task"):
-                self.plugin._track_task(task)
+            settings = self.settings.auto_recall
+            delay_seconds = settings.delay_seconds
+
+            # 只等待消息事件，未命中时留到撤回前与同一聊天的其他撤回合并解析
+            message_id = await self._get_last_message_id() or placeholder_message_id
+            current_span().set(delay_seconds=delay_seconds, resolved=bool(message_id) and message_id != placeholder_message_id)
+
+            recall_scheduler.configure(
+                settings.max_concurrent_recalls,
+                settings.id_wait_seconds,
+                settings.batch_window_seconds,
+                settings.poll_fallback_attempts,
+            )
+            recall_selector.configure(settings.command_fallback_after)
+            recall_scheduler.schedule(
+                stream_id, message_id, delay_seconds, platform, send_timestamp, bot_account, self.log_prefix
+            )
+            recall_logger.info(
+                f"{self.log_prefix} 计划在 {delay_seconds} 秒后撤回消息: {message_id or '（撤回前解析）'}"
+                f"（待撤回 {recall_scheduler.pending_count} 条）"
+            )
         except Exception as exc:
             recall_logger.error(f"{self.log_prefix} 计划自动撤回失败: {exc!r}")
 
@@ -214,102 +159,37 @@ class AutoRecallMixin:
         """由子类实现，用于判断当前会话是否启用了自动撤回"""
         raise NotImplementedError
 
+    def _get_message_lookup_context(self) -> Tuple[Optional[str], str, Optional[float]]:
+        """返回解析消息ID所需的 (stream_id, 机器人账号, 发送时间)"""
+        context = self._get_recall_context()
+        chat_stream = context.get("chat_stream")
+        stream_id = getattr(chat_stream, "stream_id", None) if chat_stream else None
+        platform = context.get("platform", "") or ""
+        bot_account = _get_bot_account_for_platform(platform)
+        send_timestamp = getattr(self, "_last_send_timestamp", None)
+        return (str(stream_id) if stream_id else None), bot_account, send_timestamp
+
     async def _get_last_message_id(self) -> Optional[str]:
-        """获取最后发送的消息ID"""
-        try:
-            recall_logger.info(f"{self.log_prefix} 【调试】开始获取消息ID")
+        """
+        等待消息事件提供本次发送的图片消息ID
 
-            context = self._get_recall_context()
-            chat_stream = context.get("chat_stream")
-            stream_id = getattr(chat_stream, "stream_id", None) if chat_stream else None
+        未命中时返回 None，由撤回调度器在撤回前与同一聊天的其他撤回合并解析。
+        """
+        try:
+            stream_id, bot_account, send_timestamp = self._get_message_lookup_context()
             if not stream_id:
                 recall_logger.info(f"{self.log_prefix} 【调试】无法获取stream_id")
                 return None
 
-            platform = context.get("platform", "") or ""
-            bot_account = _get_bot_account_for_platform(platform)
-            send_timestamp = getattr(self, "_last_send_timestamp", None)
-            timestamp_tolerance = 0.2
-
-            from src.plugin_system import message_api
-
-            max_attempts = 5
-            placeholder_id: Optional[str] = None
-
-            for attempt in range(max_attempts):
-                msgs = message_api.get_recent_messages(
-                    chat_id=str(stream_id),
-                    hours=0.05,
-                    limit=5,
-                    limit_mode="latest",
-                    filter_mai=False
-                ) or []
-                recall_logger.debug(f"{self.log_prefix} 【调试】尝试{attempt + 1}/{max_attempts}，获取到 {len(msgs)} 条消息")
-
-                for msg in reversed(msgs):
-                    if not _is_image_message(msg):
-                        continue
-
-                    message_id = _extract_message_field(msg, "message_id")
-                    if not message_id:
-                        continue
-                    message_id = str(message_id)
-
-                    msg_user_id = str(_extract_message_field(msg, "user_id") or "")
-                    msg_time = _extract_message_field(msg, "time")
-                    try:
-                        msg_time_val = float(msg_time) if msg_time is not None else None
-                    except (TypeError, ValueError):
-                        msg_time_val = None
-
-                    if send_timestamp and msg_time_val is not None:
-                        if msg_time_val + timestamp_tolerance < send_timestamp:
-                            continue
-
-                    if bot_account and msg_user_id and msg_user_id != bot_account:
-                        continue
-
-                    if not message_id.startswith("send_api_"):
-                        recall_logger.info(f"{self.log_prefix} 【调试】命中消息ID: {message_id}")
-                        return message_id
-
-                    placeholder_id = message_id
-
-                if attempt < max_attempts - 1:
-                    await asyncio.sleep(0.4)
-
-            if placeholder_id:
-                recall_logger.warning(f"{self.log_prefix} 未获取到正式ID，使用占位ID: {placeholder_id}")
-                return placeholder_id
-
-            recall_logger.warning(f"{self.log_prefix} 所有方法都未能获取消息ID")
-            return None
+            event_wait = max(0.0, self.settings.auto_recall.event_wait_seconds)
+            message_id = await message_resolver.wait_for(
+                stream_id, send_timestamp, bot_account, timeout=event_wait, tolerance=_TIMESTAMP_TOLERANCE
+            )
+            if message_id:
+                message_resolver.claim(stream_id, message_id)
+                runtime_stats.incr("recall.id_from_event")
+                recall_logger.info(f"{self.log_prefix} 【调试】消息事件命中消息ID: {message_id}")
+            return message_id
         except Exception as exc:
             recall_logger.error(f"{self.log_prefix} 获取消息ID失败: {exc!r}")
             return None
-
-    async def _try_recall_message(self, message_id: str) -> bool:
-        """尝试撤回消息"""
-        try:
-            delete_commands = ["DELETE_MSG", "delete_msg", "RECALL_MSG", "recall_msg"]
-            for cmd in delete_commands:
-                try:
-                    result = await self.send_command(
-                        cmd,
-                        {"message_id": str(message_id)},
-                        display_message="",
-                        storage_message=False
-                    )
-                    if isinstance(result, bool) and result:
-                        return True
-                    if isinstance(result, dict):
-                        status = str(result.get("status", "")).lower()
-                        if status in ("ok", "success") or result.get("retcode") == 0:
-                            return True
-                except Exception as exc:
-                    recall_logger.debug(f"{self.log_prefix} 尝试命令 {cmd} 失败: {exc!r}")
-                    continue
-            return False
-        except Exception as exc:
-            recall_logger.error(f"{self.log_prefix} 撤回消息异常: {exc!r}")
-            return False
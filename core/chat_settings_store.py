@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+会话设置持久化：SQLite（WAL 模式）中每个会话一行，设置以 JSON 保存
+
+本模块只依赖标准库，不引用宿主程序的任何模块；写入由调用方在后台线程中批量执行。
+"""
+import json
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterable, Iterator, Optional, Tuple
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS chat_settings (
+    platform   TEXT NOT NULL,
+    chat_id    TEXT NOT NULL,
+    data       TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (platform, chat_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_chat_settings_updated_at ON chat_settings (updated_at);
+"""
+
+_UPSERT = (
+    "INSERT INTO chat_settings (platform, chat_id, data, updated_at) VALUES (?, ?, ?, ?) "
+    "ON CONFLICT(platform, chat_id) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at"
+)
+_DELETE = "DELETE FROM chat_settings WHERE platform = ? AND chat_id = ?"
+
+
+class ChatSettingsStore:
+    """会话设置的 SQLite 存储，单连接，内部加锁以便在线程池中使用"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+
+    def load_recent(self, limit: Optional[int] = None) -> Iterator[Tuple[str, str, Dict[str, Any]]]:
+        """按最近修改时间倒序读取会话设置，用于启动时批量载入"""
+        sql = "SELECT platform, chat_id, data FROM chat_settings ORDER BY updated_at DESC"
+        params: Tuple = ()
+        if limit is not None:
+            sql += " LIMIT ?"
+            params = (int(limit),)
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        loads = json.loads
+        for platform, chat_id, data in rows:
+            yield platform, chat_id, loads(data)
+
+    def get(self, platform: str, chat_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data FROM chat_settings WHERE platform = ? AND chat_id = ?", (platform, chat_id)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def write_many(self, entries: Iterable[Tuple[str, str, Optional[Dict[str, Any]]]]) -> int:
+        """在一个事务中写入多条设置；data 为空时删除该会话的记录"""
+        now = time.time()
+        upserts = []
+        deletes = []
+        for platform, chat_id, data in entries:
+            if data:
+                upserts.append((platform, chat_id, json.dumps(data, ensure_ascii=False, separators=(",", ":")), now))
+            else:
+                deletes.append((platform, chat_id))
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                if upserts:
+                    self._conn.executemany(_UPSERT, upserts)
+                if deletes:
+                    self._conn.executemany(_DELETE, deletes)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return len(upserts) + len(deletes)
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM chat_settings").fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
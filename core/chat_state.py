@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+"""
+会话状态注册表：集中保存每个会话的运行时设置
+
+取代原先分散在各命令类上的多个类级字典（管理员模式、模型/画师串/尺寸选择、
+自动撤回开关、最近草图）。每个会话对应一条 __slots__ 记录，按 (platform, chat_id)
+元组索引，一次查找即可取得全部设置；长期不活跃的会话按 LRU / 空闲时长淘汰。
+
+挂接持久化存储后，启动时批量载入最近使用的会话，读取始终走内存；
+内存中没有的会话在首次访问时从存储补载。设置变更先记入待写集合，
+由后台任务定期合并写入，命令处理不等待磁盘。
+"""
+import asyncio
+import itertools
+import sys
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from src.common.logger import get_logger
+
+from . import runtime_stats
+
+logger = get_logger("nai_pic_plugin")
+
+# 会话设置字段；值为 None 表示使用配置文件中的默认值
+SETTING_FIELDS = ("admin_mode", "model", "artist_preset", "size", "recall_enabled", "degrade_exempt")
+
+# 全部会话共用的版本号序列：会话被淘汰后重建的记录不会与旧记录的版本号重复
+_versions = itertools.count(1)
+
+
+class ChatState:
+    """单个会话的运行时设置"""
+
+    __slots__ = ("key", "admin_mode", "model", "artist_preset", "size", "recall_enabled", "degrade_exempt",
+                 "draft_prompt", "draft_seed", "version", "last_access")
+
+    def __init__(self, key: str):
+        self.key = key
+        self.admin_mode: Optional[bool] = None
+        self.model: Optional[str] = None
+        self.artist_preset: Optional[int] = None
+        self.size: Optional[str] = None
+        self.recall_enabled: Optional[bool] = None
+        self.degrade_exempt: Optional[bool] = None
+        self.draft_prompt: Optional[str] = None
+        self.draft_seed: Optional[int] = None
+        # 设置每次变化时取新的版本号，供缓存判断是否失效
+        self.version = next(_versions)
+        self.last_access = time.monotonic()
+
+    def update(self, **settings: Any) -> None:
+        """修改会话设置并更新版本号"""
+        for name, value in settings.items():
+            if name not in SETTING_FIELDS:
+                raise AttributeError(f"未知的会话设置: {name}")
+            setattr(self, name, value)
+        self.version = next(_versions)
+
+    def settings(self) -> Dict[str, Any]:
+        """返回已设置（非默认）的会话设置"""
+        return {name: getattr(self, name) for name in SETTING_FIELDS if getattr(self, name) is not None}
+
+
+class ChatStateRegistry:
+    """按 LRU 顺序保存会话状态，超出数量上限或空闲过久的会话被淘汰"""
+
+    def __init__(self, max_chats: int = 10000, idle_ttl_seconds: float = 7 * 24 * 3600):
+        self.max_chats = max(1, max_chats)
+        self.idle_ttl_seconds = idle_ttl_seconds
+        self._states: "OrderedDict[Tuple[str, str], ChatState]" = OrderedDict()
+        self.evicted = 0
+        self._store = None
+        self.flush_interval = 1.0
+        # 尚未写入存储的设置：(platform, chat_id) -> 设置快照（None 表示删除）
+        self._dirty: Dict[Tuple[str, str], Optional[Dict[str, Any]]] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+
+    def configure(self, max_chats: int, idle_ttl_seconds: float) -> None:
+        self.max_chats = max(1, int(max_chats or 1))
+        self.idle_ttl_seconds = max(0.0, float(idle_ttl_seconds))
+
+    def attach_store(self, store, flush_interval: float = 1.0) -> int:
+        """挂接持久化存储，并批量载入最近使用的会话（不超过 max_chats），返回载入数量"""
+        self._store = store
+        self.flush_interval = max(0.1, float(flush_interval))
+        loaded = 0
+        for platform, chat_id, data in store.load_recent(self.max_chats):
+            key = (sys.intern(platform), sys.intern(chat_id))
+            if key in self._states:
+                continue
+            state = ChatState(sys.intern(f"{platform}:{chat_id}"))
+            self._apply_settings(state, data)
+            # 查询结果按最近修改倒序，插入到队首以保持 LRU 顺序
+            self._states[key] = state
+            self._states.move_to_end(key, last=False)
+            loaded += 1
+        runtime_stats.set_gauge("chat_state.count", len(self._states))
+        return loaded
+
+    def get(self, platform: str, chat_id: str) -> Optional[ChatState]:
+        """
+        查找会话状态
+
+        未挂载存储时只查内存，不存在返回 None 且不创建记录；挂载存储时未命中会在
+        当前线程同步查询 sqlite，并把结果（没有设置时为空记录）插入注册表后返回。
+        """
+        key = (platform or "", str(chat_id))
+        state = self._states.get(key)
+        if state is not None:
+            self._touch(state, key)
+            return state
+        if self._store is not None:
+            # 同时缓存“无设置”的结果，避免重复查询存储
+            return self._load_missing(key)
+        return None
+
+    def get_or_create(self, platform: str, chat_id: str) -> ChatState:
+        """查找会话状态，不存在时创建"""
+        key = (platform or "", str(chat_id))
+        state = self._states.get(key)
+        if state is not None:
+            self._touch(state, key)
+            return state
+
+        if self._store is not None:
+            return self._load_missing(key)
+        return self._insert(key)
+
+    def update(self, state: ChatState, **settings: Any) -> None:
+        """修改会话设置，并安排写入持久化存储"""
+        state.update(**settings)
+        if self._store is None:
+            return
+        platform, _, chat_id = state.key.partition(":")
+        self._dirty[(platform, chat_id)] = state.settings() or None
+        self._ensure_flush_task()
+
+    async def flush(self) -> int:
+        """把待写设置合并写入存储，返回写入条数"""
+        if self._store is None or not self._dirty:
+            return 0
+        batch, self._dirty = self._dirty, {}
+        entries = [(platform, chat_id, data) for (platform, chat_id), data in batch.items()]
+        try:
+            written = await asyncio.to_thread(self._store.write_many, entries)
+        except Exception as exc:
+            # 写入失败时放回待写集合（期间又有修改的以新值为准）
+            for key, data in batch.items():
+                self._dirty.setdefault(key, data)
+            logger.warning(f"[ChatState] 会话设置写入失败，将稍后重试: {exc!r}")
+            return 0
+        runtime_stats.incr("chat_state.flushed", written)
+        return written
+
+    def flush_sync(self) -> int:
+        """同步写入全部待写设置，用于停止插件时"""
+        if self._store is None or not self._dirty:
+            return 0
+        batch, self._dirty = self._dirty, {}
+        return self._store.write_many(
+            (platform, chat_id, data) for (platform, chat_id), data in batch.items()
+        )
+
+    def close(self) -> int:
+        """停止后台写入，同步写入剩余设置并关闭存储，返回写入条数；之后的设置只保存在内存中"""
+        if self._flush_task is not None and not self._flush_task.done():
+            self._flush_task.cancel()
+        self._flush_task = None
+        if self._store is None:
+            return 0
+        try:
+            return self.flush_sync()
+        finally:
+            self._store.close()
+            self._store = None
+
+    def _ensure_flush_task(self) -> None:
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.get_running_loop().create_task(self._flush_loop())
+
+    async def _flush_loop(self) -> None:
+        while self._dirty:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    def _load_missing(self, key: Tuple[str, str]) -> ChatState:
+        if key in self._dirty:
+            data = self._dirty[key]
+        else:
+            try:
+                data = self._store.get(*key)
+            except Exception as exc:
+                logger.warning(f"[ChatState] 读取会话设置失败: {exc!r}")
+                data = None
+            runtime_stats.incr("chat_state.store_reads")
+        state = self._insert(key)
+        if data:
+            self._apply_settings(state, data)
+        return state
+
+    def _insert(self, key: Tuple[str, str]) -> ChatState:
+        platform = sys.intern(key[0])
+        chat_id = sys.intern(key[1])
+        state = ChatState(sys.intern(f"{platform}:{chat_id}"))
+        self._states[(platform, chat_id)] = state
+        self._evict()
+        runtime_stats.set_gauge("chat_state.count", len(self._states))
+        return state
+
+    @staticmethod
+    def _apply_settings(state: ChatState, data: Dict[str, Any]) -> None:
+        for name in SETTING_FIELDS:
+            if name in data:
+                setattr(state, name, data[name])
+
+    def __len__(self) -> int:
+        return len(self._states)
+
+    def memory_report(self) -> Dict[str, Any]:
+        """估算注册表占用的内存（记录、键与字典本身）"""
+        total = sys.getsizeof(self._states)
+        for key, state in self._states.items():
+            total += sys.getsizeof(key) + sum(sys.getsizeof(part) for part in key)
+            total += sys.getsizeof(state)
+            for name in ChatState.__slots__:
+                value = getattr(state, name)
+                if isinstance(value, str) and name != "key":
+                    total += sys.getsizeof(value)
+        count = len(self._states)
+        return {
+            "chats": count,
+            "bytes": total,
+            "bytes_per_chat": total / count if count else 0.0,
+            "evicted": self.evicted,
+            "max_chats": self.max_chats,
+            "idle_ttl_seconds": self.idle_ttl_seconds,
+        }
+
+    def _touch(self, state: ChatState, key: Tuple[str, str]) -> None:
+        state.last_access = time.monotonic()
+        self._states.move_to_end(key)
+
+    def _evict(self) -> None:
+        states = self._states
+        while len(states) > self.max_chats:
+            self._evict_oldest("超出会话数上限")
+
+        if self.idle_ttl_seconds > 0:
+            expire_before = time.monotonic() - self.idle_ttl_seconds
+            while states:
+                oldest = next(iter(states.values()))
+                if oldest.last_access >= expire_before:
+                    break
+                self._evict_oldest("空闲超时")
+
+    def _evict_oldest(self, reason: str) -> None:
+        _, state = self._states.popitem(last=False)
+        self.evicted += 1
+        # 没有持久化存储时淘汰即丢失设置，记录下来便于排查“设置被重置”
+        if self._store is None:
+            settings = state.settings()
+            if settings:
+                runtime_stats.incr("chat_state.settings_lost")
+                logger.info(f"[ChatState] 会话 {state.key} 因{reason}被淘汰，未持久化的设置已恢复默认: {settings}")
+
+
+# 进程内共享的会话状态注册表
+chat_states = ChatStateRegistry()
+
+STORE_FILENAME = "chat_settings.db"
+
+
+def attach_default_store(flush_interval: float = 1.0) -> None:
+    """为共享注册表挂接 data/chat_settings.db，重复调用时忽略"""
+    if chat_states._store is not None:
+        return
+    from .chat_settings_store import ChatSettingsStore
+    from .storage_paths import data_path
+
+    started = time.perf_counter()
+    try:
+        store = ChatSettingsStore(data_path(STORE_FILENAME, create_dir=True))
+        loaded = chat_states.attach_store(store, flush_interval)
+    except Exception as exc:
+        logger.warning(f"[ChatState] 会话设置存储不可用，设置仅保存在内存中: {exc!r}")
+        return
+    logger.info(f"[ChatState] 已载入 {loaded} 个会话的设置，耗时 {(time.perf_counter() - started) * 1000:.1f}ms")
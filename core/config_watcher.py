@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+"""
+配置热重载：监视插件的 config.toml，变化后重新编译并原子替换生效配置
+
+文件解析或编译失败时保留原配置；替换成功后作废合并配置缓存、退役不再使用的
+base_url 对应的 HTTP 会话、更新会话注册表的容量设置，并在日志中列出变化的配置项
+（api_key 等敏感项只显示“已修改”）。进行中的生成与撤回继续使用它们已取得的配置。
+"""
+import asyncio
+import os
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+
+from src.common.logger import get_logger
+
+from .chat_state import chat_states
+from .model_config_cache import model_config_cache
+from .plugin_settings import PluginSettings, plugin_settings
+
+try:
+    import tomllib as _toml
+except ImportError:  # Python < 3.11
+    import toml as _toml
+
+logger = get_logger("nai_pic_plugin")
+
+_SENSITIVE_MARKERS = ("api_key", "token", "secret", "password")
+_MISSING = object()
+
+
+def is_sensitive_key(key: str) -> bool:
+    """按配置项名（点分键的最后一段）判断是否为密钥类配置"""
+    name = key.rsplit(".", 1)[-1].lower()
+    return any(name == marker or name.endswith(f"_{marker}") for marker in _SENSITIVE_MARKERS)
+
+
+def _flatten(config: Mapping[str, Any], prefix: str = "") -> Dict[str, Any]:
+    flat = {}
+    for key, value in config.items():
+        path = f"{prefix}{key}"
+        if isinstance(value, Mapping):
+            flat.update(_flatten(value, f"{path}."))
+        else:
+            flat[path] = value
+    return flat
+
+
+def _describe(value: Any) -> str:
+    if value is _MISSING:
+        return "（无）"
+    text = repr(value)
+    return text if len(text) <= 80 else f"{text[:77]}..."
+
+
+def diff_config(old: Mapping[str, Any], new: Mapping[str, Any]) -> List[str]:
+    """列出两份原始配置之间变化的配置项，敏感项不显示具体值"""
+    old_flat = _flatten(old)
+    new_flat = _flatten(new)
+    changes = []
+    for key in sorted(old_flat.keys() | new_flat.keys()):
+        before = old_flat.get(key, _MISSING)
+        after = new_flat.get(key, _MISSING)
+        if before == after:
+            continue
+        if is_sensitive_key(key):
+            changes.append(f"{key}: 已修改")
+        else:
+            changes.append(f"{key}: {_describe(before)} -> {_describe(after)}")
+    return changes
+
+
+def _base_urls(settings: PluginSettings) -> List[str]:
+    """生效配置可能使用的全部 base_url（版本配置节可以覆盖基础配置）"""
+    urls = [settings.model.get("base_url", "")]
+    urls.extend(version.config["base_url"] for version in settings.versions.values() if "base_url" in version.config)
+    return urls
+
+
+class ConfigWatcher:
+    """轮询配置文件的修改时间与大小，变化时重新加载"""
+
+    def __init__(self):
+        self.plugin = None
+        self.path: Optional[str] = None
+        self.reloads = 0
+        self.failures = 0
+        self._signature: Optional[Tuple[int, int]] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def attach(self, plugin) -> None:
+        """记录插件实例与配置文件路径，以当前文件状态为基准"""
+        self.plugin = plugin
+        plugin_dir = getattr(plugin, "plugin_dir", None) or os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        self.path = os.path.join(plugin_dir, getattr(plugin, "config_file_name", "config.toml"))
+        self._signature = self._stat()
+
+    def ensure_started(self) -> None:
+        """启动轮询协程；需在事件循环中调用，可重复调用"""
+        settings = plugin_settings.current
+        if self.plugin is None or settings is None or not settings.config_reload.enabled:
+            return
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+            logger.info(f"[ConfigWatcher] 已开始监视配置文件: {self.path}")
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def _stat(self) -> Optional[Tuple[int, int]]:
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    async def _run(self) -> None:
+        while True:
+            settings = plugin_settings.current
+            interval = settings.config_reload.poll_interval_seconds if settings is not None else 2.0
+            await asyncio.sleep(max(0.5, interval))
+            if settings is not None and not settings.config_reload.enabled:
+                continue
+            signature = self._stat()
+            if signature is None or signature == self._signature:
+                continue
+            self._signature = signature
+            try:
+                await self.reload()
+            except Exception as exc:
+                self.failures += 1
+                logger.error(f"[ConfigWatcher] 重新加载配置失败，继续使用原配置: {exc!r}")
+
+    async def reload(self) -> bool:
+        """读取并编译配置文件，成功后替换生效配置；返回是否发生了替换"""
+        text = await asyncio.to_thread(self._read)
+        try:
+            new_config = _toml.loads(text)
+        except Exception as exc:
+            self.failures += 1
+            logger.error(f"[ConfigWatcher] 配置文件解析失败，继续使用原配置: {exc}")
+            return False
+
+        old_settings = plugin_settings.current
+        old_config = old_settings.source if old_settings is not None else {}
+        changes = diff_config(old_config, new_config)
+        if not changes:
+            return False
+
+        # 先完整编译，再一次性替换
+        settings = plugin_settings.compile(new_config)
+        for warning in settings.warnings:
+            logger.warning(f"[ConfigWatcher] 配置问题: {warning}")
+        self.plugin.config = new_config
+        plugin_settings.swap(settings)
+        self._apply(settings)
+        self.reloads += 1
+
+        logger.info(f"[ConfigWatcher] 配置已重新加载，{len(changes)} 项变化:\n  " + "\n  ".join(changes))
+        return True
+
+    def _read(self) -> str:
+        with open(self.path, "r", encoding="utf-8") as fh:
+            return fh.read()
+
+    @staticmethod
+    def _apply(settings: PluginSettings) -> None:
+        """重建依赖配置的缓存与连接池"""
+        model_config_cache.invalidate_all()
+        chat_states.configure(settings.chat_state.max_chats, settings.chat_state.idle_ttl_seconds)
+
+        from .nai_web_client import retire_sessions
+
+        retired = retire_sessions(_base_urls(settings))
+        if retired:
+            logger.info(f"[ConfigWatcher] 已退役不再使用的上游连接池: {', '.join(retired)}")
+
+
+# 进程内共享的配置监视器
+config_watcher = ConfigWatcher()
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+负载降级：上游排队较深或耗时较高时降低推理步数与图片尺寸，负载回落后自动恢复完整质量
+
+负载程度取 0~1：排队深度（每个并发槽平均等待的调用数）与上游耗时 EWMA 分别在
+[开始, 最大] 区间内线性映射，取两者中的较大值。步数与尺寸（边长比例）按负载程度在
+完整值与模型配置节中的下限（degrade_min_steps / degrade_min_scale）之间插值，
+未配置下限的维度不降级。高清重绘与管理员豁免的会话（/nai degrade off）始终使用完整质量。
+降级后的配置带有 degrade_level，上游调用据此计入指标历史的降级出图数。
+"""
+import time
+from typing import Any, Dict, Mapping, Optional
+
+from src.common.logger import get_logger
+
+from . import runtime_stats
+from .chat_state import chat_states
+from .image_ops import parse_size
+from .plugin_settings import SIZE_MAPPINGS, DegradationSettings, plugin_settings
+from .tracing import current_span
+from .upstream_limiter import UpstreamLimiter, find_upstream_limiter
+
+logger = get_logger("nai_pic_plugin")
+
+# 上游空闲超过该时间后耗时 EWMA 视为过期，不再作为负载依据
+_LATENCY_STALE_SECONDS = 300.0
+# 降级后的宽高取该值的整数倍
+_SIZE_STEP = 64
+
+
+def _ramp(value: float, start: float, full: float) -> float:
+    if full <= start:
+        return 1.0 if value >= start else 0.0
+    return min(1.0, max(0.0, (value - start) / (full - start)))
+
+
+def load_level(settings: DegradationSettings, limiter: Optional[UpstreamLimiter]) -> float:
+    """返回上游当前的负载程度（0 为完整质量，1 为降到下限）"""
+    if limiter is None:
+        return 0.0
+    level = _ramp(limiter.waiting / max(1, limiter.limit), settings.queue_start, settings.queue_full)
+    latency = limiter.latency_ewma
+    if latency is not None and time.monotonic() - limiter.last_observed < _LATENCY_STALE_SECONDS:
+        level = max(level, _ramp(latency, settings.latency_start_seconds, settings.latency_full_seconds))
+    return level
+
+
+def _scaled_size(size: str, scale: float) -> Optional[str]:
+    parsed = parse_size(SIZE_MAPPINGS.get(size, size))
+    if parsed is None:
+        return None
+    width, height = (max(_SIZE_STEP, int(side * scale) // _SIZE_STEP * _SIZE_STEP) for side in parsed)
+    return f"{width}x{height}"
+
+
+class DegradationPolicy:
+    """按上游负载为本次生成调整模型配置"""
+
+    @property
+    def settings(self) -> Optional[DegradationSettings]:
+        current = plugin_settings.current
+        return current.degradation if current is not None else None
+
+    @staticmethod
+    def is_exempt(platform: str, chat_id: str) -> bool:
+        chat_state = chat_states.get(platform, chat_id) if platform and chat_id else None
+        return chat_state is not None and bool(chat_state.degrade_exempt)
+
+    def current_level(self) -> float:
+        settings = self.settings
+        current = plugin_settings.current
+        if settings is None or current is None or not settings.enabled:
+            return 0.0
+        return load_level(settings, find_upstream_limiter(str(current.model.get("base_url") or "")))
+
+    def apply(self, component: Any, model_config: Mapping[str, Any], size: Optional[str] = None) -> Mapping[str, Any]:
+        """
+        返回本次生成使用的模型配置；不降级时原样返回
+
+        降级时返回副本：num_inference_steps 为降级后的步数，nai_size 为降级后的尺寸
+        （以 size 或配置中的尺寸为基准），degrade_level 为负载程度。
+        """
+        level = self.current_level()
+        if level <= 0:
+            return model_config
+        platform, chat_id, _ = component._get_chat_identity()
+        if self.is_exempt(platform, chat_id):
+            return model_config
+
+        degraded: Dict[str, Any] = dict(model_config)
+        changes = []
+        steps, min_steps = model_config.get("num_inference_steps"), model_config.get("degrade_min_steps")
+        if isinstance(steps, int) and isinstance(min_steps, int) and 0 < min_steps < steps:
+            reduced = round(steps - level * (steps - min_steps))
+            if reduced < steps:
+                degraded["num_inference_steps"] = reduced
+                changes.append(f"步数 {steps}->{reduced}")
+
+        base_size = size or model_config.get("nai_size") or model_config.get("default_size", "")
+        min_scale = model_config.get("degrade_min_scale")
+        scaled = None
+        if base_size and isinstance(min_scale, (int, float)) and 0 < min_scale < 1:
+            scaled = _scaled_size(base_size, 1 - level * (1 - min_scale))
+            if scaled == SIZE_MAPPINGS.get(base_size, base_size):
+                scaled = None
+            elif scaled is not None:
+                changes.append(f"尺寸 {base_size}->{scaled}")
+
+        if not changes:
+            return model_config
+        # 调用方按 nai_size 请求上游，未降尺寸时也带上基准尺寸
+        if base_size:
+            degraded["nai_size"] = scaled or base_size
+        degraded["degrade_level"] = round(level, 2)
+        current_span().set(degrade_level=degraded["degrade_level"])
+        runtime_stats.incr("degradation.applied")
+        logger.info(f"{component.log_prefix} 负载 {level:.2f}，降级生成：{'，'.join(changes)}")
+        return degraded
+
+
+# 进程内共享的降级策略
+degradation = DegradationPolicy()
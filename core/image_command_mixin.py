@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+"""
+生图命令混入：统一 /nai 与 /nai0 的生成、发送及草图记录逻辑
+"""
+import asyncio
+import base64
+import random
+import re
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from src.common.logger import get_logger
+
+from . import runtime_stats
+from .admission import admission
+from .chat_state import chat_states
+from .image_ops import compose_grid
+from .image_pipeline_mixin import ImagePipelineMixin
+from .image_url_helper import save_base64_image_to_file
+from .quota import quota_manager
+from .tracing import span
+
+logger = get_logger("nai_pic_plugin")
+
+MAX_SEED = 2 ** 32 - 1
+
+# /nai fast <描述>、/nai x4 <描述> 等前缀
+FAST_PREFIX_PATTERN = re.compile(r"^fast\s+(?P<rest>.+)$", re.IGNORECASE | re.DOTALL)
+BATCH_PREFIX_PATTERN = re.compile(r"^x(?P<count>\d{1,2})\s+(?P<rest>.+)$", re.IGNORECASE | re.DOTALL)
+
+_BASE64_IMAGE_PREFIXES = ("iVBORw", "/9j/", "UklGR", "R0lGOD")
+
+
+class ImageCommandMixin(ImagePipelineMixin):
+    """为生图命令提供统一的生成与发送流程"""
+
+    async def _parse_batch_prefix(self, text: str) -> Tuple[int, str]:
+        """解析 x<N> 批量前缀，返回 (张数, 剩余文本)
+
+        x0 与 x1 按单张处理；超过 batch.max_count 时截断并提示用户，
+        需在准入与配额检查之前调用，保证按实际生成的张数计费。
+        """
+        batch_match = BATCH_PREFIX_PATTERN.match(text)
+        if not batch_match:
+            return 1, text
+        count = max(1, int(batch_match.group("count")))
+        max_count = max(1, self.settings.batch.max_count)
+        if count > max_count:
+            logger.info(f"{self.log_prefix} 批量数量 {count} 超过上限，调整为 {max_count}")
+            await self.send_text(f"单次最多生成 {max_count} 张，已调整为 {max_count} 张", storage_message=False)
+            count = max_count
+        return count, batch_match.group("rest").strip()
+
+    async def _check_admission_and_quota(self, entry: str, cost: int) -> Optional[str]:
+        """上游排队过长或超出配额时回复用户并返回失败原因，通过时返回 None"""
+        admission_message = admission.admit(self, entry, cost)
+        if admission_message:
+            await self.send_text(admission_message, storage_message=False)
+            return "排队过长"
+
+        # 配额检查放在获取模型配置之前，超限的请求不产生上游开销
+        quota_message = quota_manager.check_component(self, cost)
+        if quota_message:
+            await self.send_text(quota_message, storage_message=False)
+            return "超出配额"
+        return None
+
+    async def _generate_and_send(self, prompt: str, model_config: Dict[str, Any],
+                                 draft_mode: bool) -> Tuple[bool, Optional[str], bool]:
+        """调用接口生成图片并发送，草图模式下记录草图以便重绘"""
+        # 获取图片尺寸
+        image_size = model_config.get("nai_size") or model_config.get("default_size", "1024x1280")
+
+        # 草图本身就是小图，不做本地放大
+        upscale_target = None
+        if not draft_mode:
+            image_size, upscale_target = self._resolve_upscale_plan(image_size)
+            if upscale_target:
+                model_config = dict(model_config)
+                model_config["nai_size"] = image_size
+
+        # 显示处理信息
+        enable_debug = self.settings.components.enable_debug_info
+        if enable_debug:
+            await self.send_text(f"正在生成图片，请稍候...")
+
+        try:
+            # 调用 API 生成图片
+            success, result = await self.api_client.generate_image_async(
+                prompt=prompt,
+                model_config=model_config,
+                size=image_size
+            )
+        except Exception as e:
+            logger.error(f"{self.log_prefix} 图片生成失败: {e!r}", exc_info=True)
+            await self.send_text(f"生成图片时出错: {str(e)[:100]}")
+            return False, f"生成失败: {e}", True
+
+        if not success:
+            await self.send_text(f"生成图片失败：{result}")
+            return False, f"生成失败: {result}", True
+
+        final_image_data = self._process_api_response(result)
+        if not final_image_data:
+            await self.send_text("API 返回了无效的数据")
+            return False, "数据格式错误", True
+
+        failure = await self._send_image_data(final_image_data, upscale_target)
+        if failure:
+            return False, failure, True
+
+        self._record_first_image(draft_mode)
+        if draft_mode:
+            platform, chat_id, _ = self._get_chat_identity()
+            self.remember_draft(platform, chat_id, prompt, model_config["seed"])
+            await self.send_text("🖼️ 草图已生成，使用 /nai refine 以相同提示词和种子生成高清版")
+        elif enable_debug:
+            await self.send_text("图片生成完成！")
+        await self._schedule_auto_recall()
+        return True, "图片生成成功", True
+
+    async def _generate_batch_and_send(self, prompt: str, model_config: Dict[str, Any],
+                                       count: int) -> Tuple[bool, Optional[str], bool]:
+        """并发生成多张不同种子的变体，拼接为一张网格图发送，count 须已由 _parse_batch_prefix 截断"""
+        image_size = model_config.get("nai_size") or model_config.get("default_size", "1024x1280")
+        enable_debug = self.settings.components.enable_debug_info
+        if enable_debug:
+            await self.send_text(f"正在批量生成 {count} 张图片，请稍候...")
+
+        base_seed = model_config.get("seed") or random.randint(1, MAX_SEED - count)
+
+        async def _run_variant(index: int) -> Tuple[bool, str, float]:
+            variant_config = dict(model_config)
+            variant_config["seed"] = base_seed + index
+            started = time.monotonic()
+            try:
+                success, result = await self.api_client.generate_image_async(
+                    prompt=prompt,
+                    model_config=variant_config,
+                    size=image_size
+                )
+            except Exception as e:
+                logger.error(f"{self.log_prefix} 批量变体 #{index + 1} 生成失败: {e!r}", exc_info=True)
+                success, result = False, str(e)
+            elapsed = time.monotonic() - started
+            runtime_stats.observe("batch.variant", elapsed)
+            return success, result, elapsed
+
+        results = await asyncio.gather(*(_run_variant(index) for index in range(count)))
+
+        images = []
+        timings = []
+        last_error = ""
+        for index, (success, result, elapsed) in enumerate(results, 1):
+            timings.append(f"#{index} {elapsed:.1f}s{'' if success else '(失败)'}")
+            if not success:
+                last_error = result
+                continue
+            final_image_data = self._process_api_response(result)
+            if not final_image_data or not final_image_data.startswith(_BASE64_IMAGE_PREFIXES):
+                logger.warning(f"{self.log_prefix} 批量变体 #{index} 不是Base64图片，无法拼接")
+                continue
+            try:
+                images.append(base64.b64decode(final_image_data))
+            except Exception as e:
+                logger.warning(f"{self.log_prefix} 批量变体 #{index} 解码失败: {e}")
+
+        logger.info(f"{self.log_prefix} 批量生成 {len(images)}/{count} 成功，各变体耗时: {', '.join(timings)}")
+        if not images:
+            await self.send_text(f"生成图片失败：{last_error or 'API 返回了无效的数据'}")
+            return False, f"生成失败: {last_error}", True
+
+        sheet_base64 = base64.b64encode(images[0]).decode("utf-8")
+        if len(images) > 1:
+            if not self._can_process_images():
+                logger.warning(f"{self.log_prefix} 未安装 Pillow，无法拼接网格，仅发送第一张")
+            else:
+                max_side = self.settings.batch.max_grid_side
+                started = time.perf_counter()
+                try:
+                    with span("image.grid", images=len(images), max_side=max_side):
+                        sheet = await self._run_in_image_worker(compose_grid, images, max_side)
+                    sheet_base64 = base64.b64encode(sheet).decode("utf-8")
+                    logger.info(f"{self.log_prefix} 网格拼接耗时 {(time.perf_counter() - started) * 1000:.1f}ms")
+                except Exception as e:
+                    logger.warning(f"{self.log_prefix} 网格拼接失败，仅发送第一张: {e!r}")
+
+        failure = await self._send_image_data(sheet_base64)
+        if failure:
+            return False, failure, True
+
+        self._record_first_image(False)
+        await self.send_text(f"🖼️ 批量生成 {len(images)}/{count} 张，耗时：{' / '.join(timings)}")
+        await self._schedule_auto_recall()
+        return True, "批量图片生成成功", True
+
+    async def _send_image_data(self, final_image_data: str,
+                               upscale_target: Optional[Tuple[int, int]] = None) -> Optional[str]:
+        """发送URL或Base64图片，成功返回 None，失败时提示用户并返回失败原因"""
+        send_time = time.time()
+
+        # 判断是 URL 还是 base64
+        if final_image_data.startswith(("http://", "https://")):
+            # 直接发送图片 URL（参考 lolicon 插件）
+            try:
+                with span("send", type="imageurl", source="url"):
+                    send_success = await self.send_custom("imageurl", final_image_data)
+            except Exception as e:
+                logger.error(f"{self.log_prefix} 图片URL发送失败: {e!r}")
+                await self.send_text(f"图片发送失败: {str(e)[:100]}")
+                return "发送失败"
+        elif final_image_data.startswith(_BASE64_IMAGE_PREFIXES):
+            # Base64 格式 -> 放大、后处理后保存为文件并以URL方式发送
+            if upscale_target:
+                final_image_data = await self._upscale_image_base64(final_image_data, upscale_target)
+            final_image_data = await self._postprocess_image_base64(final_image_data)
+            image_path = save_base64_image_to_file(final_image_data)
+            if image_path:
+                with span("send", type="imageurl", source="file"):
+                    send_success = await self.send_custom("imageurl", f"file://{image_path}")
+            else:
+                logger.warning(f"{self.log_prefix} 图片保存失败，回退为Base64发送")
+                with span("send", type="image", source="base64"):
+                    send_success = await self.send_image(final_image_data)
+        else:
+            await self.send_text("API 返回了无法识别的图片格式")
+            return "数据格式错误"
+
+        if not send_success:
+            await self.send_text("图片发送失败")
+            return "发送失败"
+
+        self._last_send_timestamp = send_time
+        return None
+
+    def _record_first_image(self, draft_mode: bool):
+        """记录从收到命令到首张图片发出的耗时，草图与完整质量分开统计"""
+        started = getattr(self, "_request_started", None)
+        if started is None:
+            return
+        elapsed = time.monotonic() - started
+        runtime_stats.observe("first_image.draft" if draft_mode else "first_image.full", elapsed)
+        logger.info(f"{self.log_prefix} 首张图片耗时 {elapsed:.2f}s（{'草图' if draft_mode else '完整质量'}）")
+
+    @staticmethod
+    def remember_draft(platform: str, chat_id: str, prompt: str, seed: int):
+        """记录会话最近一次草图的提示词和种子"""
+        chat_state = chat_states.get_or_create(platform, chat_id)
+        chat_state.draft_prompt = prompt
+        chat_state.draft_seed = seed
+
+    @staticmethod
+    def get_last_draft(platform: str, chat_id: str) -> Optional[Dict[str, Any]]:
+        """获取会话最近一次草图，未生成过则返回 None"""
+        chat_state = chat_states.get(platform, chat_id)
+        if chat_state is None or chat_state.draft_prompt is None:
+            return None
+        return {"prompt": chat_state.draft_prompt, "seed": chat_state.draft_seed}
@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+"""
+图片字节级处理函数
+
+本模块只依赖标准库（Pillow 在函数内部按需导入），不引用宿主程序的任何模块，
+因此其中的函数可以直接提交到子进程中执行。
+"""
+import struct
+from io import BytesIO
+from typing import Optional
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+# 会影响像素呈现的辅助块（含内嵌 ICC 色彩配置），去除元数据时保留
+_KEPT_ANCILLARY_CHUNKS = frozenset({b"tRNS", b"gAMA", b"sRGB", b"cHRM", b"iCCP"})
+
+# 转码格式别名 -> Pillow 格式名
+_TRANSCODE_FORMATS = {
+    "webp": "WEBP",
+    "jpeg": "JPEG",
+    "jpg": "JPEG",
+}
+
+
+def is_png(data: bytes) -> bool:
+    return data[:8] == PNG_SIGNATURE
+
+
+def strip_png_ancillary_chunks(data: bytes) -> bytes:
+    """
+    去除 PNG 中的辅助块（tEXt/iTXt/zTXt 等），不解码像素数据
+
+    仅保留关键块（类型首字母大写）与少量影响显示效果的辅助块。
+    遇到截断或格式异常的数据时原样返回。
+    """
+    if not is_png(data):
+        return data
+
+    view = memoryview(data)
+    total = len(data)
+    pos = len(PNG_SIGNATURE)
+    parts = [view[:pos]]
+    dropped = False
+
+    while pos + 12 <= total:
+        length = struct.unpack_from(">I", data, pos)[0]
+        chunk_type = bytes(view[pos + 4:pos + 8])
+        end = pos + 12 + length
+        if end > total:
+            return data
+
+        # 类型首字母第5位为0表示关键块
+        if not chunk_type[0] & 0x20 or chunk_type in _KEPT_ANCILLARY_CHUNKS:
+            parts.append(view[pos:end])
+        else:
+            dropped = True
+
+        pos = end
+        if chunk_type == b"IEND":
+            break
+
+    if not dropped:
+        return data
+    return b"".join(parts)
+
+
+def normalize_transcode_format(fmt: str) -> str:
+    """将配置中的转码格式转换为 Pillow 格式名，不支持时返回空字符串"""
+    return _TRANSCODE_FORMATS.get((fmt or "").strip().lower(), "")
+
+
+def transcode_image(data: bytes, fmt: str, quality: int) -> Optional[bytes]:
+    """
+    使用 Pillow 将图片转码为 WebP/JPEG
+
+    在子进程中执行；不转码或转码结果不比原图小时返回 None
+    （结果经过进程间传递，调用方无法用 is 判断是否为原数据）。
+    """
+    from PIL import Image
+
+    pil_format = normalize_transcode_format(fmt)
+    if not pil_format:
+        return None
+
+    with Image.open(BytesIO(data)) as image:
+        image.load()
+        if pil_format == "JPEG" and image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        elif pil_format == "WEBP" and image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+
+        output = BytesIO()
+        save_kwargs = {"quality": max(1, min(100, int(quality)))}
+        if pil_format == "WEBP":
+            save_kwargs["method"] = 4
+        else:
+            save_kwargs["optimize"] = True
+        image.save(output, format=pil_format, **save_kwargs)
+
+    encoded = output.getvalue()
+    return encoded if len(encoded) < len(data) else None
+
+
+def parse_size(size: str):
+    """解析 "宽x高" 格式的尺寸，无法解析时返回 None"""
+    try:
+        width, height = (int(part) for part in str(size).lower().split("x", 1))
+    except (TypeError, ValueError):
+        return None
+    if width <= 0 or height <= 0:
+        return None
+    return width, height
+
+
+def upscale_image(data: bytes, width: int, height: int, resample: str = "lanczos") -> Optional[bytes]:
+    """
+    使用 Pillow 的 C 实现（pillow-simd 下为 SIMD 路径）将图片放大到指定尺寸
+
+    在子进程中执行，输出为 PNG；原图已不小于目标尺寸时返回 None。
+    """
+    from PIL import Image
+
+    filters = {
+        "lanczos": Image.LANCZOS,
+        "bicubic": Image.BICUBIC,
+        "bilinear": Image.BILINEAR,
+    }
+    resample_filter = filters.get((resample or "").lower(), Image.LANCZOS)
+
+    with Image.open(BytesIO(data)) as image:
+        if image.width >= width and image.height >= height:
+            return None
+        image.load()
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+        resized = image.resize((width, height), resample_filter)
+
+    output = BytesIO()
+    resized.save(output, format="PNG", compress_level=3)
+    return output.getvalue()
+
+
+def compose_grid(images, max_side: int = 2048, background=(255, 255, 255)) -> bytes:
+    """
+    将多张图片拼接为网格（联系表）并编码为 PNG
+
+    各图缩放到统一的格子尺寸后，用 NumPy 切片一次性写入网格数组；
+    未安装 NumPy 时回退为 Pillow 的 paste。网格最长边不超过 max_side。
+    """
+    import math
+
+    from PIL import Image
+
+    decoded = []
+    for data in images:
+        with Image.open(BytesIO(data)) as image:
+            decoded.append(image.convert("RGB"))
+    if not decoded:
+        raise ValueError("没有可拼接的图片")
+
+    count = len(decoded)
+    columns = math.ceil(math.sqrt(count))
+    rows = math.ceil(count / columns)
+
+    cell_w = max(image.width for image in decoded)
+    cell_h = max(image.height for image in decoded)
+    scale = min(1.0, max_side / (cell_w * columns), max_side / (cell_h * rows))
+    cell_w = max(1, int(cell_w * scale))
+    cell_h = max(1, int(cell_h * scale))
+    cells = [
+        image if image.size == (cell_w, cell_h) else image.resize((cell_w, cell_h), Image.BILINEAR)
+        for image in decoded
+    ]
+
+    try:
+        import numpy as np
+    except ImportError:
+        np = None
+
+    if np is not None:
+        grid = np.empty((rows * cell_h, columns * cell_w, 3), dtype=np.uint8)
+        grid[:] = background
+        for index, cell in enumerate(cells):
+            row, column = divmod(index, columns)
+            grid[row * cell_h:(row + 1) * cell_h, column * cell_w:(column + 1) * cell_w] = np.asarray(cell)
+        sheet = Image.fromarray(grid, "RGB")
+    else:
+        sheet = Image.new("RGB", (columns * cell_w, rows * cell_h), background)
+        for index, cell in enumerate(cells):
+            row, column = divmod(index, columns)
+            sheet.paste(cell, (column * cell_w, row * cell_h))
+
+    output = BytesIO()
+    sheet.save(output, format="PNG", compress_level=3)
+    return output.getvalue()
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+"""
+图片后处理流水线混入：在上游返回图片与发送之间执行可选的处理阶段
+"""
+import asyncio
+import base64
+import importlib.util
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Tuple
+
+from src.common.logger import get_logger
+
+from . import runtime_stats
+from .image_ops import (
+    is_png,
+    normalize_transcode_format,
+    parse_size,
+    strip_png_ancillary_chunks,
+    transcode_image,
+    upscale_image,
+)
+from .plugin_settings import SIZE_MAPPINGS, PluginSettingsMixin
+from .tracing import current_span, traced
+
+logger = get_logger("nai_pic_plugin")
+
+_executor: Optional[ProcessPoolExecutor] = None
+_executor_workers = 0
+_pillow_available: Optional[bool] = None
+
+
+def _get_process_pool(max_workers: int) -> ProcessPoolExecutor:
+    """获取（必要时创建）图片处理用的进程池"""
+    global _executor, _executor_workers
+    max_workers = max(1, int(max_workers or 1))
+    if _executor is None or _executor_workers != max_workers:
+        if _executor is not None:
+            _executor.shutdown(wait=False)
+        _executor = ProcessPoolExecutor(max_workers=max_workers)
+        _executor_workers = max_workers
+    return _executor
+
+
+def shutdown_process_pool() -> None:
+    """关闭图片处理进程池，停止插件时调用；之后再次使用会重新创建"""
+    global _executor, _executor_workers
+    if _executor is None:
+        return
+    executor, _executor, _executor_workers = _executor, None, 0
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _has_pillow() -> bool:
+    global _pillow_available
+    if _pillow_available is None:
+        _pillow_available = importlib.util.find_spec("PIL") is not None
+        if not _pillow_available:
+            logger.warning("[ImagePipeline] 未安装 Pillow，图片转码功能不可用")
+    return _pillow_available
+
+
+class ImagePipelineMixin(PluginSettingsMixin):
+    """为命令和动作提供图片后处理能力"""
+
+    @traced("image.postprocess")
+    async def _postprocess_image_base64(self, image_base64: str) -> str:
+        """
+        对Base64图片执行后处理：去除PNG元数据、超过阈值时转码
+
+        任一阶段失败都会回退为上一阶段的结果，不影响图片发送。
+        """
+        postprocess = self.settings.image_postprocess
+        if not postprocess.enabled:
+            return image_base64
+
+        try:
+            image_bytes = base64.b64decode(image_base64)
+        except Exception as exc:
+            logger.warning(f"{self.log_prefix} 图片后处理解码失败，跳过: {exc}")
+            return image_base64
+
+        original_size = len(image_bytes)
+        processed = image_bytes
+        strip_ms = 0.0
+        transcode_ms = 0.0
+
+        if postprocess.strip_metadata and is_png(processed):
+            started = time.perf_counter()
+            processed = strip_png_ancillary_chunks(processed)
+            strip_ms = (time.perf_counter() - started) * 1000
+
+        transcode_format = postprocess.transcode_format
+        threshold_bytes = max(0, postprocess.transcode_threshold_kb) * 1024
+        if normalize_transcode_format(transcode_format) and len(processed) > threshold_bytes and _has_pillow():
+            quality = postprocess.transcode_quality
+            started = time.perf_counter()
+            try:
+                # 工作进程在未转码时返回 None
+                processed = await self._run_in_image_worker(
+                    transcode_image, processed, transcode_format, quality
+                ) or processed
+            except Exception as exc:
+                logger.warning(f"{self.log_prefix} 图片转码失败，使用未转码图片: {exc!r}")
+            transcode_ms = (time.perf_counter() - started) * 1000
+
+        saved = original_size - len(processed)
+        if saved > 0:
+            runtime_stats.incr("image.bytes_saved", saved)
+        current_span().set(**{"bytes.in": original_size, "bytes.out": len(processed)})
+        logger.info(
+            f"{self.log_prefix} 图片后处理: {original_size} -> {len(processed)} bytes (节省 {saved} bytes)，"
+            f"去元数据 {strip_ms:.1f}ms，转码 {transcode_ms:.1f}ms"
+        )
+
+        if processed is image_bytes:
+            return image_base64
+        return base64.b64encode(processed).decode("utf-8")
+
+    def _resolve_upscale_plan(self, image_size: str) -> Tuple[str, Optional[Tuple[int, int]]]:
+        """
+        根据放大预设决定请求上游的尺寸
+
+        Returns:
+            (请求上游使用的尺寸, 需要在本地放大到的目标宽高)；不放大时目标为 None
+        """
+        upscale = self.settings.upscale
+        if not upscale.enabled or not image_size:
+            return image_size, None
+
+        target_size = SIZE_MAPPINGS.get(image_size, image_size)
+        # 预设的键在编译配置时已展开尺寸代号（竖图/横/s 等）
+        upstream_size = upscale.presets.get(target_size)
+        target = parse_size(target_size)
+        upstream = parse_size(upstream_size) if upstream_size else None
+        if not target or not upstream or upstream[0] >= target[0] or upstream[1] >= target[1]:
+            return image_size, None
+        if not _has_pillow():
+            return image_size, None
+
+        logger.info(f"{self.log_prefix} 使用本地放大: 上游请求 {upstream_size}，放大至 {target_size}")
+        return upstream_size, target
+
+    @traced("image.upscale")
+    async def _upscale_image_base64(self, image_base64: str, target: Tuple[int, int]) -> str:
+        """在工作进程中将Base64图片放大到目标尺寸，失败时返回原图"""
+        try:
+            image_bytes = base64.b64decode(image_base64)
+        except Exception as exc:
+            logger.warning(f"{self.log_prefix} 图片放大解码失败，跳过: {exc}")
+            return image_base64
+
+        resample = self.settings.upscale.resample
+        current_span().set(size=f"{target[0]}x{target[1]}", resample=resample)
+        started = time.perf_counter()
+        try:
+            upscaled = await self._run_in_image_worker(upscale_image, image_bytes, target[0], target[1], resample)
+        except Exception as exc:
+            logger.warning(f"{self.log_prefix} 图片放大失败，发送原图: {exc!r}")
+            return image_base64
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        if upscaled is None:
+            logger.info(f"{self.log_prefix} 图片已不小于 {target[0]}x{target[1]}，无需放大")
+            return image_base64
+
+        megapixels = target[0] * target[1] / 1_000_000
+        runtime_stats.observe("upscale.per_megapixel", elapsed_ms / 1000 / megapixels)
+        logger.info(
+            f"{self.log_prefix} 图片已放大至 {target[0]}x{target[1]}，耗时 {elapsed_ms:.1f}ms"
+            f"（{elapsed_ms / megapixels:.1f}ms/MP）"
+        )
+        return base64.b64encode(upscaled).decode("utf-8")
+
+    def _can_process_images(self) -> bool:
+        """是否具备在工作进程中解码/编码图片的条件（需要 Pillow）"""
+        return _has_pillow()
+
+    async def _run_in_image_worker(self, func, *args):
+        """在图片处理进程池中执行纯函数"""
+        workers = self.settings.image_postprocess.worker_processes
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_get_process_pool(workers), func, *args)
@@ -7,11 +7,15 @@ from typing import Optional, List, Tuple
 
 from src.common.logger import get_logger
 
+from . import runtime_stats
+from .tracing import current_span, traced
+
 logger = get_logger("nai_pic_plugin.image_helper")
 
 _BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 _IMAGE_OUTPUT_DIR = os.path.join(_BASE_DIR, "generated_images")
-os.makedirs(_IMAGE_OUTPUT_DIR, exist_ok=True)
+# 输出目录在第一次写入图片时创建
+_output_dir_ready = False
 _MAX_FILE_AGE_SECONDS = 30 * 60  # 30分钟保留时间
 _MAX_FILE_COUNT = 80  # 限制缓存文件数量
 _CLEANUP_INTERVAL_SECONDS = 5 * 60  # 每5分钟尝试清理一次
@@ -71,6 +75,14 @@ def _cleanup_generated_files(now: float):
         logger.debug(f"[ImageHelper] 已清理 {removed} 个临时图片文件")
 
 
+def _ensure_output_dir():
+    global _output_dir_ready
+    if not _output_dir_ready:
+        os.makedirs(_IMAGE_OUTPUT_DIR, exist_ok=True)
+        _output_dir_ready = True
+
+
+@traced("image.save")
 def save_base64_image_to_file(image_base64: str) -> Optional[str]:
     """将Base64图片保存为本地文件并返回文件路径"""
     _maybe_cleanup_generated_files()
@@ -82,13 +94,16 @@ def save_base64_image_to_file(image_base64: str) -> Optional[str]:
         return None
 
     image_type = imghdr.what(None, h=image_bytes) or "png"
+    current_span().set(bytes=len(image_bytes), format=image_type)
     extension = "jpg" if image_type == "jpeg" else image_type
     file_name = f"nai_{int(time.time() * 1000)}_{uuid.uuid4().hex[:6]}.{extension}"
     file_path = os.path.join(_IMAGE_OUTPUT_DIR, file_name)
 
     try:
+        _ensure_output_dir()
         with open(file_path, "wb") as f:
             f.write(image_bytes)
+        runtime_stats.incr("image.bytes_sent", len(image_bytes))
         logger.debug(f"[ImageHelper] 图片已保存: {file_path}")
         return file_path
     except Exception as e:
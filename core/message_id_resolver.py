@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""
+消息ID解析：维护各聊天流最近发出的图片消息索引，将发送时间映射为平台消息ID
+
+索引由两类来源写入：
+1. 宿主的消息事件（发送后 / 收到自身消息回显），由事件处理器调用 observe
+2. 兜底轮询 message_api 得到的结果
+等待中的撤回任务在索引更新时被直接唤醒，无需反复查询数据库。
+聊天流按最近写入的顺序保存，最新记录也已过期的聊天流连同占用记录一起清理，
+聊天流数量另有上限，长时间运行时索引不会随出现过图片的聊天数增长。
+"""
+import asyncio
+import time
+from collections import OrderedDict, deque
+from typing import Deque, Dict, List, Optional, Set
+
+PLACEHOLDER_PREFIX = "send_api_"
+
+_MAX_RECORDS_PER_STREAM = 32
+_RECORD_TTL_SECONDS = 300.0
+_MAX_STREAMS = 4096
+
+
+def is_placeholder_id(message_id: Optional[str]) -> bool:
+    return bool(message_id) and str(message_id).startswith(PLACEHOLDER_PREFIX)
+
+
+class _OutboundRecord:
+    __slots__ = ("message_id", "time", "user_id", "observed_at")
+
+    def __init__(self, message_id: str, msg_time: float, user_id: str):
+        self.message_id = message_id
+        self.time = msg_time
+        self.user_id = user_id
+        self.observed_at = time.monotonic()
+
+
+class MessageIdResolver:
+    """按聊天流索引图片消息，并按发送时间为每次发送分配唯一的消息ID"""
+
+    def __init__(self):
+        # 按最近写入排序，便于从队首清理空闲的聊天流
+        self._records: "OrderedDict[str, Deque[_OutboundRecord]]" = OrderedDict()
+        self._claimed: Dict[str, Set[str]] = {}
+        self._waiters: Dict[str, List[asyncio.Event]] = {}
+
+    def observe(self, stream_id: str, message_id: str, msg_time: Optional[float], user_id: str = "") -> None:
+        """记录一条图片消息，并唤醒该聊天流上等待中的解析任务"""
+        if not stream_id or not message_id:
+            return
+        message_id = str(message_id)
+        records = self._records.get(stream_id)
+        if records is None:
+            self._prune_streams()
+            records = self._records[stream_id] = deque(maxlen=_MAX_RECORDS_PER_STREAM)
+        else:
+            self._records.move_to_end(stream_id)
+
+        msg_time = float(msg_time) if msg_time is not None else time.time()
+        for record in records:
+            if record.message_id == message_id:
+                return
+            # 占位ID被正式ID替换：同一时间点的占位记录直接更新
+            if is_placeholder_id(record.message_id) and not is_placeholder_id(message_id) \
+                    and abs(record.time - msg_time) < 1e-3:
+                record.message_id = message_id
+                self._notify(stream_id)
+                return
+
+        records.append(_OutboundRecord(message_id, msg_time, str(user_id or "")))
+        self._notify(stream_id)
+
+    def lookup(self, stream_id: str, send_timestamp: Optional[float], bot_account: str = "",
+               tolerance: float = 0.2, allow_placeholder: bool = False) -> Optional[str]:
+        """
+        在索引中为一次发送查找消息ID（不占用）
+
+        选择发送时间之后、时间最接近且尚未被其他发送占用的图片消息。
+        """
+        records = self._records.get(stream_id)
+        if not records:
+            return None
+
+        claimed = self._claimed.get(stream_id, set())
+        now = time.monotonic()
+        best: Optional[_OutboundRecord] = None
+        best_distance = float("inf")
+        for record in records:
+            if now - record.observed_at > _RECORD_TTL_SECONDS or record.message_id in claimed:
+                continue
+            if is_placeholder_id(record.message_id) and not allow_placeholder:
+                continue
+            if bot_account and record.user_id and record.user_id != bot_account:
+                continue
+            if send_timestamp:
+                if record.time + tolerance < send_timestamp:
+                    continue
+                distance = abs(record.time - send_timestamp)
+            else:
+                distance = -record.time  # 无发送时间时取最新一条
+            if distance < best_distance:
+                best, best_distance = record, distance
+        return best.message_id if best else None
+
+    def claim(self, stream_id: str, message_id: str) -> None:
+        """标记消息ID已被某次发送占用，避免相邻两次发送解析到同一张图"""
+        # 已被清理的聊天流不再记录占用，避免占用集合脱离索引单独残留
+        if not is_placeholder_id(message_id) and stream_id in self._records:
+            self._claimed.setdefault(stream_id, set()).add(message_id)
+            claimed = self._claimed[stream_id]
+            if len(claimed) > _MAX_RECORDS_PER_STREAM * 4:
+                live = {record.message_id for record in self._records.get(stream_id, ())}
+                claimed.intersection_update(live)
+
+    async def wait_for(self, stream_id: str, send_timestamp: Optional[float], bot_account: str = "",
+                       timeout: float = 1.0, tolerance: float = 0.2) -> Optional[str]:
+        """等待索引中出现与本次发送匹配的正式消息ID，超时返回 None"""
+        deadline = time.monotonic() + max(0.0, timeout)
+        while True:
+            found = self.lookup(stream_id, send_timestamp, bot_account, tolerance)
+            if found:
+                return found
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            event = asyncio.Event()
+            self._waiters.setdefault(stream_id, []).append(event)
+            try:
+                await asyncio.wait_for(event.wait(), timeout=remaining)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                waiters = self._waiters.get(stream_id)
+                if waiters and event in waiters:
+                    waiters.remove(event)
+                    if not waiters:
+                        self._waiters.pop(stream_id, None)
+
+    def _prune_streams(self) -> None:
+        """清理最新记录已过期的聊天流，并把聊天流数量限制在上限以内"""
+        expire_before = time.monotonic() - _RECORD_TTL_SECONDS
+        records = self._records
+        while records:
+            stream_id, oldest = next(iter(records.items()))
+            if len(records) < _MAX_STREAMS and oldest and oldest[-1].observed_at >= expire_before:
+                break
+            del records[stream_id]
+            self._claimed.pop(stream_id, None)
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def _notify(self, stream_id: str) -> None:
+        for event in self._waiters.get(stream_id, ()):
+            event.set()
+
+
+# 进程内共享的解析器实例
+resolver = MessageIdResolver()
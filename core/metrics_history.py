@@ -0,0 +1,374 @@
+# -*- coding: utf-8 -*-
+"""
+指标历史：把每分钟的生图数量、延迟分布、错误类别与发送字节数写入磁盘上的环形文件，重启后保留
+
+文件由定长的槽组成：分钟槽（默认 7 天，每槽 68 字节）记录请求数、错误类别、上游调用、
+配置缓存命中、发送与节省的字节数以及请求延迟直方图；小时槽记录按 (模型, 尺寸) 划分的上游延迟直方图。
+槽位由时间取模得到，写入时槽中是旧时间的数据则覆盖、是同一时间的数据则累加，
+文件大小固定，超过保留期的数据自然被覆盖。
+内存中只累计当前分钟，分钟切换、停止或生成报告时写入。/nai report 由此生成容量规划摘要。
+"""
+import functools
+import os
+import struct
+import time
+import zlib
+from collections import Counter
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from src.common.logger import get_logger
+
+from . import runtime_stats
+from .plugin_settings import SIZE_MAPPINGS, MetricsHistorySettings, plugin_settings
+from .storage_paths import data_path
+
+logger = get_logger("nai_pic_plugin")
+
+# 延迟直方图的桶上界（秒），最后一个桶收纳更慢的请求
+LATENCY_BUCKETS = (1, 2, 3, 5, 8, 12, 20, 30, 45, 60, 90, float("inf"))
+
+# 上游延迟按模型与尺寸划分，未列出的归入 other
+MODELS = ("nai-diffusion-3", "nai-diffusion-furry-3", "nai-diffusion-4-curated-preview",
+          "nai-diffusion-4-full", "nai-diffusion-4-5-full", "other")
+SIZES = ("832x1216", "1216x832", "1024x1024", "other")
+
+# 从 runtime_stats 计数器按差值汇入分钟槽的项目
+_DELTA_COUNTERS = ("model_config.cache_hit", "model_config.cache_miss", "image.bytes_sent", "image.bytes_saved")
+
+# 错误类别，与分钟槽中的计数顺序一致
+ERROR_CLASSES = ("upstream", "invalid_data", "send", "config", "exception", "other")
+
+# 分钟槽：分钟时间戳、成功、失败（按类别）、拒绝、排队拒绝、上游调用与失败、降级出图、缓存命中与未命中、发送与节省的 KB、延迟直方图
+_MINUTE_COUNTERS = ("ok",) + tuple(f"error.{name}" for name in ERROR_CLASSES) + (
+    "denied", "shed", "upstream.calls", "upstream.failures", "degraded")
+_MINUTE_STRUCT = struct.Struct(f"<I{len(_MINUTE_COUNTERS)}H4I{len(LATENCY_BUCKETS)}H")
+_HOUR_STRUCT = struct.Struct(f"<I{len(MODELS) * len(SIZES) * len(LATENCY_BUCKETS)}H")
+_HEADER_STRUCT = struct.Struct("<4sHIII")
+_MAGIC = b"NAIM"
+_FORMAT_VERSION = 1
+# 维度或分桶变化后旧文件不可用，布局指纹写在文件头中
+_LAYOUT = zlib.crc32(repr((_MINUTE_COUNTERS, LATENCY_BUCKETS, MODELS, SIZES)).encode("utf-8"))
+
+_UINT16_MAX = 0xFFFF
+_UINT32_MAX = 0xFFFFFFFF
+
+
+def _bucket(seconds: float) -> int:
+    for index, bound in enumerate(LATENCY_BUCKETS):
+        if seconds <= bound:
+            return index
+    return len(LATENCY_BUCKETS) - 1
+
+
+def _dimension(model: Optional[str], size: Optional[str]) -> int:
+    model_index = MODELS.index(model) if model in MODELS else len(MODELS) - 1
+    size = SIZE_MAPPINGS.get(size or "", size)
+    size_index = SIZES.index(size) if size in SIZES else len(SIZES) - 1
+    return model_index * len(SIZES) + size_index
+
+
+def classify_result(result: Any) -> str:
+    """把组件 execute 的返回值归为 ok / denied / shed / 错误类别"""
+    if not isinstance(result, tuple) or not result:
+        return "exception"
+    if result[0]:
+        return "ok"
+    reason = str(result[1] or "") if len(result) > 1 else ""
+    if "权限" in reason or "配额" in reason:
+        return "denied"
+    if "排队" in reason:
+        return "shed"
+    if reason.startswith("生成失败"):
+        return "upstream"
+    if "格式" in reason:
+        return "invalid_data"
+    if "发送失败" in reason:
+        return "send"
+    if "配置" in reason or "未配置" in reason:
+        return "config"
+    return "other"
+
+
+def percentile_bound(histogram: List[int], ratio: float) -> Optional[float]:
+    """返回直方图中覆盖 ratio 比例样本的桶上界，没有样本时返回 None"""
+    total = sum(histogram)
+    if not total:
+        return None
+    threshold = total * ratio
+    cumulative = 0
+    for index, count in enumerate(histogram):
+        cumulative += count
+        if cumulative >= threshold:
+            return LATENCY_BUCKETS[index]
+    return LATENCY_BUCKETS[-1]
+
+
+class _MinuteAccumulator:
+    __slots__ = ("minute", "counters", "latency", "upstream")
+
+    def __init__(self, minute: int):
+        self.minute = minute
+        self.counters: Counter = Counter()
+        self.latency = [0] * len(LATENCY_BUCKETS)
+        self.upstream: Dict[int, List[int]] = {}
+
+
+class MetricsHistory:
+    """累计当前分钟并写入环形文件"""
+
+    def __init__(self):
+        self._current: Optional[_MinuteAccumulator] = None
+        self._counters_seen: Tuple[int, ...] = (0,) * len(_DELTA_COUNTERS)
+        self._minute_slots = 0
+        self._hour_slots = 0
+
+    @property
+    def settings(self) -> Optional[MetricsHistorySettings]:
+        current = plugin_settings.current
+        return current.metrics_history if current is not None else None
+
+    @property
+    def enabled(self) -> bool:
+        settings = self.settings
+        return settings is not None and settings.enabled
+
+    # ---- 记录 ----
+
+    def _accumulator(self) -> _MinuteAccumulator:
+        minute = int(time.time() // 60)
+        current = self._current
+        if current is None or current.minute != minute:
+            if current is not None:
+                self.flush()
+            current = self._current = _MinuteAccumulator(minute)
+        return current
+
+    def record_request(self, outcome: str, latency: float) -> None:
+        if not self.enabled:
+            return
+        current = self._accumulator()
+        current.counters[outcome if outcome in ("ok", "denied", "shed") else f"error.{outcome}"] += 1
+        if outcome not in ("denied", "shed"):
+            current.latency[_bucket(latency)] += 1
+
+    def record_upstream(self, model: Optional[str], size: Optional[str], elapsed: float, success: bool) -> None:
+        if not self.enabled:
+            return
+        current = self._accumulator()
+        current.counters["upstream.calls"] += 1
+        if not success:
+            current.counters["upstream.failures"] += 1
+            return
+        histogram = current.upstream.setdefault(_dimension(model, size), [0] * len(LATENCY_BUCKETS))
+        histogram[_bucket(elapsed)] += 1
+
+    def record_degraded(self) -> None:
+        if not self.enabled:
+            return
+        self._accumulator().counters["degraded"] += 1
+
+    # ---- 文件 ----
+
+    def _open(self, settings: MetricsHistorySettings):
+        """打开（必要时创建或重建）环形文件"""
+        path = data_path(settings.file_name, create_dir=True)
+        minute_slots = max(1, settings.retention_days) * 24 * 60
+        hour_slots = max(1, settings.retention_days) * 24
+        expected = _HEADER_STRUCT.size + minute_slots * _MINUTE_STRUCT.size + hour_slots * _HOUR_STRUCT.size
+        try:
+            handle = open(path, "r+b")
+        except FileNotFoundError:
+            handle = None
+        if handle is not None:
+            header = handle.read(_HEADER_STRUCT.size)
+            valid = (
+                len(header) == _HEADER_STRUCT.size
+                and _HEADER_STRUCT.unpack(header) == (_MAGIC, _FORMAT_VERSION, _LAYOUT, minute_slots, hour_slots)
+                and os.fstat(handle.fileno()).st_size == expected
+            )
+            if valid:
+                self._minute_slots, self._hour_slots = minute_slots, hour_slots
+                return handle
+            handle.close()
+            logger.info("[MetricsHistory] 指标历史文件格式或保留期已变化，重新创建")
+        handle = open(path, "w+b")
+        handle.write(_HEADER_STRUCT.pack(_MAGIC, _FORMAT_VERSION, _LAYOUT, minute_slots, hour_slots))
+        handle.truncate(expected)
+        self._minute_slots, self._hour_slots = minute_slots, hour_slots
+        return handle
+
+    def _minute_offset(self, minute: int) -> int:
+        return _HEADER_STRUCT.size + (minute % self._minute_slots) * _MINUTE_STRUCT.size
+
+    def _hour_offset(self, hour: int) -> int:
+        return (_HEADER_STRUCT.size + self._minute_slots * _MINUTE_STRUCT.size
+                + (hour % self._hour_slots) * _HOUR_STRUCT.size)
+
+    @staticmethod
+    def _merge_slot(handle, offset: int, layout: struct.Struct, stamp: int, values: List[int],
+                    limits: List[int]) -> None:
+        """槽中是同一时间的数据时累加，否则覆盖"""
+        handle.seek(offset)
+        existing = layout.unpack(handle.read(layout.size))
+        if existing[0] == stamp:
+            values = [old + new for old, new in zip(existing[1:], values)]
+        values = [min(value, limit) for value, limit in zip(values, limits)]
+        handle.seek(offset)
+        handle.write(layout.pack(stamp, *values))
+
+    def _counter_deltas(self) -> List[int]:
+        seen = tuple(runtime_stats.get_counter(name) for name in _DELTA_COUNTERS)
+        deltas = [max(0, now - before) for now, before in zip(seen, self._counters_seen)]
+        self._counters_seen = seen
+        return deltas
+
+    def flush(self) -> None:
+        """把当前分钟的累计写入文件"""
+        current, self._current = self._current, None
+        settings = self.settings
+        if current is None or settings is None or not settings.enabled:
+            return
+        hits, misses, bytes_sent, bytes_saved = self._counter_deltas()
+        minute_values = [current.counters[name] for name in _MINUTE_COUNTERS]
+        minute_values += [hits, misses, round(bytes_sent / 1024), round(bytes_saved / 1024)]
+        minute_values += current.latency
+        minute_limits = [_UINT16_MAX] * len(_MINUTE_COUNTERS) + [_UINT32_MAX] * 4 + [_UINT16_MAX] * len(LATENCY_BUCKETS)
+        try:
+            with self._open(settings) as handle:
+                self._merge_slot(handle, self._minute_offset(current.minute), _MINUTE_STRUCT, current.minute,
+                                 minute_values, minute_limits)
+                if current.upstream:
+                    hour = current.minute // 60
+                    hour_values = [0] * (len(MODELS) * len(SIZES) * len(LATENCY_BUCKETS))
+                    for dimension, histogram in current.upstream.items():
+                        start = dimension * len(LATENCY_BUCKETS)
+                        hour_values[start:start + len(LATENCY_BUCKETS)] = histogram
+                    self._merge_slot(handle, self._hour_offset(hour), _HOUR_STRUCT, hour, hour_values,
+                                     [_UINT16_MAX] * len(hour_values))
+        except OSError as exc:
+            logger.warning(f"[MetricsHistory] 写入指标历史失败: {exc!r}")
+
+    # ---- 读取 ----
+
+    def _read_slots(self, since_minute: int) -> Tuple[List[tuple], List[tuple]]:
+        settings = self.settings
+        if settings is None:
+            return [], []
+        now_minute = int(time.time() // 60)
+        minutes, hours = [], []
+        try:
+            with self._open(settings) as handle:
+                handle.seek(_HEADER_STRUCT.size)
+                data = handle.read(self._minute_slots * _MINUTE_STRUCT.size)
+                minutes = [slot for slot in _MINUTE_STRUCT.iter_unpack(data) if since_minute <= slot[0] <= now_minute]
+                data = handle.read(self._hour_slots * _HOUR_STRUCT.size)
+                hours = [slot for slot in _HOUR_STRUCT.iter_unpack(data)
+                         if since_minute // 60 <= slot[0] <= now_minute // 60]
+        except OSError as exc:
+            logger.warning(f"[MetricsHistory] 读取指标历史失败: {exc!r}")
+        return minutes, hours
+
+    def summarize(self, window_minutes: int) -> Dict[str, Any]:
+        """汇总最近 window_minutes 分钟的指标"""
+        self.flush()
+        minutes, hours = self._read_slots(int(time.time() // 60) - window_minutes + 1)
+        counters_end = 1 + len(_MINUTE_COUNTERS)
+        totals = [0] * (len(_MINUTE_COUNTERS) + 4)
+        latency = [0] * len(LATENCY_BUCKETS)
+        by_hour: Counter = Counter()
+        peak_minute = (0, 0)
+        for slot in minutes:
+            values = slot[1:counters_end + 4]
+            totals = [a + b for a, b in zip(totals, values)]
+            latency = [a + b for a, b in zip(latency, slot[counters_end + 4:])]
+            requests = sum(values[:1 + len(ERROR_CLASSES)])
+            by_hour[time.localtime(slot[0] * 60).tm_hour] += requests
+            peak_minute = max(peak_minute, (requests, slot[0]))
+
+        dimensions: Dict[Tuple[str, str], List[int]] = {}
+        for slot in hours:
+            for dimension in range(len(MODELS) * len(SIZES)):
+                histogram = slot[1 + dimension * len(LATENCY_BUCKETS):1 + (dimension + 1) * len(LATENCY_BUCKETS)]
+                if any(histogram):
+                    key = (MODELS[dimension // len(SIZES)], SIZES[dimension % len(SIZES)])
+                    merged = dimensions.setdefault(key, [0] * len(LATENCY_BUCKETS))
+                    dimensions[key] = [a + b for a, b in zip(merged, histogram)]
+
+        named = dict(zip(_MINUTE_COUNTERS + ("cache.hits", "cache.misses", "kb_sent", "kb_saved"), totals))
+        return {
+            "window_minutes": window_minutes,
+            "covered_minutes": len(minutes),
+            "counters": named,
+            "errors": {name: named[f"error.{name}"] for name in ERROR_CLASSES if named[f"error.{name}"]},
+            "latency_p50": percentile_bound(latency, 0.5),
+            "latency_p95": percentile_bound(latency, 0.95),
+            "peak_hours": by_hour.most_common(3),
+            "peak_minute": peak_minute,
+            "upstream_p95": sorted(
+                ((key, sum(hist), percentile_bound(hist, 0.95)) for key, hist in dimensions.items()),
+                key=lambda item: item[1], reverse=True,
+            ),
+        }
+
+    def close(self) -> None:
+        self.flush()
+
+
+# 进程内共享的指标历史
+metrics_history = MetricsHistory()
+
+
+def record_metrics(entry: str):
+    """装饰组件的 execute：记录结果类别与端到端延迟"""
+
+    def decorator(execute):
+        @functools.wraps(execute)
+        async def wrapper(self, *args, **kwargs):
+            if not metrics_history.enabled:
+                return await execute(self, *args, **kwargs)
+            started = time.monotonic()
+            result = None
+            try:
+                result = await execute(self, *args, **kwargs)
+                return result
+            finally:
+                metrics_history.record_request(classify_result(result), time.monotonic() - started)
+
+        return wrapper
+
+    return decorator
+
+
+def _format_seconds(value: Optional[float]) -> str:
+    if value is None:
+        return "-"
+    return f">{LATENCY_BUCKETS[-2]:g}s" if value == float("inf") else f"≤{value:g}s"
+
+
+def format_report(summary: Dict[str, Any], title: str) -> Iterator[str]:
+    """把 summarize 的结果格式化为文本行"""
+    counters = summary["counters"]
+    errors = sum(summary["errors"].values())
+    requests = counters["ok"] + errors
+    yield f"【{title}】（有数据 {summary['covered_minutes']} 分钟）"
+    if not requests and not counters["upstream.calls"]:
+        yield "  无生图请求"
+        return
+    yield (f"  请求 {requests}（成功 {counters['ok']}，失败 {errors}，被拒绝 {counters['denied']}，排队拒绝 {counters['shed']}），"
+           f"延迟 p50 {_format_seconds(summary['latency_p50'])} / p95 {_format_seconds(summary['latency_p95'])}")
+    if summary["errors"]:
+        yield "  失败类别：" + "，".join(f"{name} {count}" for name, count in summary["errors"].items())
+    if summary["peak_hours"]:
+        yield "  高峰时段：" + "，".join(f"{hour:02d}时 {count}" for hour, count in summary["peak_hours"] if count)
+        count, minute = summary["peak_minute"]
+        yield f"  峰值 {count} 次/分钟（{time.strftime('%m-%d %H:%M', time.localtime(minute * 60))}）"
+    calls, failures = counters["upstream.calls"], counters["upstream.failures"]
+    if calls:
+        degraded = f"，降级出图 {counters['degraded']}" if counters["degraded"] else ""
+        yield f"  上游调用 {calls}，错误率 {failures / calls:.1%}{degraded}"
+    for (model, size), count, p95 in summary["upstream_p95"][:6]:
+        yield f"    {model} {size}: {count} 次，p95 {_format_seconds(p95)}"
+    lookups = counters["cache.hits"] + counters["cache.misses"]
+    if lookups:
+        yield f"  配置缓存命中率 {counters['cache.hits'] / lookups:.1%}（{counters['cache.hits']}/{lookups}）"
+    yield f"  发送图片 {counters['kb_sent'] / 1024:.1f}MB，后处理节省 {counters['kb_saved'] / 1024:.1f}MB"
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""
+合并后模型配置的缓存
+
+按 (platform, chat_id, 模型, 是否草图) 缓存只读的合并配置快照。快照记录生成时
+引用的基础配置节、版本配置节与会话设置版本号，三者任一变化（插件配置重新加载、
+管理命令修改会话设置）即视为失效；invalidate_all 用于配置热重载时整体作废。
+"""
+from collections import OrderedDict
+from types import MappingProxyType
+from typing import Any, Dict, Hashable, Mapping, Optional
+
+from . import runtime_stats
+
+
+def freeze_config(config: Dict[str, Any]) -> Mapping[str, Any]:
+    """返回只读视图，嵌套的字典同样只读；调用方需修改时应先 dict() 复制"""
+    return MappingProxyType({
+        key: MappingProxyType(dict(value)) if isinstance(value, dict) else value
+        for key, value in config.items()
+    })
+
+
+class _CacheEntry:
+    __slots__ = ("base_config", "version_config", "state_version", "generation", "snapshot")
+
+    def __init__(self, base_config, version_config, state_version: int, generation: int,
+                 snapshot: Mapping[str, Any]):
+        self.base_config = base_config
+        self.version_config = version_config
+        self.state_version = state_version
+        self.generation = generation
+        self.snapshot = snapshot
+
+
+class ModelConfigCache:
+    """LRU 缓存，条目数有上限"""
+
+    def __init__(self, max_entries: int = 4096):
+        self.max_entries = max_entries
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Hashable, _CacheEntry]" = OrderedDict()
+
+    def get(self, key: Hashable, base_config, version_config, state_version: int) -> Optional[Mapping[str, Any]]:
+        entry = self._entries.get(key)
+        if (entry is not None and entry.base_config is base_config and entry.version_config is version_config
+                and entry.state_version == state_version and entry.generation == self.generation):
+            self._entries.move_to_end(key)
+            self.hits += 1
+            runtime_stats.incr("model_config.cache_hit")
+            return entry.snapshot
+        self.misses += 1
+        runtime_stats.incr("model_config.cache_miss")
+        return None
+
+    def put(self, key: Hashable, base_config, version_config, state_version: int,
+            merged_config: Dict[str, Any]) -> Mapping[str, Any]:
+        snapshot = freeze_config(merged_config)
+        self._entries[key] = _CacheEntry(base_config, version_config, state_version, self.generation, snapshot)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return snapshot
+
+    def invalidate_all(self) -> None:
+        """插件配置重新加载时调用，所有快照在下次访问时重建"""
+        self.generation += 1
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+# 进程内共享的合并配置缓存
+model_config_cache = ModelConfigCache()
@@ -2,47 +2,75 @@
 """
 模型配置混入，统一处理模型/画师串选择及版本配置合并逻辑
 """
-from typing import Dict, Any, Tuple
+from typing import Dict, Any, Mapping, Optional, Tuple
 
 from src.common.logger import get_logger
 
+from .chat_state import chat_states
+from .model_config_cache import model_config_cache
+from .plugin_settings import PluginSettingsMixin, VersionSettings
+from .tracing import current_span, traced
+
 logger = get_logger("nai_pic_plugin")
 
 
-class ModelConfigMixin:
+class ModelConfigMixin(PluginSettingsMixin):
     """为命令和动作提供统一的模型配置解析逻辑"""
 
-    def _get_model_config(self) -> Dict[str, Any]:
-        base_config = self.get_config("model", {})  # type: ignore[attr-defined]
+    @traced("config.merge")
+    def _get_model_config(self, draft: bool = False) -> Mapping[str, Any]:
+        """
+        合并基础配置、版本配置与会话选择，返回本次生成使用的模型配置
+
+        返回缓存的只读快照，调用方需要修改时应先 dict() 复制；
+        会话设置变化或插件配置重新加载后自动重建。
+
+        Args:
+            draft: 是否应用版本配置中的快速草图预设（draft_size / draft_steps）
+        """
+        settings = self.settings
+        base_config = settings.model
         if not base_config:
             logger.error(f"{self._log_prefix} 模型配置读取失败")
             return {}
 
         platform, chat_id, _ = self._get_chat_identity()
+        # 会话设置只查找一次
+        chat_state = chat_states.get(platform, chat_id) if platform and chat_id else None
 
         model_name = base_config.get("default_model", "")
         # 运行时模型切换
-        try:
-            if platform and chat_id:
-                from .nai_admin_command import NaiAdminControlCommand
-
-                selected_model = NaiAdminControlCommand.get_selected_model(
-                    platform, chat_id, self.get_config  # type: ignore[attr-defined]
-                )
-                if selected_model:
-                    model_name = selected_model
-                    logger.info(f"{self._log_prefix} 使用用户选定的模型: {selected_model}")
-        except Exception as exc:
-            logger.warning(f"{self._log_prefix} 获取用户选定模型失败: {exc}")
-
-        version_config = self._get_version_config(model_name)
-
-        merged_config = base_config.copy()
+        if chat_state is not None and chat_state.model:
+            model_name = chat_state.model
+
+        version = settings.version_for(model_name)
+        version_config = version.config if version is not None else None
+        state_version = chat_state.version if chat_state is not None else -1
+        cache_key = (platform, chat_id, model_name, draft)
+        cached = model_config_cache.get(cache_key, base_config, version_config, state_version)
+        current_span().set(model=model_name, draft=draft, cached=cached is not None)
+        if cached is not None:
+            return cached
+
+        merged_config = self._build_model_config(base_config, version, model_name, platform, chat_id, chat_state)
+        if draft:
+            self._apply_draft_preset(merged_config)
+        return model_config_cache.put(cache_key, base_config, version_config, state_version, merged_config)
+
+    def _build_model_config(self, base_config: Mapping[str, Any], version: Optional[VersionSettings], model_name: str,
+                            platform: str, chat_id: str, chat_state) -> Dict[str, Any]:
+        """按优先级合并配置：基础配置 < 版本配置 < 会话选择"""
+        if version is not None:
+            logger.info(f"{self._log_prefix} 检测到 {version.display} 模型，使用 {version.section} 配置")
+        if chat_state is not None and chat_state.model:
+            logger.info(f"{self._log_prefix} 使用用户选定的模型: {model_name}")
+
+        merged_config = dict(base_config)
         if model_name:
             merged_config["default_model"] = model_name
 
-        if version_config:
-            for key, value in version_config.items():
+        if version is not None:
+            for key, value in version.config.items():
                 if key == "nai_extra_params":
                     base_extra = merged_config.get("nai_extra_params", {}) or {}
                     merged_extra = dict(base_extra)
@@ -53,51 +81,41 @@ class ModelConfigMixin:
                 else:
                     merged_config[key] = value
 
-        # 应用画师串选择
-        try:
-            if platform and chat_id and model_name:
+        # 应用画师串选择（未选择时使用第一个预设）
+        if platform and chat_id and version is not None and version.artist_presets:
+            try:
                 from .nai_admin_command import NaiAdminControlCommand
 
-                selected_artist = NaiAdminControlCommand.get_selected_artist_preset(
-                    platform, chat_id, model_name, self.get_config  # type: ignore[attr-defined]
+                selected_artist = NaiAdminControlCommand.resolve_artist_prompt(
+                    version.artist_presets, chat_state.artist_preset if chat_state is not None else None
                 )
                 if selected_artist:
                     merged_config["nai_artist_prompt"] = selected_artist
                     logger.info(f"{self._log_prefix} 使用用户选定的画师串: {selected_artist[:50]}...")
-        except Exception as exc:
-            logger.warning(f"{self._log_prefix} 获取用户选定画师串失败: {exc}")
+            except Exception as exc:
+                logger.warning(f"{self._log_prefix} 获取用户选定画师串失败: {exc}")
 
         # 应用尺寸选择
-        try:
-            if platform and chat_id:
-                from .nai_admin_command import NaiAdminControlCommand
-
-                selected_size = NaiAdminControlCommand.get_selected_size(platform, chat_id)
-                if selected_size:
-                    merged_config["nai_size"] = selected_size
-                    logger.info(f"{self._log_prefix} 使用用户选定的尺寸: {selected_size}")
-        except Exception as exc:
-            logger.warning(f"{self._log_prefix} 获取用户选定尺寸失败: {exc}")
+        if chat_state is not None and chat_state.size:
+            merged_config["nai_size"] = chat_state.size
+            logger.info(f"{self._log_prefix} 使用用户选定的尺寸: {chat_state.size}")
 
         return merged_config
 
-    def _get_version_config(self, model_name: str) -> Dict[str, Any]:
-        if not model_name:
-            return {}
-
-        if "nai-diffusion-3" in model_name:
-            config_section = "model_nai3"
-            logger.info(f"{self._log_prefix} 检测到 NAI V3 模型，使用 {config_section} 配置")
-        elif "nai-diffusion-4-5" in model_name:
-            config_section = "model_nai4_5"
-            logger.info(f"{self._log_prefix} 检测到 NAI V4.5 模型，使用 {config_section} 配置")
-        elif "nai-diffusion-4" in model_name:
-            config_section = "model_nai4"
-            logger.info(f"{self._log_prefix} 检测到 NAI V4 模型，使用 {config_section} 配置")
-        else:
-            return {}
-
-        return self.get_config(config_section, {})  # type: ignore[attr-defined]
+    def _apply_draft_preset(self, merged_config: Dict[str, Any]) -> None:
+        """用草图预设覆盖尺寸与步数，优先级高于会话选择"""
+        draft_size = merged_config.get("draft_size")
+        draft_steps = merged_config.get("draft_steps")
+        if draft_size:
+            merged_config["nai_size"] = draft_size
+        if draft_steps:
+            merged_config["num_inference_steps"] = draft_steps
+        logger.info(f"{self._log_prefix} 使用快速草图预设: 尺寸={draft_size}, 步数={draft_steps}")
+
+    def _get_version_config(self, model_name: str) -> Mapping[str, Any]:
+        """返回模型对应的版本配置节（只读），不支持的模型返回空字典"""
+        version = self.settings.version_for(model_name)
+        return version.config if version is not None else {}
 
     @property
     def _log_prefix(self) -> str:
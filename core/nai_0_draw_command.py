@@ -2,6 +2,7 @@
 """
 /nai0 命令：直接使用英文 tag 生成图片，不经过 LLM 处理
 """
+import random
 import time
 from typing import Tuple, Optional, Dict, Any
 
@@ -10,13 +11,16 @@ from src.common.logger import get_logger
 
 from .nai_web_client import NaiWebClient
 from .auto_recall_mixin import AutoRecallMixin
-from .image_url_helper import save_base64_image_to_file
+from .image_command_mixin import ImageCommandMixin, MAX_SEED, FAST_PREFIX_PATTERN
 from .model_config_mixin import ModelConfigMixin
+from .degradation import degradation
+from .request_hooks import instrument_execute
 
 logger = get_logger("nai_pic_plugin")
 
 
-class Nai0DrawCommand(ModelConfigMixin, AutoRecallMixin, BaseCommand):
+
+class Nai0DrawCommand(ImageCommandMixin, ModelConfigMixin, AutoRecallMixin, BaseCommand):
     """NovelAI 直接标签生图命令：/nai0 [英文tag]"""
 
     command_name = "nai_0_draw"
@@ -27,9 +31,11 @@ class Nai0DrawCommand(ModelConfigMixin, AutoRecallMixin, BaseCommand):
         super().__init__(*args, **kwargs)
         self.api_client = NaiWebClient(self)
 
+    @instrument_execute("nai0")
     async def execute(self) -> Tuple[bool, Optional[str], bool]:
         """执行 /nai0 命令"""
         logger.info(f"{self.log_prefix} 执行 /nai0 命令")
+        self._request_started = time.monotonic()
 
         # 检查用户权限
         has_permission = self._check_user_permission()
@@ -40,92 +46,47 @@ class Nai0DrawCommand(ModelConfigMixin, AutoRecallMixin, BaseCommand):
         # 获取用户输入的英文 tags
         tags = self.matched_groups.get("tags", "").strip()
 
+        # 快速草图模式：/nai0 fast <标签>
+        draft_mode = False
+        fast_match = FAST_PREFIX_PATTERN.match(tags)
+        if fast_match:
+            draft_mode = True
+            tags = fast_match.group("rest").strip()
+
+        # 批量模式：/nai0 x4 <标签>
+        batch_count, tags = await self._parse_batch_prefix(tags)
+
         if not tags:
             await self.send_text("请输入英文标签，例如：/nai0 hatsune miku, smile")
             return False, "未提供标签", True
 
+        # 上游排队过长或超出配额时直接拒绝，避免用户等到超时
+        rejected = await self._check_admission_and_quota("nai0", batch_count)
+        if rejected:
+            return False, rejected, True
+
         logger.info(f"{self.log_prefix} 用户输入的标签: {tags}")
 
         # 直接使用用户输入的 tags 作为提示词
         prompt = tags
 
         # 获取模型配置
-        model_config = self._get_model_config()
+        model_config = self._get_model_config(draft=draft_mode)
         if not model_config or not model_config.get("base_url"):
             await self.send_text("NovelAI 配置错误，请检查配置文件")
             return False, "配置错误", True
 
-        # 获取图片尺寸
-        image_size = model_config.get("nai_size") or model_config.get("default_size", "1024x1280")
+        # 负载较高时按策略降低步数与尺寸
+        model_config = degradation.apply(self, model_config)
 
-        # 显示处理信息
-        enable_debug = self.get_config("components.enable_debug_info", False)
-        if enable_debug:
-            await self.send_text(f"正在生成图片，请稍候...")
+        if batch_count > 1:
+            return await self._generate_batch_and_send(prompt, model_config, batch_count)
 
-        try:
-            # 调用 API 生成图片
-            success, result = self.api_client.generate_image(
-                prompt=prompt,
-                model_config=model_config,
-                size=image_size
-            )
-        except Exception as e:
-            logger.error(f"{self.log_prefix} 图片生成失败: {e!r}", exc_info=True)
-            await self.send_text(f"生成图片时出错: {str(e)[:100]}")
-            return False, f"生成失败: {e}", True
-
-        if success:
-            final_image_data = self._process_api_response(result)
-
-            if final_image_data:
-                send_time = time.time()
-
-                # 判断是 URL 还是 base64
-                if final_image_data.startswith(("http://", "https://")):
-                    # 直接发送图片 URL
-                    try:
-                        send_success = await self.send_custom("imageurl", final_image_data)
-                        if send_success:
-                            self._last_send_timestamp = send_time
-                            if enable_debug:
-                                await self.send_text("图片生成完成！")
-                            await self._schedule_auto_recall()
-                            return True, "图片生成成功", True
-                        else:
-                            await self.send_text("图片发送失败")
-                            return False, "发送失败", True
-                    except Exception as e:
-                        logger.error(f"{self.log_prefix} 图片URL发送失败: {e!r}")
-                        await self.send_text(f"图片发送失败: {str(e)[:100]}")
-                        return False, "发送失败", True
-                elif final_image_data.startswith(("iVBORw", "/9j/", "UklGR", "R0lGOD")):
-                    # Base64 格式 -> 保存为文件并以URL方式发送
-                    image_path = save_base64_image_to_file(final_image_data)
-                    if image_path:
-                        send_success = await self.send_custom("imageurl", f"file://{image_path}")
-                    else:
-                        logger.warning(f"{self.log_prefix} 图片保存失败，回退为Base64发送")
-                        send_success = await self.send_image(final_image_data)
-
-                    if send_success:
-                        self._last_send_timestamp = send_time
-                        if enable_debug:
-                            await self.send_text("图片生成完成！")
-                        await self._schedule_auto_recall()
-                        return True, "图片生成成功", True
-                    else:
-                        await self.send_text("图片发送失败")
-                        return False, "发送失败", True
-                else:
-                    await self.send_text("API 返回了无法识别的图片格式")
-                    return False, "数据格式错误", True
-            else:
-                await self.send_text("API 返回了无效的数据")
-                return False, "数据格式错误", True
-        else:
-            await self.send_text(f"生成图片失败：{result}")
-            return False, f"生成失败: {result}", True
+        if draft_mode:
+            model_config = dict(model_config)
+            model_config["seed"] = model_config.get("seed") or random.randint(1, MAX_SEED)
+
+        return await self._generate_and_send(prompt, model_config, draft_mode)
 
     def _process_api_response(self, result: str) -> Optional[str]:
         """处理 API 响应"""
@@ -146,7 +107,7 @@ class Nai0DrawCommand(ModelConfigMixin, AutoRecallMixin, BaseCommand):
     def _is_auto_recall_enabled(self, platform: str, chat_id: str) -> bool:
         """检查是否启用自动撤回"""
         from .nai_recall_command import NaiRecallControlCommand
-        return NaiRecallControlCommand.is_recall_enabled(platform, chat_id, self.get_config)
+        return NaiRecallControlCommand.is_recall_enabled(platform, chat_id, self.settings)
 
     def _check_user_permission(self) -> bool:
         """检查当前用户是否有权限使用生图命令"""
@@ -178,7 +139,7 @@ class Nai0DrawCommand(ModelConfigMixin, AutoRecallMixin, BaseCommand):
 
             # 检查用户权限
             return NaiAdminControlCommand.check_user_permission(
-                platform, chat_id, user_id, self.get_config
+                platform, chat_id, user_id, self.settings
             )
         except Exception as e:
             logger.error(f"{self.log_prefix} 检查用户权限时出错: {e}", exc_info=True)
@@ -7,23 +7,24 @@ from typing import Tuple, Optional
 from src.plugin_system.base.base_command import BaseCommand
 from src.common.logger import get_logger
 
+from . import runtime_stats
+from .admission import admission
+from .degradation import degradation
+from .chat_state import ChatState, chat_states
+from .plugin_settings import SIZE_MAPPINGS, PluginSettings, PluginSettingsMixin, parse_artist_presets, version_section_for
+from .metrics_history import format_report, metrics_history
+from .model_config_cache import model_config_cache
+from .quota import quota_manager
+from .recall_scheduler import scheduler as recall_scheduler
+from .request_profiler import ENTRIES as PROFILE_ENTRIES, request_profiler
+
 logger = get_logger("nai_admin_command")
 
 
-class NaiAdminControlCommand(BaseCommand):
+class NaiAdminControlCommand(PluginSettingsMixin, BaseCommand):
     """NAI 管理员模式控制命令"""
 
-    # 类级别的管理员模式状态
-    _admin_mode_enabled = {}
-
-    # 类级别的模型选择状态（会话级别）
-    _selected_models = {}
-
-    # 类级别的画师串选择状态（会话级别）
-    _selected_artist_presets = {}
-
-    # 类级别的尺寸选择状态（会话级别）
-    _selected_sizes = {}
+    # 会话级别的管理员模式、模型/画师串/尺寸选择保存在 chat_state 注册表中
 
     # 模型映射表
     MODEL_MAPPINGS = {
@@ -34,22 +35,12 @@ class NaiAdminControlCommand(BaseCommand):
     }
 
     # 尺寸映射表
-    SIZE_MAPPINGS = {
-        "竖": "832x1216",
-        "竖图": "832x1216",
-        "横": "1216x832",
-        "横图": "1216x832",
-        "方": "1024x1024",
-        "方图": "1024x1024",
-        "h": "1216x832",  # horizontal
-        "v": "832x1216",  # vertical
-        "s": "1024x1024", # square
-    }
+    SIZE_MAPPINGS = SIZE_MAPPINGS
 
     # Command基本信息
     command_name = "nai_admin_control_command"
-    command_description = "NAI管理员模式控制命令：/nai <st|sp|set|art|size|help>"
-    command_pattern = r"(?:.*，说：\s*)?/nai\s+(?P<action>st|sp|set|art|size|help)(?:\s+(?P<param>.+))?$"
+    command_description = "NAI管理员模式控制命令：/nai <st|sp|set|art|size|prof|report|quota|degrade|help>"
+    command_pattern = r"(?:.*，说：\s*)?/nai\s+(?P<action>st|sp|set|art|size|prof|report|quota|degrade|help)(?:\s+(?P<param>.+))?$"
 
     async def execute(self) -> Tuple[bool, Optional[str], bool]:
         """执行管理员模式控制命令"""
@@ -80,7 +71,8 @@ class NaiAdminControlCommand(BaseCommand):
             chat_id = user_info.user_id
             chat_type = "私聊"
 
-        current_chat_key = f"{platform}:{chat_id}"
+        chat_state = chat_states.get_or_create(platform, chat_id)
+        current_chat_key = chat_state.key
         user_id = user_info.user_id
 
         # help 命令对所有人开放，不需要权限检查
@@ -98,27 +90,45 @@ class NaiAdminControlCommand(BaseCommand):
                 await self.send_text("❌ 只有管理员可以开启/关闭管理员模式", storage_message=False)
                 return False, "没有管理员权限", True
 
+        # prof 性能剖析、report 运行报告、quota 配额管理、degrade 降级豁免始终需要管理员权限
+        elif action in ["prof", "report", "quota", "degrade"]:
+            if not is_admin:
+                await self.send_text("❌ 只有管理员可以使用此命令", storage_message=False)
+                return False, "没有管理员权限", True
+
         # set/art/size 操作根据管理员模式状态判断
         elif action in ["set", "art", "size"]:
             # 检查是否启用了管理员模式
-            admin_mode_enabled = self.is_admin_mode_enabled(platform, chat_id, self.get_config)
+            admin_mode_enabled = self.is_admin_mode_enabled(platform, chat_id, self.settings)
             if admin_mode_enabled and not is_admin:
                 await self.send_text("❌ 当前会话已开启管理员模式，仅管理员可使用此命令", storage_message=False)
                 return False, "没有权限", True
 
         # 执行具体操作
         if action == "set":
-            return await self._handle_set_model(current_chat_key, param)
+            return await self._handle_set_model(chat_state, param)
 
         if action == "art":
-            return await self._handle_set_artist(current_chat_key, param)
+            return await self._handle_set_artist(chat_state, param)
 
         if action == "size":
-            return await self._handle_set_size(current_chat_key, param)
+            return await self._handle_set_size(chat_state, param)
+
+        if action == "prof":
+            return await self._handle_profile(current_chat_key, param)
+
+        if action == "report":
+            return await self._handle_report()
+
+        if action == "quota":
+            return await self._handle_quota(platform, str(chat_id), str(user_id), param)
+
+        if action == "degrade":
+            return await self._handle_degrade(chat_state, chat_type, param)
 
         if action == "st":
             # 开启管理员模式
-            self._admin_mode_enabled[current_chat_key] = True
+            chat_states.update(chat_state, admin_mode=True)
             await self.send_text(
                 f"✅ 已在{chat_type}中开启NAI管理员模式\n"
                 f"🔒 现在所有NAI命令仅管理员可使用\n"
@@ -129,7 +139,7 @@ class NaiAdminControlCommand(BaseCommand):
 
         elif action == "sp":
             # 关闭管理员模式
-            self._admin_mode_enabled[current_chat_key] = False
+            chat_states.update(chat_state, admin_mode=False)
             await self.send_text(
                 f"✅ 已在{chat_type}中关闭NAI管理员模式\n"
                 f"🔓 现在所有人都可使用NAI命令\n"
@@ -146,6 +156,10 @@ class NaiAdminControlCommand(BaseCommand):
                 "/nai set <模型> - 切换生图模型 (3/f3/4/4.5)\n"
                 "/nai art <编号> - 切换画师风格预设\n"
                 "/nai size <尺寸> - 切换图片尺寸 (竖/横/方)\n"
+                "/nai prof <次数> - 剖析之后的生图请求（仅管理员可用）\n"
+                "/nai report - 查看运行报告（仅管理员可用）\n"
+                "/nai quota [reset] - 查看或清除生图配额计数（仅管理员可用）\n"
+                "/nai degrade [on|off] - 查看或切换本会话的负载降级（仅管理员可用）\n"
                 "/nai help - 查看所有命令帮助"
             )
             return False, "无效的操作参数", True
@@ -159,6 +173,9 @@ class NaiAdminControlCommand(BaseCommand):
   示例：/nai 画一张初音未来
 /nai0 <英文标签> - 直接使用英文标签生成图片
   示例：/nai0 1girl, hatsune miku, smile
+/nai fast <描述> - 快速生成低分辨率草图（/nai0 fast 同理）
+/nai refine - 使用上一张草图的提示词和种子生成高清版
+/nai x4 <描述> - 并发生成多张不同种子的变体并拼成一张网格图（/nai0 x4 同理）
 
 【模型管理】
 /nai set - 查看当前模型和可用模型列表
@@ -184,24 +201,33 @@ class NaiAdminControlCommand(BaseCommand):
 【管理员功能】（仅管理员可用）
 /nai st - 开启管理员模式（限制所有命令仅管理员使用）
 /nai sp - 关闭管理员模式（所有人可用）
+/nai prof <次数> [nai|nai0|action] [here|平台:会话ID] - 剖析之后匹配的生图请求
+/nai prof - 查看剖析状态；/nai prof off - 取消剖析
+/nai report - 查看最近 24 小时与 7 天的运行报告
+/nai quota - 查看本会话与自己的生图配额用量
+/nai quota reset [用户ID|all] - 清除本会话（或指定用户、全部）的配额计数
+/nai degrade off - 本会话不参与负载降级；/nai degrade on - 恢复
 
 【其他】
 /nai help - 显示此帮助信息
 
+⚠️ /nai 后紧跟 st、sp、set、art、size、prof、report、quota、degrade、help、on、off 时按命令处理，
+想画的内容以这些词开头时请在前面加字，例如：/nai 画 report 风格的海报
+
 💡 提示：管理员模式开启后，所有命令仅管理员可用"""
 
         await self.send_text(help_text)
         return True, "显示帮助信息", True
 
-    async def _handle_set_model(self, chat_key: str, model_key: str) -> Tuple[bool, Optional[str], bool]:
+    async def _handle_set_model(self, chat_state: ChatState, model_key: str) -> Tuple[bool, Optional[str], bool]:
         """处理模型切换命令"""
         if not model_key:
             # 显示当前模型和可用模型列表
-            current_model = self._selected_models.get(chat_key)
+            current_model = chat_state.model
             if current_model:
                 current_display = f"当前模型: {current_model}"
             else:
-                default_model = self.get_config("model.default_model", "nai-diffusion-4-5-full")
+                default_model = self.settings.default_model
                 current_display = f"当前使用默认模型: {default_model}"
 
             await self.send_text(
@@ -229,49 +255,38 @@ class NaiAdminControlCommand(BaseCommand):
 
         # 设置模型
         model_name = self.MODEL_MAPPINGS[model_key]
-        self._selected_models[chat_key] = model_name
+        chat_states.update(chat_state, model=model_name)
 
         await self.send_text(
             f"✅ 已切换到模型: {model_name}\n"
             f"代号: {model_key}"
         )
-        logger.info(f"{self.log_prefix} 会话 {chat_key} 已切换到模型 {model_name}")
+        logger.info(f"{self.log_prefix} 会话 {chat_state.key} 已切换到模型 {model_name}")
         return True, f"已切换到模型 {model_name}", True
 
-    async def _handle_set_artist(self, chat_key: str, preset_index: str) -> Tuple[bool, Optional[str], bool]:
+    async def _handle_set_artist(self, chat_state: ChatState, preset_index: str) -> Tuple[bool, Optional[str], bool]:
         """处理画师串切换命令"""
         # 获取当前使用的模型
-        current_model = self._selected_models.get(chat_key)
-        if not current_model:
-            current_model = self.get_config("model.default_model", "nai-diffusion-4-5-full")
+        settings = self.settings
+        current_model = chat_state.model or settings.default_model
 
         # 根据模型确定配置节
-        if "nai-diffusion-3" in current_model:
-            config_section = "model_nai3"
-            model_display = "NAI V3"
-        elif "nai-diffusion-4-5" in current_model:
-            config_section = "model_nai4_5"
-            model_display = "NAI V4.5"
-        elif "nai-diffusion-4" in current_model:
-            config_section = "model_nai4"
-            model_display = "NAI V4"
-        else:
+        resolved = version_section_for(current_model)
+        if resolved is None:
             await self.send_text("❌ 当前模型不支持画师串切换")
             return False, "模型不支持画师串", True
+        model_display = resolved[1]
 
-        # 获取画师串列表（原始格式）
-        artist_presets_raw = self.get_config(f"{config_section}.artist_presets", [])
-
-        if not artist_presets_raw:
+        # 画师串在编译配置时已解析（兼容新旧格式）
+        version = settings.version_for(current_model)
+        artist_presets = version.artist_presets if version is not None else ()
+        if not artist_presets:
             await self.send_text(f"❌ {model_display} 模型未配置画师串预设")
             return False, "未配置画师串", True
 
-        # 解析画师串列表，支持新旧格式
-        artist_presets = self._parse_artist_presets(artist_presets_raw)
-
         # 如果没有提供索引，显示列表
         if not preset_index:
-            current_index = self._selected_artist_presets.get(chat_key, 1)
+            current_index = chat_state.artist_preset or 1
             preset_list = "\n".join([
                 f"{'→ ' if i == current_index else '  '}{i}. {preset['name']}"
                 for i, preset in enumerate(artist_presets, 1)
@@ -299,7 +314,7 @@ class NaiAdminControlCommand(BaseCommand):
             return False, "无效的画师串编号", True
 
         # 设置画师串
-        self._selected_artist_presets[chat_key] = index
+        chat_states.update(chat_state, artist_preset=index)
         selected_preset = artist_presets[index - 1]
 
         await self.send_text(
@@ -307,14 +322,14 @@ class NaiAdminControlCommand(BaseCommand):
             f"名称: {selected_preset['name']}\n"
             f"模型: {model_display}"
         )
-        logger.info(f"{self.log_prefix} 会话 {chat_key} 已切换到画师串 #{index} ({selected_preset['name']})")
+        logger.info(f"{self.log_prefix} 会话 {chat_state.key} 已切换到画师串 #{index} ({selected_preset['name']})")
         return True, f"已切换到画师串 #{index}", True
 
-    async def _handle_set_size(self, chat_key: str, size_key: str) -> Tuple[bool, Optional[str], bool]:
+    async def _handle_set_size(self, chat_state: ChatState, size_key: str) -> Tuple[bool, Optional[str], bool]:
         """处理尺寸切换命令"""
         if not size_key:
             # 显示当前尺寸和可用尺寸列表
-            current_size = self._selected_sizes.get(chat_key)
+            current_size = chat_state.size
             if current_size:
                 # 反向查找尺寸的友好名称
                 size_name = "自定义"
@@ -349,7 +364,7 @@ class NaiAdminControlCommand(BaseCommand):
 
         # 设置尺寸
         size_value = self.SIZE_MAPPINGS[size_key]
-        self._selected_sizes[chat_key] = size_value
+        chat_states.update(chat_state, size=size_value)
 
         # 获取友好的尺寸名称
         size_names = {
@@ -363,13 +378,178 @@ class NaiAdminControlCommand(BaseCommand):
             f"✅ 已切换到: {size_display}\n"
             f"尺寸: {size_value}"
         )
-        logger.info(f"{self.log_prefix} 会话 {chat_key} 已切换到尺寸 {size_value}")
+        logger.info(f"{self.log_prefix} 会话 {chat_state.key} 已切换到尺寸 {size_value}")
         return True, f"已切换到尺寸 {size_value}", True
 
+    async def _handle_profile(self, current_chat_key: str, param: str) -> Tuple[bool, Optional[str], bool]:
+        """处理性能剖析命令：/nai prof <次数> [入口] [here|平台:会话ID]、/nai prof off、/nai prof"""
+        settings = self.settings.profiling
+        if not settings.enabled:
+            await self.send_text("❌ 性能剖析未启用（[profiling] enabled）", storage_message=False)
+            return False, "性能剖析未启用", True
+
+        tokens = param.split()
+        if not tokens:
+            arm = request_profiler.armed
+            if arm is None:
+                status = "当前没有布置剖析"
+            else:
+                status = f"剖析中：{arm.target}，剩余 {arm.remaining}/{arm.total} 次"
+            await self.send_text(
+                f"{status}\n已保存剖析 {request_profiler.captures} 次\n\n"
+                f"使用方法: /nai prof <次数> [{'|'.join(PROFILE_ENTRIES)}] [here|平台:会话ID]\n"
+                "/nai prof off - 取消剖析"
+            )
+            return True, "显示剖析状态", True
+
+        if tokens[0] == "off":
+            arm = request_profiler.disarm()
+            await self.send_text(
+                f"✅ 已取消剖析（{arm.target}，剩余 {arm.remaining} 次）" if arm else "当前没有布置剖析"
+            )
+            return True, "已取消剖析", True
+
+        try:
+            count = int(tokens[0])
+        except ValueError:
+            count = 0
+        if count < 1:
+            await self.send_text("❌ 剖析次数必须是正整数")
+            return False, "无效的剖析次数", True
+
+        entry, chat_key = None, None
+        for token in tokens[1:]:
+            if token in PROFILE_ENTRIES:
+                entry = token
+            elif token == "here":
+                chat_key = current_chat_key
+            elif ":" in token:
+                chat_key = token
+            else:
+                await self.send_text(f"❌ 无法识别的剖析条件: {token}\n可用入口: {'/'.join(PROFILE_ENTRIES)}")
+                return False, "无效的剖析条件", True
+
+        chat_stream = getattr(self.message, "chat_stream", None)
+        reply_stream_id = getattr(chat_stream, "stream_id", None)
+        arm = request_profiler.arm(count, entry, chat_key, str(reply_stream_id) if reply_stream_id else None)
+        limited = f"（单次最多 {settings.max_requests} 次）" if arm.total < count else ""
+        await self.send_text(
+            f"✅ 已布置性能剖析：{arm.target}，之后 {arm.total} 个请求{limited}\n"
+            f"📁 剖析文件保存在 data/profiles/，摘要会发到本会话\n"
+            f"⏱ {settings.expire_minutes} 分钟内未采满将自动取消"
+        )
+        logger.info(f"{self.log_prefix} 会话 {current_chat_key} 布置了性能剖析: {arm.target} x{arm.total}")
+        return True, "已布置性能剖析", True
+
+    async def _handle_report(self) -> Tuple[bool, Optional[str], bool]:
+        """处理运行报告命令：汇总最近 24 小时与 7 天的指标历史，并附上当前进程状态"""
+        settings = self.settings.metrics_history
+        lines = ["📈 NAI 运行报告"]
+        if settings.enabled:
+            # 7 天窗口不超过保留期；保留期只有 1 天时只显示一段
+            windows = sorted({24 * 60, min(7, max(1, settings.retention_days)) * 24 * 60})
+            for window_minutes in windows:
+                title = "最近 24 小时" if window_minutes == 24 * 60 else f"最近 {window_minutes // (24 * 60)} 天"
+                lines.extend(format_report(metrics_history.summarize(window_minutes), title))
+        else:
+            lines.append("指标历史未启用（[metrics_history] enabled），仅显示当前状态")
+        if self.settings.admission.enabled:
+            lines.append("【当前负载】")
+            lines.extend(admission.status_lines())
+        lines.append("【进程状态】")
+        recall = recall_scheduler.stats()
+        lines.append(f"  待撤回 {recall['pending']}（执行中 {recall['running']}），"
+                     f"撤回延迟 平均 {recall['lag_avg']:.1f}s / p95 {recall['lag_p95']:.1f}s / 最大 {recall['lag_max']:.1f}s")
+        memory = chat_states.memory_report()
+        lines.append(f"  会话状态 {memory['chats']}/{memory['max_chats']} 个，约 {memory['bytes'] / 1024:.1f}KB"
+                     f"（每个 {memory['bytes_per_chat']:.0f}B），已淘汰 {memory['evicted']}")
+        cache = model_config_cache.stats()
+        lines.append(f"  模型配置缓存 {cache['entries']} 项，启动以来命中率 {cache['hit_rate']:.1%}"
+                     f"（{cache['hits']}/{cache['hits'] + cache['misses']}）")
+        await self.send_text("\n".join(lines))
+        return True, "显示运行报告", True
+
+    async def _handle_quota(self, platform: str, chat_id: str, user_id: str,
+                            param: str) -> Tuple[bool, Optional[str], bool]:
+        """处理配额命令：/nai quota 查看用量，/nai quota reset [用户ID|all] 清除计数"""
+        settings = self.settings.quota
+        if not settings.enabled:
+            await self.send_text("❌ 生图配额未启用（[quota] enabled）", storage_message=False)
+            return False, "配额未启用", True
+
+        args = param.split()
+        if args and args[0] == "reset":
+            target = args[1] if len(args) > 1 else ""
+            if target == "all":
+                cleared = quota_manager.reset()
+                description = "全部"
+            elif target:
+                cleared = quota_manager.reset("user", f"{platform}:{target}")
+                description = f"用户 {target} "
+            else:
+                cleared = quota_manager.reset("chat", f"{platform}:{chat_id}")
+                description = "本会话"
+            await self.send_text(f"✅ 已清除{description}的配额计数（{cleared} 项）", storage_message=False)
+            logger.info(f"{self.log_prefix} 清除了{description}的配额计数")
+            return True, "已清除配额计数", True
+        if args:
+            await self.send_text("使用方法: /nai quota 查看用量；/nai quota reset [用户ID|all] 清除计数",
+                                 storage_message=False)
+            return False, "无效的配额参数", True
+
+        scope_names = {"user": "你", "chat": "本会话", "global": "全局"}
+        lines = ["🎫 生图配额用量"]
+        for scope, used, limit, window in quota_manager.usage(platform, chat_id, user_id):
+            lines.append(f"  {scope_names[scope]}：{used:.1f} / {limit} 张（{window / 60:g} 分钟内）")
+        if len(lines) == 1:
+            lines.append("  未配置任何限额")
+        if settings.exempt_admins:
+            lines.append("💡 管理员不受配额限制")
+        rejected = [
+            f"{scope_names[scope]} {runtime_stats.get_counter(f'quota.rejected.{scope}')}"
+            for scope in ("user", "chat", "global")
+        ]
+        lines.append(f"启动以来因超额拒绝：{'，'.join(rejected)}")
+        await self.send_text("\n".join(lines), storage_message=False)
+        return True, "显示配额用量", True
+
+    async def _handle_degrade(self, chat_state: ChatState, chat_type: str,
+                              param: str) -> Tuple[bool, Optional[str], bool]:
+        """处理负载降级命令：/nai degrade 查看状态，/nai degrade off|on 豁免或恢复本会话"""
+        if param == "off":
+            chat_states.update(chat_state, degrade_exempt=True)
+            await self.send_text(f"✅ 本{chat_type}已豁免负载降级，始终使用完整质量生成", storage_message=False)
+            logger.info(f"{self.log_prefix} {chat_type} {chat_state.key} 豁免负载降级")
+            return True, "已豁免负载降级", True
+
+        if param == "on":
+            chat_states.update(chat_state, degrade_exempt=None)
+            await self.send_text(f"✅ 本{chat_type}已恢复参与负载降级", storage_message=False)
+            logger.info(f"{self.log_prefix} {chat_type} {chat_state.key} 恢复负载降级")
+            return True, "已恢复负载降级", True
+
+        if param:
+            await self.send_text("使用方法: /nai degrade 查看状态；/nai degrade off 豁免本会话；/nai degrade on 恢复",
+                                 storage_message=False)
+            return False, "无效的降级参数", True
+
+        if not self.settings.degradation.enabled:
+            status = "未启用（[degradation] enabled）"
+        else:
+            status = f"已启用，当前负载程度 {degradation.current_level():.2f}"
+        exempt = "已豁免" if chat_state.degrade_exempt else "参与降级"
+        lines = [
+            f"📉 负载降级：{status}",
+            f"本{chat_type}：{exempt}",
+            f"启动以来降级生成 {runtime_stats.get_counter('degradation.applied')} 次",
+        ]
+        await self.send_text("\n".join(lines), storage_message=False)
+        return True, "显示降级状态", True
+
     def _check_admin_permission(self) -> bool:
         """检查当前用户是否是管理员"""
         try:
-            admin_users = self.get_config("admin.admin_users", [])
+            admin_users = self.settings.admin.admin_users
             if not admin_users:
                 # 如果未配置管理员列表，默认允许所有人管理
                 logger.warning(f"{self.log_prefix} 未配置管理员列表，允许所有人使用管理命令")
@@ -392,60 +572,32 @@ class NaiAdminControlCommand(BaseCommand):
 
     @staticmethod
     def _parse_artist_presets(presets_raw):
-        """
-        解析画师串预设列表，兼容新旧格式
-
-        新格式：[{"name": "风格名", "prompt": "画师串内容"}, ...]
-        旧格式：["画师串内容1", "画师串内容2", ...]
-
-        Returns:
-            List[Dict]: 统一返回 [{"name": "...", "prompt": "..."}, ...]
-        """
-        if not presets_raw:
-            return []
-
-        result = []
-        for i, preset in enumerate(presets_raw, 1):
-            if isinstance(preset, dict):
-                # 新格式：已经是字典
-                name = preset.get("name", f"画师串 {i}")
-                prompt = preset.get("prompt", "")
-                result.append({"name": name, "prompt": prompt})
-            elif isinstance(preset, str):
-                # 旧格式：纯字符串，自动生成名称
-                # 使用前30个字符作为默认名称
-                preview = preset[:30] + "..." if len(preset) > 30 else preset
-                result.append({"name": f"#{i} {preview}", "prompt": preset})
-            else:
-                logger.warning(f"跳过无效的画师串格式: {type(preset)}")
-                continue
-
-        return result
+        """解析画师串预设列表，兼容新旧格式，见 plugin_settings.parse_artist_presets"""
+        return parse_artist_presets(presets_raw)
 
     @classmethod
-    def is_admin_mode_enabled(cls, platform: str, chat_id: str, get_config_func) -> bool:
+    def is_admin_mode_enabled(cls, platform: str, chat_id: str, settings: PluginSettings) -> bool:
         """
         静态方法：检查指定会话是否启用了管理员模式
 
         Args:
             platform: 平台标识
             chat_id: 会话ID（可以是group_id或user_id）
-            get_config_func: 获取配置的函数
+            settings: 编译后的插件配置
 
         Returns:
             bool: 是否启用管理员模式
         """
-        current_chat_key = f"{platform}:{chat_id}"
-
         # 检查运行时覆盖
-        if current_chat_key in cls._admin_mode_enabled:
-            return cls._admin_mode_enabled[current_chat_key]
+        chat_state = chat_states.get(platform, chat_id)
+        if chat_state is not None and chat_state.admin_mode is not None:
+            return chat_state.admin_mode
 
         # 检查默认配置
-        return get_config_func("admin.default_admin_mode", False)
+        return settings.admin.default_admin_mode
 
     @classmethod
-    def check_user_permission(cls, platform: str, chat_id: str, user_id: str, get_config_func) -> bool:
+    def check_user_permission(cls, platform: str, chat_id: str, user_id: str, settings: PluginSettings) -> bool:
         """
         静态方法：检查用户是否有权限使用生图命令
 
@@ -453,18 +605,17 @@ class NaiAdminControlCommand(BaseCommand):
             platform: 平台标识
             chat_id: 会话ID（可以是group_id或user_id）
             user_id: 用户ID
-            get_config_func: 获取配置的函数
+            settings: 编译后的插件配置
 
         Returns:
             bool: 是否有权限
         """
         # 如果管理员模式未开启，所有人都有权限
-        if not cls.is_admin_mode_enabled(platform, chat_id, get_config_func):
+        if not cls.is_admin_mode_enabled(platform, chat_id, settings):
             return True
 
         # 管理员模式已开启，检查��否是管理员
-        admin_users = get_config_func("admin.admin_users", [])
-        return str(user_id) in admin_users
+        return settings.is_admin(user_id)
 
     @classmethod
     def get_selected_model(cls, platform: str, chat_id: str, get_config_func) -> Optional[str]:
@@ -479,11 +630,12 @@ class NaiAdminControlCommand(BaseCommand):
         Returns:
             Optional[str]: 选定的模型名称，如果未设置则返回 None
         """
-        current_chat_key = f"{platform}:{chat_id}"
-        return cls._selected_models.get(current_chat_key)
+        chat_state = chat_states.get(platform, chat_id)
+        return chat_state.model if chat_state is not None else None
 
     @classmethod
-    def get_selected_artist_preset(cls, platform: str, chat_id: str, model_name: str, get_config_func) -> Optional[str]:
+    def get_selected_artist_preset(cls, platform: str, chat_id: str, model_name: str,
+                                   settings: PluginSettings) -> Optional[str]:
         """
         静态方法：获取指定会话选定的画师串
 
@@ -491,35 +643,26 @@ class NaiAdminControlCommand(BaseCommand):
             platform: 平台标识
             chat_id: 会话ID（可以是group_id或user_id）
             model_name: 当前使用的模型名称
-            get_config_func: 获取配置的函数
+            settings: 编译后的插件配置
 
         Returns:
             Optional[str]: 选定的画师串内容，如果未设置则返回第一个预设（如果存在）
         """
-        current_chat_key = f"{platform}:{chat_id}"
-
-        # 根据模型确定配置节
-        if "nai-diffusion-3" in model_name:
-            config_section = "model_nai3"
-        elif "nai-diffusion-4-5" in model_name:
-            config_section = "model_nai4_5"
-        elif "nai-diffusion-4" in model_name:
-            config_section = "model_nai4"
-        else:
-            return None
-
-        # 获取画师串列表（原始格式）
-        artist_presets_raw = get_config_func(f"{config_section}.artist_presets", [])
-        if not artist_presets_raw:
-            return None
-
-        # 解析画师串列表，兼容新旧格式
-        artist_presets = cls._parse_artist_presets(artist_presets_raw)
-        if not artist_presets:
+        # 根据模型确定配置节，画师串在编译配置时已解析
+        version = settings.version_for(model_name)
+        if version is None or not version.artist_presets:
             return None
+        artist_presets = version.artist_presets
 
         # 获取选定的索引，默认为1（第一个）
-        selected_index = cls._selected_artist_presets.get(current_chat_key, 1)
+        chat_state = chat_states.get(platform, chat_id)
+        selected_index = chat_state.artist_preset if chat_state is not None else None
+        return cls.resolve_artist_prompt(artist_presets, selected_index)
+
+    @staticmethod
+    def resolve_artist_prompt(artist_presets, selected_index: Optional[int]) -> Optional[str]:
+        """按选定编号（从1开始，未选择时为第一个）返回画师串内容"""
+        selected_index = selected_index or 1
 
         # 确保索引有效，返回 prompt 内容
         if 1 <= selected_index <= len(artist_presets):
@@ -539,5 +682,5 @@ class NaiAdminControlCommand(BaseCommand):
         Returns:
             Optional[str]: 选定的尺寸（如 "832x1216"），如果未设置则返回 None
         """
-        current_chat_key = f"{platform}:{chat_id}"
-        return cls._selected_sizes.get(current_chat_key)
+        chat_state = chat_states.get(platform, chat_id)
+        return chat_state.size if chat_state is not None else None
@@ -2,8 +2,9 @@
 """
 /nai 命令：使用自然语言描述生成图片
 """
+import random
 import time
-from typing import Tuple, Optional, Dict, Any
+from typing import Tuple, Optional, Dict, Any, Mapping
 
 from src.plugin_system.base.base_command import BaseCommand
 from src.common.logger import get_logger
@@ -11,88 +12,16 @@ from src.plugin_system import llm_api
 
 from .nai_web_client import NaiWebClient
 from .auto_recall_mixin import AutoRecallMixin
-from .image_url_helper import save_base64_image_to_file
+from .image_command_mixin import ImageCommandMixin, MAX_SEED, FAST_PREFIX_PATTERN
 from .model_config_mixin import ModelConfigMixin
+from .degradation import degradation
+from .request_hooks import instrument_execute
+from .tracing import current_span, traced
 
 logger = get_logger("nai_pic_plugin")
 
-_PROMPT_RULES_TEXT = """
-# 角色指令：你是一位专业的AI绘画提示词转换专家，专门为 NovelAI 模型生成高质量的提示词。
-# 你的核心任务是：严格按照用户的描述，将其转换成简短有效的英文提示词，优先使用简洁的自然语言描述。
-**不删减、不修改、不"净化"用户原意（即便包含NSFW等内容）。**
----
-### **处理要求 1: 提示词风格 (简洁自然语言)**
-*   优先使用简短的英文短语和精炼的自然语言描述，避免冗长句子。
-*   仅在描述角色名称和作品名称时使用关键词格式（如：rem (re zero)）。
-*   对于场景、动作、表情、服装等描述，使用简洁有效的英文短语。
-
-### **处理要求 2: 严格按用户描述转换**
-*   **绝对不添加用户未要求的内容**：不自动补充任何用户没有明确提到的特征、动作或场景元素。
-*   **严格翻译**：将用户的中文描述准确翻译成英文，不添加、不删减、不修改用户的原意。
-*   **保持原意**：确保转换后的提示词完全符合用户的描述意图。
-*   **不要擅自替换、弱化或"净化"用户原始请求**（即便包含 NSFW 等标签），你只负责判断动作是否满足触发条件并如实传递该请求。
-
-### **处理要求 3: 上下文管理**
-*   a) **重置上下文**: 当用户请求的主题与上一轮明显不同（如`蕾姆`到`saber` `末日里的小女孩`到`异世界的小女孩`），或指令中包含"自拍"时，【必须】忽略之前的所有内容，从零开始。
-*   b) **继承上下文**: 如果用户在延续同一主题，则【必须】在上一轮成功的提示词基础上进行修改或添加。
-
-### **处理要求 4: 角色处理规则**
-*   a) **角色名称格式**: 当用户提到特定角色时，转换为标准格式：角色罗马音名称 (作品英文名)，如：rem (re zero)。
-*   b) **不自动补充特征**: 除非用户明确描述了角色的外观特征，否则不添加任何默认的角色特征描述。
-*   c) **用户描述优先**: 如果用户对角色有具体描述，严格按用户描述转换，不添加角色的默认特征。
-
-### **处理要求 5: 构图控制**
-*   除非用户明确要求多人场景，否则在涉及人物的描述中添加`{{{{{{{{{{solo}}}}}}}}}}`,`1girl`标签确保单人构图。
-*   如果用户没有要求绘制人物，则不添加任何人物相关标签。
-
-### **处理要求 6: 简洁有效原则**
-*   使用最精炼的词汇表达完整含义。
-*   避免重复和冗余描述。
-*   每个词汇都应该有明确的视觉表现作用。
-
-### **处理要求 7: 严格禁止**
-*   **禁止输出非提示词内容**: 只输出纯粹的英文提示词。
-*   **禁止添加质量词**: 不自动添加 masterpiece, best quality, 8k 等质量标签。
-*   **禁止自主发挥**: 严格按照用户描述转换，不添加任何个人理解或补充。
-
----
-### **# 示例 (简洁自然语言)**
-
-#### **示例 1: 简单场景描述**
-*   **用户输入**: "画一个女孩在雨中哭泣"
-*   **输出**: `girl crying in rain, {{{{{{{{{{solo}}}}}}}}}}, 1girl`
-
-#### **示例 2: 角色 + 用户具体描述**
-*   **用户输入**: "画雷姆穿着白色连衣裙站在花园里"
-*   **输出**: `rem (re zero) in white dress, standing in garden, {{{{{{{{{{solo}}}}}}}}}}, 1girl`
-
-#### **示例 3: 自然语言场景**
-*   **用户输入**: "画一个宇航员在红色星球上发现发光的花"
-*   **输出**: `astronaut discovering glowing flower on red planet, {{{{{{{{{{solo}}}}}}}}}}, 1girl`
-
-#### **示例 4: 角色但无额外描述**
-*   **用户输入**: "画初音未来"
-*   **输出**: `hatsune miku (vocaloid), {{{{{{{{{{solo}}}}}}}}}}, 1girl`
-
-#### **示例 5: 非人物场景**
-*   **用户输入**: "画一个美丽的日落海滩"
-*   **输出**: `beautiful sunset beach, golden light on waves`
-
-#### **示例 6: 复杂场景简化**
-*   **用户输入**: "画一个穿着校服的女学生坐在教室里看书"
-*   **输出**: `schoolgirl in uniform reading book in classroom, {{{{{{{{{{solo}}}}}}}}}}, 1girl`
-""".strip()
-
-_PROMPT_GENERATOR_TEMPLATE = f"""
-{_PROMPT_RULES_TEXT}
-
-【用户描述】
-<<USER_REQUEST>>
-<<SELFIE_HINT>>
-""".strip()
-
-
-class NaiDrawCommand(ModelConfigMixin, AutoRecallMixin, BaseCommand):
+
+class NaiDrawCommand(ImageCommandMixin, ModelConfigMixin, AutoRecallMixin, BaseCommand):
     """NovelAI 快速生图命令：/nai [描述]"""
 
     command_name = "nai_draw"
@@ -103,9 +32,11 @@ class NaiDrawCommand(ModelConfigMixin, AutoRecallMixin, BaseCommand):
         super().__init__(*args, **kwargs)
         self.api_client = NaiWebClient(self)
 
+    @instrument_execute("nai")
     async def execute(self) -> Tuple[bool, Optional[str], bool]:
         """执行 /nai 命令"""
         logger.info(f"{self.log_prefix} 执行 /nai 命令")
+        self._request_started = time.monotonic()
 
         # 检查用户权限
         has_permission = self._check_user_permission()
@@ -116,10 +47,29 @@ class NaiDrawCommand(ModelConfigMixin, AutoRecallMixin, BaseCommand):
         # 获取用户输入的描述
         description = self.matched_groups.get("description", "").strip()
 
+        # 高清重绘上一张草图
+        if description.lower() == "refine":
+            return await self._execute_refine()
+
+        # 快速草图模式：/nai fast <描述>
+        draft_mode = False
+        fast_match = FAST_PREFIX_PATTERN.match(description)
+        if fast_match:
+            draft_mode = True
+            description = fast_match.group("rest").strip()
+
+        # 批量模式：/nai x4 <描述>
+        batch_count, description = await self._parse_batch_prefix(description)
+
         if not description:
             await self.send_text("请输入你想画的内容，例如：/nai 画一张初音未来")
             return False, "未提供描述", True
 
+        # 准入与配额检查放在生成提示词之前，被拒绝的请求不产生 LLM 与上游开销
+        rejected = await self._check_admission_and_quota("nai", batch_count)
+        if rejected:
+            return False, rejected, True
+
         # 检测是否为自拍模式
         selfie_mode = "自拍" in description or "selfie" in description.lower()
 
@@ -138,89 +88,56 @@ class NaiDrawCommand(ModelConfigMixin, AutoRecallMixin, BaseCommand):
             generated_prompt = self._process_selfie_prompt(generated_prompt)
 
         # 获取模型配置
-        model_config = self._get_model_config()
+        model_config = self._get_model_config(draft=draft_mode)
         if not model_config or not model_config.get("base_url"):
             await self.send_text("NovelAI 配置错误，请检查配置文件")
             return False, "配置错误", True
 
-        # 获取图片尺寸
-        image_size = model_config.get("nai_size") or model_config.get("default_size", "1024x1280")
+        # 负载较高时按策略降低步数与尺寸
+        model_config = degradation.apply(self, model_config)
 
-        # 显示处理信息
-        enable_debug = self.get_config("components.enable_debug_info", False)
-        if enable_debug:
-            await self.send_text(f"正在生成图片，请稍候...")
+        if batch_count > 1:
+            return await self._generate_batch_and_send(generated_prompt, model_config, batch_count)
 
-        try:
-            # 调用 API 生成图片
-            success, result = self.api_client.generate_image(
-                prompt=generated_prompt,
-                model_config=model_config,
-                size=image_size
-            )
-        except Exception as e:
-            logger.error(f"{self.log_prefix} 图片生成失败: {e!r}", exc_info=True)
-            await self.send_text(f"生成图片时出错: {str(e)[:100]}")
-            return False, f"生成失败: {e}", True
-
-        if success:
-            final_image_data = self._process_api_response(result)
-
-            if final_image_data:
-                send_time = time.time()
-
-                # 判断是 URL 还是 base64
-                if final_image_data.startswith(("http://", "https://")):
-                    # 直接发送图片 URL（参考 lolicon 插件）
-                    try:
-                        send_success = await self.send_custom("imageurl", final_image_data)
-                        if send_success:
-                            self._last_send_timestamp = send_time
-                            if enable_debug:
-                                await self.send_text("图片生成完成！")
-                            await self._schedule_auto_recall()
-                            return True, "图片生成成功", True
-                        else:
-                            await self.send_text("图片发送失败")
-                            return False, "发送失败", True
-                    except Exception as e:
-                        logger.error(f"{self.log_prefix} 图片URL发送失败: {e!r}")
-                        await self.send_text(f"图片发送失败: {str(e)[:100]}")
-                        return False, "发送失败", True
-                elif final_image_data.startswith(("iVBORw", "/9j/", "UklGR", "R0lGOD")):
-                    # Base64 格式 -> 保存为文件并以URL方式发送
-                    image_path = save_base64_image_to_file(final_image_data)
-                    if image_path:
-                        send_success = await self.send_custom("imageurl", f"file://{image_path}")
-                    else:
-                        logger.warning(f"{self.log_prefix} 图片保存失败，回退为Base64发送")
-                        send_success = await self.send_image(final_image_data)
-
-                    if send_success:
-                        self._last_send_timestamp = send_time
-                        if enable_debug:
-                            await self.send_text("图片生成完成！")
-                        await self._schedule_auto_recall()
-                        return True, "图片生成成功", True
-                    else:
-                        await self.send_text("图片发送失败")
-                        return False, "发送失败", True
-                else:
-                    await self.send_text("API 返回了无法识别的图片格式")
-                    return False, "数据格式错误", True
-            else:
-                await self.send_text("API 返回了无效的数据")
-                return False, "数据格式错误", True
-        else:
-            await self.send_text(f"生成图片失败：{result}")
-            return False, f"生成失败: {result}", True
+        if draft_mode:
+            model_config = dict(model_config)
+            model_config["seed"] = model_config.get("seed") or random.randint(1, MAX_SEED)
 
+        return await self._generate_and_send(generated_prompt, model_config, draft_mode)
+
+    async def _execute_refine(self) -> Tuple[bool, Optional[str], bool]:
+        """使用上一张草图的提示词与种子生成完整质量的图片"""
+        platform, chat_id, _ = self._get_chat_identity()
+        draft = self.get_last_draft(platform, chat_id)
+        if not draft:
+            await self.send_text("当前会话没有可重绘的草图，请先使用 /nai fast <描述> 生成草图")
+            return False, "没有草图", True
+
+        rejected = await self._check_admission_and_quota("nai", 1)
+        if rejected:
+            return False, rejected, True
+
+        model_config = self._get_model_config()
+        if not model_config or not model_config.get("base_url"):
+            await self.send_text("NovelAI 配置错误，请检查配置文件")
+            return False, "配置错误", True
+
+        model_config = dict(model_config)
+        model_config["seed"] = draft["seed"]
+        logger.info(f"{self.log_prefix} 高清重绘草图，种子={draft['seed']}")
+        return await self._generate_and_send(draft["prompt"], model_config, False)
+
+    @traced("llm.prompt")
     async def _generate_prompt_with_llm(self, selfie_mode: bool, request_text: str) -> Optional[str]:
         """使用 LLM 生成英文提示词"""
         generator_config = self._get_prompt_generator_config()
 
         # 准备提示词模板
-        prompt_template = generator_config.get("prompt_template") or _PROMPT_GENERATOR_TEMPLATE
+        prompt_template = generator_config.get("prompt_template")
+        if not prompt_template:
+            from .prompt_templates import get_prompt_generator_template
+
+            prompt_template = get_prompt_generator_template("command")
         prompt = self._render_generator_prompt(prompt_template, request_text, selfie_mode)
 
         # 获取 LLM 模型配置
@@ -243,6 +160,7 @@ class NaiDrawCommand(ModelConfigMixin, AutoRecallMixin, BaseCommand):
         except Exception as e:
             logger.error(f"{self.log_prefix} LLM 调用失败: {e}", exc_info=True)
             return None
+        current_span().set(**{"llm.model": model_name or "", "llm.success": bool(success and response)})
 
         if not success or not response:
             logger.error(f"{self.log_prefix} LLM 生成失败")
@@ -295,13 +213,9 @@ class NaiDrawCommand(ModelConfigMixin, AutoRecallMixin, BaseCommand):
             cleaned = cleaned[1:-1].strip()
         return cleaned
 
-    def _get_prompt_generator_config(self) -> Dict[str, Any]:
+    def _get_prompt_generator_config(self) -> Mapping[str, Any]:
         """获取提示词生成器配置"""
-        config = self.get_config("prompt_generator", None)
-        if config:
-            return config
-        legacy = self.get_config("prompt_fallback", None)
-        return legacy or {}
+        return self.settings.prompt_generator
 
     def _process_api_response(self, result: str) -> Optional[str]:
         """处理 API 响应"""
@@ -331,7 +245,7 @@ class NaiDrawCommand(ModelConfigMixin, AutoRecallMixin, BaseCommand):
     def _is_auto_recall_enabled(self, platform: str, chat_id: str) -> bool:
         """检查是否启用自动撤回"""
         from .nai_recall_command import NaiRecallControlCommand
-        return NaiRecallControlCommand.is_recall_enabled(platform, chat_id, self.get_config)
+        return NaiRecallControlCommand.is_recall_enabled(platform, chat_id, self.settings)
 
     def _check_user_permission(self) -> bool:
         """检查当前用户是否有权限使用生图命令"""
@@ -363,7 +277,7 @@ class NaiDrawCommand(ModelConfigMixin, AutoRecallMixin, BaseCommand):
 
             # 检查用户权限
             return NaiAdminControlCommand.check_user_permission(
-                platform, chat_id, user_id, self.get_config
+                platform, chat_id, user_id, self.settings
             )
         except Exception as e:
             logger.error(f"{self.log_prefix} 检查用户权限时出错: {e}", exc_info=True)
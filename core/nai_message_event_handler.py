@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""
+事件处理器：
+1. 把发出的图片消息写入消息ID索引，供自动撤回直接解析
+2. 启动时恢复上次未完成的自动撤回
+3. 停止时写入尚未落盘的会话设置、追踪与指标历史，关闭流量记录文件
+4. 启动时开始监视配置文件，修改后热重载
+"""
+from typing import Any, Optional
+
+from src.plugin_system.base.base_events_handler import BaseEventHandler
+from src.plugin_system.base.component_types import EventType
+from src.common.logger import get_logger
+
+from .chat_state import chat_states
+from .config_watcher import config_watcher
+from .image_pipeline_mixin import shutdown_process_pool
+from .message_id_resolver import resolver
+from .metrics_history import metrics_history
+from .recall_scheduler import scheduler as recall_scheduler
+from .tracing import tracer
+from .traffic_recorder import traffic_recorder
+
+logger = get_logger("pic_auto_recall")
+
+_IMAGE_SEGMENT_TYPES = {"image", "imageurl", "emoji"}
+
+
+def _has_image_segment(segments: Any) -> bool:
+    """递归检查消息段中是否包含图片"""
+    if not segments:
+        return False
+    if not isinstance(segments, (list, tuple)):
+        segments = [segments]
+    for seg in segments:
+        seg_type = seg.get("type") if isinstance(seg, dict) else getattr(seg, "type", None)
+        if seg_type in _IMAGE_SEGMENT_TYPES:
+            return True
+        if seg_type == "seglist":
+            data = seg.get("data") if isinstance(seg, dict) else getattr(seg, "data", None)
+            if _has_image_segment(data):
+                return True
+    return False
+
+
+def _base_info_field(message: Any, field: str) -> Optional[Any]:
+    base_info = getattr(message, "message_base_info", None) or {}
+    value = base_info.get(field) if isinstance(base_info, dict) else None
+    if value is None:
+        value = getattr(message, field, None)
+    return value
+
+
+class NaiOutboundMessageHandler(BaseEventHandler):
+    """订阅消息发送后事件，记录图片消息的ID与发送时间"""
+
+    event_type = EventType.AFTER_SEND
+    handler_name = "nai_outbound_message_index"
+    handler_description = "记录发出的图片消息ID，供NAI自动撤回解析"
+    weight = 0
+    intercept_message = False
+
+    async def execute(self, message):
+        try:
+            if message is not None and _has_image_segment(getattr(message, "message_segments", None)):
+                stream_id = getattr(message, "stream_id", None) or _base_info_field(message, "stream_id")
+                message_id = _base_info_field(message, "message_id")
+                if stream_id and message_id:
+                    resolver.observe(
+                        str(stream_id),
+                        str(message_id),
+                        _base_info_field(message, "time"),
+                        str(_base_info_field(message, "user_id") or ""),
+                    )
+        except Exception as exc:
+            logger.debug(f"记录发送消息ID失败: {exc!r}")
+        return True, True, None, None, None
+
+
+class NaiRecallReplayHandler(BaseEventHandler):
+    """启动时载入撤回日志，补做重启前尚未执行的自动撤回"""
+
+    event_type = EventType.ON_START
+    handler_name = "nai_recall_replay"
+    handler_description = "恢复重启前未完成的NAI自动撤回"
+    weight = 0
+    intercept_message = False
+
+    async def execute(self, message):
+        try:
+            recall_scheduler.ensure_started()
+        except Exception as exc:
+            logger.warning(f"恢复自动撤回任务失败: {exc!r}")
+        return True, True, None, None, None
+
+
+class NaiConfigWatchHandler(BaseEventHandler):
+    """启动时开始监视 config.toml，修改后无需重启即可生效"""
+
+    event_type = EventType.ON_START
+    handler_name = "nai_config_watch"
+    handler_description = "监视NAI插件配置文件并热重载"
+    weight = 0
+    intercept_message = False
+
+    async def execute(self, message):
+        try:
+            config_watcher.ensure_started()
+        except Exception as exc:
+            logger.warning(f"启动配置文件监视失败: {exc!r}")
+        return True, True, None, None, None
+
+
+class NaiChatSettingsFlushHandler(BaseEventHandler):
+    """停止时把尚未写入的会话设置与撤回日志落盘"""
+
+    event_type = EventType.ON_STOP
+    handler_name = "nai_chat_settings_flush"
+    handler_description = "停止时保存NAI会话设置"
+    weight = 0
+    intercept_message = False
+
+    async def execute(self, message):
+        config_watcher.stop()
+        traffic_recorder.close()
+        tracer.flush()
+        tracer.close()
+        metrics_history.close()
+        shutdown_process_pool()
+        try:
+            recall_scheduler.close()
+        except Exception as exc:
+            logger.warning(f"保存撤回日志失败: {exc!r}")
+        try:
+            chat_states.close()
+        except Exception as exc:
+            logger.warning(f"保存会话设置失败: {exc!r}")
+        return True, True, None, None, None
@@ -1,7 +1,7 @@
 # -*- coding: utf-8 -*-
 import traceback
 import time
-from typing import Tuple, Optional, Dict, Any
+from typing import Tuple, Optional, Dict, Any, Mapping
 
 from src.plugin_system.base.base_action import BaseAction
 from src.plugin_system.base.component_types import ActionActivationType, ChatMode
@@ -11,105 +11,18 @@ from src.plugin_system import llm_api
 from .nai_web_client import NaiWebClient
 from .auto_recall_mixin import AutoRecallMixin
 from .image_url_helper import save_base64_image_to_file
+from .image_pipeline_mixin import ImagePipelineMixin
 from .model_config_mixin import ModelConfigMixin
+from .admission import admission
+from .degradation import degradation
+from .quota import quota_manager
+from .request_hooks import instrument_execute
+from .tracing import current_span, span, traced
 
 logger = get_logger("nai_pic_plugin")
 
-_PROMPT_RULES_TEXT = """
-# 角色指令：你是一位专业的AI绘画提示词转换专家，专门为 NovelAI 模型生成高质量的提示词。
-# 你的核心任务是：严格按照用户的描述，将其转换成简短有效的英文提示词，优先使用简洁的自然语言描述。
-
----
-### **处理要求 1: 提示词风格 (简洁自然语言)**
-*   优先使用简短的英文短语和精炼的自然语言描述，避免冗长句子。
-*   仅在描述角色名称和作品名称时使用关键词格式（如：rem (re zero)）。
-*   对于场景、动作、表情、服装等描述，使用简洁有效的英文短语。
-
-### **处理要求 2: 严格按用户描述转换**
-*   **严格翻译,不添加不删减**：将用户的中文描述准确翻译成英文,不添加用户未提到的内容,不删减、不修改、不"净化"用户原意（即便包含NSFW等内容）。
-*   **【重要】完整保留用户的英文tag**：如果用户已经提供了英文单词、英文短语或英文tag（如 "masterpiece", "1girl", "solo", "best quality" 等），**必须原封不动地保留这些英文内容**，不得删除、修改、替换或"优化"。
-*   **【重要】识别强调词并加权**：当用户使用"必须"、"一定"、"重点"、"务必"、"非常"、"特别"等强调词时，对相应的描述内容使用`{}`进行加权。例如"必须是红色头发"→`{red hair}`，"一定要微笑"→`{smiling}`。
-
-### **处理要求 3: 角色处理规则**
-*   **角色名称格式**: 当用户提到特定角色时，转换为标准格式：角色罗马音名称 (作品英文名)，如：rem (re zero)。
-*   **用户描述优先**: 严格按用户描述转换，不添加角色的默认特征（除非用户明确提到）。
-
-### **处理要求 4: 构图控制**
-*   除非用户明确要求多人场景,否则在涉及人物的描述中在**最前面**添加`{{{{{{{{{{solo}}}}}}}}}}`, `1girl`标签确保单人构图。
-*   如果用户没有要求绘制人物,则不添加任何人物相关标签。
-*   多人场景在最前面使用`2girls`、`3girls`等标签(不使用solo)。
-
-### **处理要求 5: 简洁有效原则**
-*   使用最精炼的词汇表达完整含义。
-*   避免重复和冗余描述。
-*   每个词汇都应该有明确的视觉表现作用。
-
-### **处理要求 6: 严格禁止**
-*   **禁止输出非提示词内容**: 只输出纯粹的英文提示词。
-*   **禁止添加质量词**: 不自动添加 masterpiece, best quality, 8k 等质量标签。
-*   **禁止自主发挥**: 严格按照用户描述转换，不添加任何个人理解或补充。
-
----
-### **# 示例**
-
-#### **示例 1: 简单场景描述**
-*   **用户输入**: "画一个女孩在雨中哭泣"
-*   **输出**: `{{{{{{{{{{solo}}}}}}}}}}, 1girl, girl crying in rain`
-
-#### **示例 2: 角色 + 用户具体描述**
-*   **用户输入**: "画雷姆穿着白色连衣裙站在花园里"
-*   **输出**: `{{{{{{{{{{solo}}}}}}}}}}, 1girl, rem (re zero) in white dress, standing in garden`
-
-#### **示例 3: 角色但无额外描述**
-*   **用户输入**: "画初音未来"
-*   **输出**: `{{{{{{{{{{solo}}}}}}}}}}, 1girl, hatsune miku (vocaloid)`
-
-#### **示例 4: 非人物场景**
-*   **用户输入**: "画一个美丽的日落海滩"
-*   **输出**: `beautiful sunset beach, golden light on waves`
-
-#### **示例 5: 用户提供英文tag**
-*   **用户输入**: "masterpiece, best quality, 1girl, 蕾姆穿着白色连衣裙"
-*   **输出**: `masterpiece, best quality, 1girl, {{{{{{{{{{solo}}}}}}}}}}, rem (re zero) in white dress`
-
-#### **示例 6: 混合中英文描述**
-*   **用户输入**: "画一个女孩在雨中, crying, wet clothes"
-*   **输出**: `{{{{{{{{{{solo}}}}}}}}}}, 1girl, girl in rain, crying, wet clothes`
-
-#### **示例 7: 用户提供完整英文提示词**
-*   **用户输入**: "solo, 1girl, long hair, blue eyes, standing in garden"
-*   **输出**: `solo, 1girl, long hair, blue eyes, standing in garden`
-
-#### **示例 8: 用户使用强调词**
-*   **用户输入**: "画蕾姆,必须是蓝色头发,一定要微笑"
-*   **输出**: `{{{{{{{{{{solo}}}}}}}}}}, 1girl, rem (re zero), {blue hair}, {smiling}`
-
-#### **示例 9: 英文tag + 强调词组合**
-*   **用户输入**: "masterpiece, 1girl, 画一个女孩,重点突出红色眼睛"
-*   **输出**: `masterpiece, 1girl, {{{{{{{{{{solo}}}}}}}}}}, girl, {red eyes}`
-
-#### **示例 10: 多人场景**
-*   **用户输入**: "画蕾姆和拉姆两个人站在一起"
-*   **输出**: `2girls, rem (re zero), ram (re zero), standing together`
-
-#### **示例 11: 上下文相关描述（简短但包含场景）**
-*   **用户输入**: "bot在洗澡时的自拍"
-*   **输出**: `{{{{{{{{{{solo}}}}}}}}}}, 1girl, girl taking selfie while bathing, bathroom, water, wet`
-
-#### **示例 12: 直接详细描述**
-*   **用户输入**: "画一张初音未来，穿着校服，白色长袜，在教室里"
-*   **输出**: `{{{{{{{{{{solo}}}}}}}}}}, 1girl, hatsune miku (vocaloid), school uniform, white thigh-highs, in classroom`
-""".strip()
-
-_PROMPT_GENERATOR_TEMPLATE = f"""
-{_PROMPT_RULES_TEXT}
-
-【用户描述】
-<<USER_REQUEST>>
-<<SELFIE_HINT>>
-""".strip()
-
-class NaiPicAction(ModelConfigMixin, AutoRecallMixin, BaseAction):
+
+class NaiPicAction(ModelConfigMixin, ImagePipelineMixin, AutoRecallMixin, BaseAction):
     """NovelAI Web 图片生成动作"""
 
     # 激活设置
@@ -179,6 +92,7 @@ class NaiPicAction(ModelConfigMixin, AutoRecallMixin, BaseAction):
         super().__init__(*args, **kwargs)
         self.api_client = NaiWebClient(self)
 
+    @instrument_execute("action")
     async def execute(self) -> Tuple[bool, Optional[str]]:
         """执行 NovelAI Web 图片生成"""
         logger.info(f"{self.log_prefix} 执行 NovelAI Web 图片生成动作")
@@ -195,6 +109,18 @@ class NaiPicAction(ModelConfigMixin, AutoRecallMixin, BaseAction):
         selfie_mode_raw = self.action_data.get("selfie_mode", False)
         selfie_mode = self._normalize_bool(selfie_mode_raw)
 
+        # 上游排队过长时直接拒绝，避免用户等到超时
+        admission_message = admission.admit(self, "action")
+        if admission_message:
+            await self.send_text(admission_message, storage_message=False)
+            return False, "排队过长"
+
+        # 配额检查放在生成提示词之前，超限的请求不产生 LLM 与上游开销
+        quota_message = quota_manager.check_component(self)
+        if quota_message:
+            await self.send_text(quota_message, storage_message=False)
+            return False, "超出配额"
+
         # 始终使用LLM生成提示词
         generated_prompt = await self._generate_prompt_with_llm(selfie_mode, description)
         if generated_prompt:
@@ -232,17 +158,26 @@ class NaiPicAction(ModelConfigMixin, AutoRecallMixin, BaseAction):
             logger.error(f"{self.log_prefix} base_url 未配置")
             return False, "base_url 未配置"
 
+        # 负载较高时按策略降低步数与尺寸；降级后的尺寸写在 nai_size 中
+        degraded_config = degradation.apply(self, model_config, size)
+        if degraded_config is not model_config:
+            model_config, size = degraded_config, ""
+
         # 获取尺寸配置
         image_size = size or model_config.get("nai_size") or model_config.get("default_size", "")
+        image_size, upscale_target = self._resolve_upscale_plan(image_size)
+        if upscale_target:
+            model_config = dict(model_config)
+            model_config["nai_size"] = image_size
 
         # 显示处理信息
-        enable_debug = self.get_config("components.enable_debug_info", False)
+        enable_debug = self.settings.components.enable_debug_info
         if enable_debug:
             await self.send_text(f"收到！正在使用 NovelAI Web 生成图片，请稍候...")
 
         try:
             # 调用API客户端生成图片
-            success, result = self.api_client.generate_image(
+            success, result = await self.api_client.generate_image_async(
                 prompt=description,
                 model_config=model_config,
                 size=image_size
@@ -259,14 +194,19 @@ class NaiPicAction(ModelConfigMixin, AutoRecallMixin, BaseAction):
             if final_image_data:
                 if final_image_data.startswith(("iVBORw", "/9j/", "UklGR", "R0lGOD")):  # Base64
                     temp_message_id = f"send_api_{int(time.time() * 1000)}"
+                    if upscale_target:
+                        final_image_data = await self._upscale_image_base64(final_image_data, upscale_target)
+                    final_image_data = await self._postprocess_image_base64(final_image_data)
                     send_time = time.time()
                     image_path = save_base64_image_to_file(final_image_data)
                     image_content = f"file://{image_path}" if image_path else None
                     if image_content:
-                        send_success = await self.send_custom("imageurl", image_content)
+                        with span("send", type="imageurl", source="file"):
+                            send_success = await self.send_custom("imageurl", image_content)
                     else:
                         logger.warning(f"{self.log_prefix} 图片保存失败，回退为Base64发送")
-                        send_success = await self.send_image(final_image_data)
+                        with span("send", type="image", source="base64"):
+                            send_success = await self.send_image(final_image_data)
 
                     if send_success:
                         self._last_send_timestamp = send_time
@@ -280,7 +220,8 @@ class NaiPicAction(ModelConfigMixin, AutoRecallMixin, BaseAction):
                 elif final_image_data.startswith(("http://", "https://")):
                     send_time = time.time()
                     try:
-                        send_success = await self.send_custom("imageurl", final_image_data)
+                        with span("send", type="imageurl", source="url"):
+                            send_success = await self.send_custom("imageurl", final_image_data)
                         if send_success:
                             self._last_send_timestamp = send_time
                             if enable_debug:
@@ -334,7 +275,7 @@ class NaiPicAction(ModelConfigMixin, AutoRecallMixin, BaseAction):
     def _is_auto_recall_enabled(self, platform: str, chat_id: str) -> bool:
         """供自动撤回Mixin调用"""
         from .nai_recall_command import NaiRecallControlCommand
-        return NaiRecallControlCommand.is_recall_enabled(platform, chat_id, self.get_config)
+        return NaiRecallControlCommand.is_recall_enabled(platform, chat_id, self.settings)
 
     def _normalize_bool(self, value: Any) -> bool:
         """将可能的配置值转为布尔类型"""
@@ -347,6 +288,7 @@ class NaiPicAction(ModelConfigMixin, AutoRecallMixin, BaseAction):
             return bool(value)
         return False
 
+    @traced("llm.prompt")
     async def _generate_prompt_with_llm(self, selfie_mode: bool, request_text: Optional[str] = None) -> Optional[str]:
         """使用LLM生成英文提示词"""
         generator_config = self._get_prompt_generator_config()
@@ -358,7 +300,11 @@ class NaiPicAction(ModelConfigMixin, AutoRecallMixin, BaseAction):
             logger.warning(f"{self.log_prefix} 无法提取原始用户请求，提示词生成终止")
             return None
 
-        prompt_template = generator_config.get("prompt_template") or _PROMPT_GENERATOR_TEMPLATE
+        prompt_template = generator_config.get("prompt_template")
+        if not prompt_template:
+            from .prompt_templates import get_prompt_generator_template
+
+            prompt_template = get_prompt_generator_template("action")
         prompt = self._render_generator_prompt(prompt_template, raw_request, selfie_mode)
 
         model_config = self._resolve_llm_model_config(generator_config.get("model_name", ""))
@@ -380,6 +326,7 @@ class NaiPicAction(ModelConfigMixin, AutoRecallMixin, BaseAction):
         except Exception as e:
             logger.error(f"{self.log_prefix} 调用LLM生成提示词失败: {e}", exc_info=True)
             return None
+        current_span().set(**{"llm.model": model_name or "", "llm.success": bool(success and response)})
 
         if not success or not response:
             logger.error(
@@ -457,13 +404,9 @@ class NaiPicAction(ModelConfigMixin, AutoRecallMixin, BaseAction):
             cleaned = cleaned[1:-1].strip()
         return cleaned
 
-    def _get_prompt_generator_config(self) -> Dict[str, Any]:
+    def _get_prompt_generator_config(self) -> Mapping[str, Any]:
         """获取提示词生成器配置，兼容新旧配置节"""
-        config = self.get_config("prompt_generator", None)
-        if config:
-            return config
-        legacy = self.get_config("prompt_fallback", None)
-        return legacy or {}
+        return self.settings.prompt_generator
 
     def _check_user_permission(self) -> bool:
         """检查当前用户是否有权限使用生图功能"""
@@ -477,7 +420,7 @@ class NaiPicAction(ModelConfigMixin, AutoRecallMixin, BaseAction):
 
             # 检查用户权限
             return NaiAdminControlCommand.check_user_permission(
-                platform, chat_id, user_id, self.get_config
+                platform, chat_id, user_id, self.settings
             )
         except Exception as e:
             logger.error(f"{self.log_prefix} 检查用户权限时出错: {e}", exc_info=True)
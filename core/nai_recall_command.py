@@ -3,14 +3,16 @@ from typing import Tuple, Optional
 from src.plugin_system.base.base_command import BaseCommand
 from src.common.logger import get_logger
 
+from .chat_state import chat_states
+from .plugin_settings import PluginSettings, PluginSettingsMixin
+
 logger = get_logger("nai_recall_command")
 
 
-class NaiRecallControlCommand(BaseCommand):
+class NaiRecallControlCommand(PluginSettingsMixin, BaseCommand):
     """NovelAI 图片生成自动撤回控制命令"""
 
-    # 类级别的配置覆盖
-    _recall_status_overrides = {}
+    # 会话级别的开关覆盖保存在 chat_state 注册表中
 
     # Command基本信息
     command_name = "nai_recall_control_command"
@@ -49,7 +51,7 @@ class NaiRecallControlCommand(BaseCommand):
 
         # 权限检查：如果管理员模式开启，则需要管理员权限
         from .nai_admin_command import NaiAdminControlCommand
-        admin_mode_enabled = NaiAdminControlCommand.is_admin_mode_enabled(platform, chat_id, self.get_config)
+        admin_mode_enabled = NaiAdminControlCommand.is_admin_mode_enabled(platform, chat_id, self.settings)
 
         if admin_mode_enabled:
             is_admin = self._check_admin_permission()
@@ -63,12 +65,13 @@ class NaiRecallControlCommand(BaseCommand):
             await self.send_text(f"❌ {permission_error}")
             return False, permission_error, True
 
-        current_chat_key = f"{platform}:{chat_id}"
+        chat_state = chat_states.get_or_create(platform, chat_id)
+        current_chat_key = chat_state.key
 
         if action == "on":
             # 开启自动撤回
-            self._recall_status_overrides[current_chat_key] = True
-            delay_seconds = self.get_config("auto_recall.delay_seconds", 5)
+            chat_states.update(chat_state, recall_enabled=True)
+            delay_seconds = self.settings.auto_recall.delay_seconds
             await self.send_text(
                 f"✅ 已在{chat_type}中开启NAI图片自动撤回功能\n"
                 f"📝 图片将在发送后 {delay_seconds} 秒自动撤回\n"
@@ -79,7 +82,7 @@ class NaiRecallControlCommand(BaseCommand):
 
         elif action == "off":
             # 关闭自动撤回
-            self._recall_status_overrides[current_chat_key] = False
+            chat_states.update(chat_state, recall_enabled=False)
             await self.send_text(
                 f"✅ 已在{chat_type}中关闭NAI图片自动撤回功能\n"
                 f"💡 使用 /nai on 可重新开启"
@@ -120,7 +123,7 @@ class NaiRecallControlCommand(BaseCommand):
         current_chat_key = f"{platform}:{chat_id}"
 
         # 检查白名单配置
-        allowed_groups = self.get_config("auto_recall.allowed_groups", [])
+        allowed_groups = self.settings.auto_recall.allowed_groups
         if not allowed_groups:
             logger.info(f"{self.log_prefix} 未配置白名单，允许所有会话���用自动撤回")
             return True, None
@@ -135,7 +138,7 @@ class NaiRecallControlCommand(BaseCommand):
     def _check_admin_permission(self) -> bool:
         """检查当前用户是否是管理员"""
         try:
-            admin_users = self.get_config("admin.admin_users", [])
+            admin_users = self.settings.admin.admin_users
             if not admin_users:
                 # 如果未配置管理员列表，默认允许所有人管理
                 logger.warning(f"{self.log_prefix} 未配置管理员列表，允许所有人使用管理命令")
@@ -157,23 +160,22 @@ class NaiRecallControlCommand(BaseCommand):
             return False
 
     @classmethod
-    def is_recall_enabled(cls, platform: str, chat_id: str, get_config_func) -> bool:
+    def is_recall_enabled(cls, platform: str, chat_id: str, settings: PluginSettings) -> bool:
         """
         静态方法：检查指定会话（群聊/私聊）是否启用了自动撤回
 
         Args:
             platform: 平台标识
             chat_id: 会话ID（可以是group_id或user_id）
-            get_config_func: 获取配置的函数
+            settings: 编译后的插件配置
 
         Returns:
             bool: 是否启用自动撤回
         """
-        current_chat_key = f"{platform}:{chat_id}"
-
         # 检查运行时覆盖
-        if current_chat_key in cls._recall_status_overrides:
-            return cls._recall_status_overrides[current_chat_key]
+        chat_state = chat_states.get(platform, chat_id)
+        if chat_state is not None and chat_state.recall_enabled is not None:
+            return chat_state.recall_enabled
 
         # 检查默认配置
-        return get_config_func("auto_recall.enabled", False)
+        return settings.auto_recall.enabled
@@ -1,28 +1,168 @@
+import asyncio
 import base64
-import requests
-import urllib3
-from typing import Dict, Any, Tuple, Optional
-from requests.adapters import HTTPAdapter
-from urllib3.util.ssl_ import create_urllib3_context
+import re
+import threading
+import time
+import warnings
+from typing import TYPE_CHECKING, Dict, Any, List, Mapping, Tuple, Optional
+from urllib.parse import urlsplit
 
 from src.common.logger import get_logger
 
-# 禁用 SSL 警告
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+from .metrics_history import metrics_history
+from .tracing import span
+from .upstream_limiter import get_upstream_limiter, is_overload
 
-logger = get_logger("nai_pic_plugin")
+if TYPE_CHECKING:
+    import requests
 
+logger = get_logger("nai_pic_plugin")
 
-class SSLAdapter(HTTPAdapter):
-    """自定义SSL适配器，用于处理SSL连接问题"""
-    def init_poolmanager(self, *args, **kwargs):
-        context = create_urllib3_context()
-        context.check_hostname = False
-        context.verify_mode = 0  # ssl.CERT_NONE
-        # 设置更宽松的SSL选项
-        context.options |= 0x4  # OP_LEGACY_SERVER_CONNECT
-        kwargs['ssl_context'] = context
-        return super().init_poolmanager(*args, **kwargs)
+_DEFAULT_BASE_URL = "https://std.loliyc.com"
+
+# 按 base_url 共享的 HTTP 会话（连接池）
+# requests / urllib3 导入较慢，在创建第一个会话时才导入
+_sessions: Dict[str, "requests.Session"] = {}
+_sessions_lock = threading.Lock()
+_ssl_adapter_class = None
+
+
+def _get_ssl_adapter_class():
+    """创建自定义SSL适配器类，用于处理SSL连接问题"""
+    global _ssl_adapter_class
+    if _ssl_adapter_class is None:
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.ssl_ import create_urllib3_context
+
+        class SSLAdapter(HTTPAdapter):
+            def init_poolmanager(self, *args, **kwargs):
+                context = create_urllib3_context()
+                context.check_hostname = False
+                context.verify_mode = 0  # ssl.CERT_NONE
+                # 设置更宽松的SSL选项
+                context.options |= 0x4  # OP_LEGACY_SERVER_CONNECT
+                kwargs['ssl_context'] = context
+                return super().init_poolmanager(*args, **kwargs)
+
+        _ssl_adapter_class = SSLAdapter
+    return _ssl_adapter_class
+
+
+def _ignore_insecure_warning(base_url: str) -> None:
+    """只对本插件的上游主机忽略未校验证书的警告，不影响宿主中的其他请求"""
+    from urllib3.exceptions import InsecureRequestWarning
+
+    host = urlsplit(base_url).hostname or ""
+    warnings.filterwarnings(
+        "ignore",
+        message=f"Unverified HTTPS request is being made to host '{re.escape(host)}'",
+        category=InsecureRequestWarning,
+    )
+
+
+def _get_session(base_url: str) -> "requests.Session":
+    """获取 base_url 对应的共享会话，首次使用时创建带自定义SSL适配器的session"""
+    with _sessions_lock:
+        session = _sessions.get(base_url)
+        if session is None:
+            import requests
+
+            _ignore_insecure_warning(base_url)
+            session = requests.Session()
+            session.mount('https://', _get_ssl_adapter_class()())
+            _sessions[base_url] = session
+        return session
+
+
+def retire_sessions(active_base_urls, grace_seconds: float = 150.0) -> List[str]:
+    """
+    移除不再使用的 base_url 对应的会话，返回被移除的 base_url
+
+    新请求会按新配置创建会话；旧会话在宽限期（长于单次请求超时）后关闭，不中断进行中的请求。
+    """
+    keep = {(url or _DEFAULT_BASE_URL).rstrip('/') for url in active_base_urls}
+    with _sessions_lock:
+        retired = [(url, _sessions.pop(url)) for url in list(_sessions) if url not in keep]
+    for _, session in retired:
+        timer = threading.Timer(grace_seconds, session.close)
+        timer.daemon = True
+        timer.start()
+    return [url for url, _ in retired]
+
+
+def _resolve_base_url(model_config: Mapping[str, Any]) -> str:
+    return (model_config.get("base_url") or _DEFAULT_BASE_URL).rstrip('/')
+
+
+def build_request(prompt: str, model_config: Mapping[str, Any], size: str = None) -> Tuple[str, str, Dict[str, Any]]:
+    """由模型配置构建请求，返回 (base_url, 请求URL, 查询参数)"""
+    base_url = _resolve_base_url(model_config)
+    endpoint = model_config.get("nai_endpoint", "/generate")
+    if not endpoint.startswith('/'):
+        endpoint = f"/{endpoint}"
+    url = f"{base_url}{endpoint}"
+
+    api_key = model_config.get("api_key", "")
+    token = api_key
+    if isinstance(api_key, str) and api_key.lower().startswith("bearer "):
+        token = api_key.split(" ", 1)[1]
+
+    custom_prompt_add = model_config.get("custom_prompt_add", "")
+    # custom_prompt_add 在最前面
+    if custom_prompt_add:
+        full_prompt = f"{custom_prompt_add}, {prompt}"
+    else:
+        full_prompt = prompt
+
+    artist_prompt = model_config.get("nai_artist_prompt") or model_config.get("artist_prompt") or custom_prompt_add
+
+    negative_prompt = model_config.get("negative_prompt_add", "")
+    sampler = model_config.get("sampler", "")
+    steps = model_config.get("num_inference_steps")
+    guidance_scale = model_config.get("guidance_scale")
+    cfg_value = model_config.get("nai_cfg")
+    noise_schedule = model_config.get("noise_schedule") or model_config.get("nai_noise_schedule")
+    nocache = model_config.get("nai_nocache")
+    seed = model_config.get("seed")
+    size_override = model_config.get("nai_size")
+    extra_params = model_config.get("nai_extra_params") or {}
+
+    params = {
+        "tag": full_prompt,
+        "model": model_config.get("default_model", "nai-diffusion-4-5-full")
+    }
+
+    if token:
+        params["token"] = token
+    if artist_prompt:
+        params["artist"] = artist_prompt
+    if negative_prompt:
+        params["negative"] = negative_prompt
+    if sampler:
+        params["sampler"] = sampler
+    if steps is not None:
+        params["steps"] = steps
+    if guidance_scale is not None:
+        params["scale"] = guidance_scale
+    if cfg_value is not None:
+        params["cfg"] = cfg_value
+    if noise_schedule:
+        params["noise_schedule"] = noise_schedule
+    if nocache is not None:
+        params["nocache"] = nocache
+    if seed is not None:
+        params["seed"] = seed
+
+    final_size = size_override or size
+    if final_size:
+        params["size"] = final_size
+
+    if isinstance(extra_params, Mapping):
+        for k, v in extra_params.items():
+            if v not in (None, ""):
+                params[k] = v
+
+    return base_url, url, params
 
 
 class NaiWebClient:
@@ -31,80 +171,43 @@ class NaiWebClient:
     def __init__(self, action_instance):
         self.action = action_instance
         self.log_prefix = action_instance.log_prefix
-        # 创建带有自定义SSL适配器的session
-        self.session = requests.Session()
-        self.session.mount('https://', SSLAdapter())
 
-    def generate_image(self, prompt: str, model_config: Dict[str, Any], size: str = None,
+    async def generate_image_async(self, prompt: str, model_config: Mapping[str, Any],
+                                   size: str = None) -> Tuple[bool, str]:
+        """在上游并发预算内于线程中执行 generate_image，避免阻塞事件循环"""
+        base_url = _resolve_base_url(model_config)
+        max_concurrency = model_config.get("max_concurrency", 0)
+        model = model_config.get("default_model")
+        final_size = model_config.get("nai_size") or size
+        with span("upstream", upstream=urlsplit(base_url).netloc, model=model, size=final_size) as upstream_span:
+            queued = time.monotonic()
+            async with get_upstream_limiter(base_url, max_concurrency) as limiter:
+                upstream_span.set(queue_ms=round((time.monotonic() - queued) * 1000, 1), limit=limiter.limit)
+                started = time.monotonic()
+                success, result = await asyncio.to_thread(self.generate_image, prompt, model_config, size)
+                elapsed = time.monotonic() - started
+                limiter.observe(elapsed, success, is_overload(success, result))
+                upstream_span.set(success=success, response_chars=len(result) if success and result else 0)
+                metrics_history.record_upstream(model, final_size, elapsed, success)
+                if model_config.get("degrade_level"):
+                    upstream_span.set(degrade_level=model_config["degrade_level"])
+                    metrics_history.record_degraded()
+                traffic_record = getattr(self.action, "_traffic_record", None)
+                if traffic_record is not None:
+                    traffic_record.add_generation(build_request(prompt, model_config, size)[2], elapsed, success)
+                return success, result
+
+    def generate_image(self, prompt: str, model_config: Mapping[str, Any], size: str = None,
                       input_image_base64: str = None) -> Tuple[bool, str]:
         """调用网页式的NovelAI接口（std.loliyc.com风格）生成图片"""
+        import requests
+
         try:
             if input_image_base64:
                 logger.warning(f"{self.log_prefix} (NaiWeb) 暂不支持图生图请求")
                 return False, "当前Nai网页接口不支持图生图"
 
-            base_url = (model_config.get("base_url") or "https://std.loliyc.com").rstrip('/')
-            endpoint = model_config.get("nai_endpoint", "/generate")
-            if not endpoint.startswith('/'):
-                endpoint = f"/{endpoint}"
-            url = f"{base_url}{endpoint}"
-
-            api_key = model_config.get("api_key", "")
-            token = api_key
-            if isinstance(api_key, str) and api_key.lower().startswith("bearer "):
-                token = api_key.split(" ", 1)[1]
-
-            custom_prompt_add = model_config.get("custom_prompt_add", "")
-            # custom_prompt_add 在最前面
-            if custom_prompt_add:
-                full_prompt = f"{custom_prompt_add}, {prompt}"
-            else:
-                full_prompt = prompt
-
-            artist_prompt = model_config.get("nai_artist_prompt") or model_config.get("artist_prompt") or custom_prompt_add
-
-            negative_prompt = model_config.get("negative_prompt_add", "")
-            sampler = model_config.get("sampler", "")
-            steps = model_config.get("num_inference_steps")
-            guidance_scale = model_config.get("guidance_scale")
-            cfg_value = model_config.get("nai_cfg")
-            noise_schedule = model_config.get("noise_schedule") or model_config.get("nai_noise_schedule")
-            nocache = model_config.get("nai_nocache")
-            size_override = model_config.get("nai_size")
-            extra_params = model_config.get("nai_extra_params") or {}
-
-            params = {
-                "tag": full_prompt,
-                "model": model_config.get("default_model", "nai-diffusion-4-5-full")
-            }
-
-            if token:
-                params["token"] = token
-            if artist_prompt:
-                params["artist"] = artist_prompt
-            if negative_prompt:
-                params["negative"] = negative_prompt
-            if sampler:
-                params["sampler"] = sampler
-            if steps is not None:
-                params["steps"] = steps
-            if guidance_scale is not None:
-                params["scale"] = guidance_scale
-            if cfg_value is not None:
-                params["cfg"] = cfg_value
-            if noise_schedule:
-                params["noise_schedule"] = noise_schedule
-            if nocache is not None:
-                params["nocache"] = nocache
-
-            final_size = size_override or size
-            if final_size:
-                params["size"] = final_size
-
-            if isinstance(extra_params, dict):
-                for k, v in extra_params.items():
-                    if v not in (None, ""):
-                        params[k] = v
+            base_url, url, params = build_request(prompt, model_config, size)
 
             request_kwargs = {
                 "url": url,
@@ -115,7 +218,7 @@ class NaiWebClient:
 
             logger.info(f"{self.log_prefix} (NaiWeb) 请求URL: {url}")
             logger.debug(f"{self.log_prefix} (NaiWeb) 参数: tag长度={len(params.get('tag', ''))}, model={params.get('model')}, size={params.get('size')}")
-            response = self.session.get(**request_kwargs)
+            response = _get_session(base_url).get(**request_kwargs)
 
             if response.status_code != 200:
                 logger.error(f"{self.log_prefix} (NaiWeb) HTTP错误 {response.status_code}: {response.text[:200]}")
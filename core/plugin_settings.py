@@ -0,0 +1,473 @@
+# -*- coding: utf-8 -*-
+"""
+编译后的插件配置
+
+插件加载（以及配置重新加载）时，把 config_schema 的默认值与 config.toml 的内容编译为
+一个只读、带类型的 PluginSettings 对象：各配置节变为属性，管理员、白名单等列表转为
+集合，各版本的画师串预设预先解析，尺寸配置预先校验。组件在处理消息时直接读取属性，
+不再逐次按点分键遍历配置字典。
+
+本模块只依赖标准库，不引用宿主程序的任何模块；schema 中的字段只需提供 type / default。
+"""
+import re
+from collections import OrderedDict
+from dataclasses import dataclass, field, replace
+from types import MappingProxyType
+from typing import Any, Dict, FrozenSet, List, Mapping, Optional, Tuple
+
+# 尺寸代号映射表（/nai size 与放大预设共用）
+SIZE_MAPPINGS: Mapping[str, str] = MappingProxyType({
+    "竖": "832x1216",
+    "竖图": "832x1216",
+    "横": "1216x832",
+    "横图": "1216x832",
+    "方": "1024x1024",
+    "方图": "1024x1024",
+    "h": "1216x832",  # horizontal
+    "v": "832x1216",  # vertical
+    "s": "1024x1024", # square
+})
+
+# 模型名 -> 版本配置节，按顺序匹配
+VERSION_SECTIONS: Tuple[Tuple[str, str, str], ...] = (
+    ("nai-diffusion-3", "model_nai3", "NAI V3"),
+    ("nai-diffusion-4-5", "model_nai4_5", "NAI V4.5"),
+    ("nai-diffusion-4", "model_nai4", "NAI V4"),
+)
+
+# 版本配置节中需要校验的尺寸字段
+_SIZE_KEYS = ("nai_size", "default_size", "draft_size")
+_SIZE_PATTERN = re.compile(r"^\s*(\d+)\s*[xX×*]\s*(\d+)\s*$")
+
+_EMPTY: Mapping[str, Any] = MappingProxyType({})
+
+
+def version_section_for(model_name: str) -> Optional[Tuple[str, str]]:
+    """返回模型对应的 (配置节名, 显示名)，不支持的模型返回 None"""
+    if not model_name:
+        return None
+    for marker, section, display in VERSION_SECTIONS:
+        if marker in model_name:
+            return section, display
+    return None
+
+
+def is_valid_size(value: Any) -> bool:
+    """尺寸可以是尺寸代号（竖图/h 等）或 宽x高"""
+    if not isinstance(value, str) or not value:
+        return False
+    return value in SIZE_MAPPINGS or _SIZE_PATTERN.match(value) is not None
+
+
+def parse_artist_presets(presets_raw) -> List[Dict[str, str]]:
+    """
+    解析画师串预设列表，兼容新旧格式
+
+    新格式：[{"name": "风格名", "prompt": "画师串内容"}, ...]
+    旧格式：["画师串内容1", "画师串内容2", ...]
+
+    Returns:
+        List[Dict]: 统一返回 [{"name": "...", "prompt": "..."}, ...]；无效条目被跳过
+    """
+    if not presets_raw:
+        return []
+
+    result = []
+    for i, preset in enumerate(presets_raw, 1):
+        if isinstance(preset, Mapping):
+            name = preset.get("name", f"画师串 {i}")
+            prompt = preset.get("prompt", "")
+            result.append({"name": name, "prompt": prompt})
+        elif isinstance(preset, str):
+            # 旧格式：纯字符串，使用前30个字符作为默认名称
+            preview = preset[:30] + "..." if len(preset) > 30 else preset
+            result.append({"name": f"#{i} {preview}", "prompt": preset})
+    return result
+
+
+def _freeze(value: Any) -> Any:
+    """递归转换为只读结构：字典 -> MappingProxyType，列表 -> tuple"""
+    if isinstance(value, Mapping):
+        return MappingProxyType({key: _freeze(item) for key, item in value.items()})
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+@dataclass(frozen=True)
+class VersionSettings:
+    """单个模型版本配置节"""
+
+    section: str
+    display: str
+    # 配置节原样内容（已冻结），用于合并模型配置
+    config: Mapping[str, Any]
+    # 预先解析的画师串：({"name": ..., "prompt": ...}, ...)
+    artist_presets: Tuple[Mapping[str, str], ...]
+
+
+@dataclass(frozen=True)
+class ComponentsSettings:
+    enable_debug_info: bool = False
+
+
+@dataclass(frozen=True)
+class ImagePostprocessSettings:
+    enabled: bool = False
+    strip_metadata: bool = True
+    transcode_format: str = ""
+    transcode_quality: int = 90
+    transcode_threshold_kb: int = 1024
+    worker_processes: int = 1
+
+
+@dataclass(frozen=True)
+class UpscaleSettings:
+    enabled: bool = False
+    # 目标尺寸（已展开尺寸代号）-> 向上游请求的尺寸
+    presets: Mapping[str, str] = field(default_factory=lambda: _EMPTY)
+    resample: str = "lanczos"
+
+
+@dataclass(frozen=True)
+class BatchSettings:
+    max_count: int = 4
+    max_grid_side: int = 2048
+
+
+@dataclass(frozen=True)
+class AutoRecallSettings:
+    enabled: bool = False
+    delay_seconds: int = 5
+    id_wait_seconds: int = 15
+    event_wait_seconds: float = 1.0
+    poll_fallback_attempts: int = 3
+    max_concurrent_recalls: int = 4
+    command_fallback_after: int = 3
+    batch_window_seconds: float = 2.0
+    # "platform:chat_id" 集合；为空表示不限制
+    allowed_groups: FrozenSet[str] = frozenset()
+
+
+@dataclass(frozen=True)
+class AdminSettings:
+    admin_users: FrozenSet[str] = frozenset()
+    default_admin_mode: bool = False
+
+
+@dataclass(frozen=True)
+class ChatStateSettings:
+    persist: bool = True
+    flush_interval_seconds: float = 1.0
+    max_chats: int = 10000
+    idle_ttl_seconds: int = 604800
+
+
+@dataclass(frozen=True)
+class ConfigReloadSettings:
+    enabled: bool = True
+    poll_interval_seconds: float = 2.0
+
+
+@dataclass(frozen=True)
+class TrafficRecordSettings:
+    enabled: bool = False
+    file_name: str = "traffic.jsonl"
+    max_file_mb: int = 50
+    salt: str = ""
+
+
+@dataclass(frozen=True)
+class TracingSettings:
+    enabled: bool = False
+    sample_rate: float = 0.1
+    file_name: str = "traces.jsonl"
+    batch_size: int = 64
+    flush_interval_seconds: float = 10.0
+    max_file_mb: int = 50
+
+
+@dataclass(frozen=True)
+class MetricsHistorySettings:
+    enabled: bool = True
+    file_name: str = "metrics_history.bin"
+    retention_days: int = 7
+
+
+@dataclass(frozen=True)
+class ProfilingSettings:
+    enabled: bool = True
+    max_requests: int = 20
+    keep_files: int = 30
+    top_functions: int = 8
+    expire_minutes: int = 60
+
+
+@dataclass(frozen=True)
+class QuotaSettings:
+    enabled: bool = False
+    user_limit: int = 20
+    user_window_seconds: int = 3600
+    chat_limit: int = 60
+    chat_window_seconds: int = 3600
+    global_limit: int = 0
+    global_window_seconds: int = 60
+    exempt_admins: bool = True
+
+
+@dataclass(frozen=True)
+class AdaptiveConcurrencySettings:
+    enabled: bool = False
+    min_limit: int = 1
+    max_limit: int = 8
+    latency_tolerance: float = 2.5
+    backoff_ratio: float = 0.7
+
+
+@dataclass(frozen=True)
+class AdmissionSettings:
+    enabled: bool = False
+    max_wait_seconds: float = 90.0
+    nai0_max_wait_seconds: float = 105.0
+    admin_max_wait_seconds: float = 0.0
+
+
+@dataclass(frozen=True)
+class DegradationSettings:
+    enabled: bool = False
+    queue_start: float = 1.0
+    queue_full: float = 4.0
+    latency_start_seconds: float = 40.0
+    latency_full_seconds: float = 90.0
+
+
+@dataclass(frozen=True)
+class PluginSettings:
+    """编译后的插件配置；source 为编译所用的原始配置字典"""
+
+    source: Mapping[str, Any]
+    model: Mapping[str, Any]
+    versions: Mapping[str, VersionSettings]
+    components: ComponentsSettings
+    image_postprocess: ImagePostprocessSettings
+    upscale: UpscaleSettings
+    batch: BatchSettings
+    auto_recall: AutoRecallSettings
+    admin: AdminSettings
+    chat_state: ChatStateSettings
+    config_reload: ConfigReloadSettings
+    traffic_record: TrafficRecordSettings
+    tracing: TracingSettings
+    metrics_history: MetricsHistorySettings
+    profiling: ProfilingSettings
+    quota: QuotaSettings
+    admission: AdmissionSettings
+    adaptive_concurrency: AdaptiveConcurrencySettings
+    degradation: DegradationSettings
+    # prompt_generator，未配置时使用旧配置名 prompt_fallback
+    prompt_generator: Mapping[str, Any]
+    # 编译时发现的问题（无效的值已回退为默认值）
+    warnings: Tuple[str, ...] = field(default=(), compare=False)
+
+    @property
+    def default_model(self) -> str:
+        return self.model.get("default_model", "nai-diffusion-4-5-full")
+
+    def version_for(self, model_name: str) -> Optional[VersionSettings]:
+        """返回模型对应的版本配置节；不支持的模型或未配置时返回 None"""
+        resolved = version_section_for(model_name)
+        if resolved is None:
+            return None
+        return self.versions.get(resolved[0])
+
+    def is_admin(self, user_id: Any) -> bool:
+        return str(user_id) in self.admin.admin_users
+
+
+class _Compiler:
+    def __init__(self, config: Mapping[str, Any], schema: Optional[Mapping[str, Mapping[str, Any]]]):
+        self.config = config or {}
+        self.schema = schema or {}
+        self.warnings: List[str] = []
+
+    def section(self, name: str) -> Mapping[str, Any]:
+        value = self.config.get(name)
+        return value if isinstance(value, Mapping) else {}
+
+    def value(self, section: str, key: str, default: Any) -> Any:
+        """读取一个配置项：缺失时使用 schema 默认值，并按 schema 类型转换"""
+        field_def = self.schema.get(section, {}).get(key)
+        if field_def is not None:
+            default = getattr(field_def, "default", default)
+        raw = self.section(section).get(key, default)
+        expected = getattr(field_def, "type", None) if field_def is not None else type(default)
+        if raw is None or expected is None:
+            return raw
+        if expected is bool:
+            if isinstance(raw, bool):
+                return raw
+            if isinstance(raw, (int, float)):
+                return bool(raw)
+            if isinstance(raw, str) and raw.strip().lower() in ("true", "false", "1", "0", "yes", "no", "on", "off"):
+                return raw.strip().lower() in ("true", "1", "yes", "on")
+        elif expected in (int, float):
+            if isinstance(raw, (int, float)) and not isinstance(raw, bool):
+                return expected(raw)
+            try:
+                return expected(str(raw).strip())
+            except ValueError:
+                pass
+        elif expected in (list, tuple, set, frozenset):
+            if isinstance(raw, (list, tuple, set, frozenset)):
+                return list(raw)
+        elif expected is dict:
+            if isinstance(raw, Mapping):
+                return dict(raw)
+        elif isinstance(raw, expected):
+            return raw
+        elif expected is str:
+            return str(raw)
+        self.warnings.append(f"{section}.{key} 的值 {raw!r} 无法转换为 {getattr(expected, '__name__', expected)}，使用默认值 {default!r}")
+        return default
+
+    def values(self, section: str, cls):
+        return cls(**{
+            name: self.value(section, name, field_def.default)
+            for name, field_def in cls.__dataclass_fields__.items()
+        })
+
+    def version(self, section: str, display: str) -> Optional[VersionSettings]:
+        raw = self.section(section)
+        if section not in self.config:
+            return None
+        config = dict(raw)
+        for key in _SIZE_KEYS:
+            size = config.get(key)
+            if size not in (None, "") and not is_valid_size(size):
+                self.warnings.append(f"{section}.{key} 的尺寸 {size!r} 无效，已忽略")
+                config.pop(key)
+        presets = parse_artist_presets(config.get("artist_presets") or [])
+        skipped = len(config.get("artist_presets") or []) - len(presets)
+        if skipped:
+            self.warnings.append(f"{section}.artist_presets 中有 {skipped} 个无效的画师串，已跳过")
+        return VersionSettings(
+            section=section,
+            display=display,
+            config=_freeze(config),
+            artist_presets=tuple(MappingProxyType(preset) for preset in presets),
+        )
+
+    def upscale(self) -> UpscaleSettings:
+        presets = {}
+        for key, value in (self.value("upscale", "presets", {}) or {}).items():
+            target = SIZE_MAPPINGS.get(key, key)
+            if not is_valid_size(target) or not is_valid_size(value):
+                self.warnings.append(f"upscale.presets 中的 {key!r} = {value!r} 不是有效尺寸，已忽略")
+                continue
+            presets[target] = SIZE_MAPPINGS.get(value, value)
+        return UpscaleSettings(
+            enabled=self.value("upscale", "enabled", False),
+            presets=MappingProxyType(presets),
+            resample=self.value("upscale", "resample", "lanczos"),
+        )
+
+    def compile(self) -> PluginSettings:
+        versions = {}
+        for _, section, display in VERSION_SECTIONS:
+            version = self.version(section, display)
+            if version is not None:
+                versions[section] = version
+
+        auto_recall = self.values("auto_recall", AutoRecallSettings)
+        admin = self.values("admin", AdminSettings)
+        prompt_generator = self.section("prompt_generator") or self.section("prompt_fallback")
+        return PluginSettings(
+            source=self.config,
+            model=_freeze(self.section("model")),
+            versions=MappingProxyType(versions),
+            components=self.values("components", ComponentsSettings),
+            image_postprocess=self.values("image_postprocess", ImagePostprocessSettings),
+            upscale=self.upscale(),
+            batch=self.values("batch", BatchSettings),
+            auto_recall=replace(
+                auto_recall, allowed_groups=frozenset(str(item) for item in auto_recall.allowed_groups or ())
+            ),
+            admin=replace(admin, admin_users=frozenset(str(item) for item in admin.admin_users or ())),
+            chat_state=self.values("chat_state", ChatStateSettings),
+            config_reload=self.values("config_reload", ConfigReloadSettings),
+            traffic_record=self.values("traffic_record", TrafficRecordSettings),
+            tracing=self.values("tracing", TracingSettings),
+            metrics_history=self.values("metrics_history", MetricsHistorySettings),
+            profiling=self.values("profiling", ProfilingSettings),
+            quota=self.values("quota", QuotaSettings),
+            admission=self.values("admission", AdmissionSettings),
+            adaptive_concurrency=self.values("adaptive_concurrency", AdaptiveConcurrencySettings),
+            degradation=self.values("degradation", DegradationSettings),
+            prompt_generator=_freeze(prompt_generator),
+            warnings=tuple(self.warnings),
+        )
+
+
+def compile_settings(config: Mapping[str, Any], schema: Optional[Mapping[str, Mapping[str, Any]]] = None) -> PluginSettings:
+    """把原始配置字典（及 config_schema 默认值）编译为只读的 PluginSettings"""
+    return _Compiler(config, schema).compile()
+
+
+class SettingsHolder:
+    """保存当前生效的编译配置；替换是单次赋值，读取方不会看到编译到一半的对象"""
+
+    def __init__(self):
+        self.schema: Optional[Mapping[str, Mapping[str, Any]]] = None
+        self.current: Optional[PluginSettings] = None
+        # 热重载前的原始配置字典：重载前创建的组件仍持有它们，读取时返回最新配置
+        self._superseded: List[Mapping[str, Any]] = []
+        # 不属于本插件加载流程的配置按对象 id 缓存编译结果，同时持有原字典保证 id 不被复用
+        self._foreign: "OrderedDict[int, Tuple[Mapping[str, Any], PluginSettings]]" = OrderedDict()
+
+    def compile(self, config: Mapping[str, Any]) -> PluginSettings:
+        return compile_settings(config, self.schema)
+
+    def load(self, config: Mapping[str, Any], schema: Optional[Mapping[str, Mapping[str, Any]]] = None) -> PluginSettings:
+        """编译并替换当前配置"""
+        if schema is not None:
+            self.schema = schema
+        return self.swap(self.compile(config))
+
+    def swap(self, settings: PluginSettings) -> PluginSettings:
+        """替换当前配置，返回新配置"""
+        previous = self.current
+        if previous is not None and previous.source is not settings.source:
+            self._superseded.append(previous.source)
+            del self._superseded[:-8]
+        self.current = settings
+        return settings
+
+    def get(self, config: Mapping[str, Any]) -> PluginSettings:
+        """返回与组件持有的原始配置对应的编译配置"""
+        settings = self.current
+        if settings is None:
+            return self.load(config)
+        if settings.source is config or any(config is source for source in self._superseded):
+            return settings
+        # 不属于本插件加载流程的配置（例如单独构造的组件）：只按对象身份查缓存，
+        # 读取路径上不做深比较，同一个字典只编译一次且不替换当前配置
+        cached = self._foreign.get(id(config))
+        if cached is not None and cached[0] is config:
+            return cached[1]
+        compiled = self.compile(config)
+        self._foreign[id(config)] = (config, compiled)
+        while len(self._foreign) > 8:
+            self._foreign.popitem(last=False)
+        return compiled
+
+
+# 进程内共享的编译配置
+plugin_settings = SettingsHolder()
+
+
+class PluginSettingsMixin:
+    """为组件提供 self.settings；组件的 plugin_config 即插件加载的原始配置字典"""
+
+    @property
+    def settings(self) -> PluginSettings:
+        return plugin_settings.get(getattr(self, "plugin_config", None) or {})
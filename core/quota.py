@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+"""
+生图配额：按用户、按会话与全局的滑动窗口限额，在生成提示词之前检查
+
+每个键只保存 [当前窗口起点, 上一窗口计数, 当前窗口计数]，滑动窗口内的用量按
+上一窗口计数 × 未滑出的比例 + 当前窗口计数 估算，检查与记账都是 O(1)。
+批量生成按张数计，张数超过某一范围上限的请求直接拒绝。管理员（admin_users）默认不受限制，/nai quota 可查看用量或清除计数。
+"""
+import math
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from src.common.logger import get_logger
+
+from . import runtime_stats
+from .plugin_settings import QuotaSettings, plugin_settings
+
+logger = get_logger("nai_pic_plugin")
+
+# 超过该数量的键时清理已经滑出窗口的计数
+_PRUNE_THRESHOLD = 4096
+
+_SCOPE_NAMES = {"user": "你的", "chat": "本会话的", "global": "全局"}
+
+
+def format_duration(seconds: float) -> str:
+    seconds = max(1, math.ceil(seconds))
+    if seconds < 60:
+        return f"{seconds} 秒"
+    minutes, seconds = divmod(seconds, 60)
+    if minutes < 60:
+        return f"{minutes} 分 {seconds} 秒" if seconds else f"{minutes} 分钟"
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours} 小时 {minutes} 分钟" if minutes else f"{hours} 小时"
+
+
+class SlidingWindow:
+    """一种限额（limit 次 / window 秒）下所有键的计数"""
+
+    def __init__(self, limit: int, window: float):
+        self.limit = limit
+        self.window = window
+        self._counters: Dict[str, List[float]] = {}
+
+    def _roll(self, key: str, now: float) -> List[float]:
+        counter = self._counters.get(key)
+        if counter is None:
+            counter = self._counters[key] = [now - now % self.window, 0, 0]
+            if len(self._counters) > _PRUNE_THRESHOLD:
+                self._prune(now)
+            return counter
+        elapsed_windows = int((now - counter[0]) // self.window)
+        if elapsed_windows == 1:
+            counter[:] = [counter[0] + self.window, counter[2], 0]
+        elif elapsed_windows > 1:
+            counter[:] = [now - now % self.window, 0, 0]
+        return counter
+
+    def _prune(self, now: float) -> None:
+        stale = [key for key, counter in self._counters.items() if now - counter[0] >= 2 * self.window]
+        for key in stale:
+            del self._counters[key]
+
+    def usage(self, key: str, now: float) -> float:
+        start, previous, current = self._roll(key, now)
+        return previous * (1 - (now - start) / self.window) + current
+
+    def retry_after(self, key: str, cost: int, now: float) -> float:
+        """返回还需等待的秒数，0 表示当前可以消耗 cost 次；cost 超过上限时永远无法满足，返回 inf"""
+        if cost > self.limit:
+            return math.inf
+        start, previous, current = self._roll(key, now)
+        if previous * (1 - (now - start) / self.window) + current + cost <= self.limit:
+            return 0.0
+        if current + cost <= self.limit:
+            # 等上一窗口的计数滑出到足够少
+            slide = self.window * (1 - (self.limit - cost - current) / previous)
+            return max(0.0, start + slide - now)
+        # 当前窗口本身已满：等到下一窗口，且当前窗口的计数滑出到足够少
+        slide = self.window * (1 - (self.limit - cost) / current)
+        return max(0.0, start + self.window + slide - now)
+
+    def consume(self, key: str, cost: int, now: float) -> None:
+        self._roll(key, now)[2] += cost
+
+    def reset(self, key: Optional[str] = None) -> int:
+        if key is None:
+            count = len(self._counters)
+            self._counters.clear()
+            return count
+        return 1 if self._counters.pop(key, None) is not None else 0
+
+
+class QuotaManager:
+    """按配置维护三种范围的滑动窗口；配置变化时重建对应的计数"""
+
+    def __init__(self):
+        self._windows: Dict[str, SlidingWindow] = {}
+
+    @property
+    def settings(self) -> Optional[QuotaSettings]:
+        current = plugin_settings.current
+        return current.quota if current is not None else None
+
+    @staticmethod
+    def is_exempt(user_id: str) -> bool:
+        current = plugin_settings.current
+        return current is not None and current.quota.exempt_admins and bool(user_id) and current.is_admin(user_id)
+
+    def _limits(self, settings: QuotaSettings) -> Dict[str, Tuple[int, float]]:
+        return {
+            "user": (settings.user_limit, settings.user_window_seconds),
+            "chat": (settings.chat_limit, settings.chat_window_seconds),
+            "global": (settings.global_limit, settings.global_window_seconds),
+        }
+
+    def _active_windows(self, settings: QuotaSettings) -> Dict[str, SlidingWindow]:
+        windows = {}
+        for scope, (limit, window) in self._limits(settings).items():
+            if limit <= 0 or window <= 0:
+                self._windows.pop(scope, None)
+                continue
+            existing = self._windows.get(scope)
+            if existing is None or existing.limit != limit or existing.window != window:
+                existing = self._windows[scope] = SlidingWindow(limit, float(window))
+            windows[scope] = existing
+        return windows
+
+    @staticmethod
+    def _keys(platform: str, chat_id: str, user_id: str) -> Dict[str, str]:
+        return {"user": f"{platform}:{user_id}", "chat": f"{platform}:{chat_id}", "global": ""}
+
+    def acquire(self, platform: str, chat_id: str, user_id: str, cost: int = 1) -> Optional[Tuple[str, float]]:
+        """全部范围都有余量时记账并返回 None，否则返回 (超限的范围, 需等待的秒数)，不记账"""
+        settings = self.settings
+        if settings is None or not settings.enabled:
+            return None
+        if self.is_exempt(user_id):
+            return None
+        cost = max(1, int(cost))
+        now = time.time()
+        windows = self._active_windows(settings)
+        keys = self._keys(platform, chat_id, user_id)
+        blocked = None
+        for scope, window in windows.items():
+            wait = window.retry_after(keys[scope], cost, now)
+            if wait > 0 and (blocked is None or wait > blocked[1]):
+                blocked = (scope, wait)
+        if blocked is not None:
+            runtime_stats.incr(f"quota.rejected.{blocked[0]}")
+            return blocked
+        for scope, window in windows.items():
+            window.consume(keys[scope], cost, now)
+        return None
+
+    def usage(self, platform: str, chat_id: str, user_id: str) -> List[Tuple[str, float, int, float]]:
+        """返回各范围的 (范围, 当前用量, 上限, 窗口秒数)"""
+        settings = self.settings
+        if settings is None or not settings.enabled:
+            return []
+        now = time.time()
+        keys = self._keys(platform, chat_id, user_id)
+        return [
+            (scope, window.usage(keys[scope], now), window.limit, window.window)
+            for scope, window in self._active_windows(settings).items()
+        ]
+
+    def reset(self, scope: Optional[str] = None, key: Optional[str] = None) -> int:
+        """清除计数；scope 为空时清除全部"""
+        if scope is None:
+            return sum(window.reset() for window in self._windows.values())
+        window = self._windows.get(scope)
+        return window.reset(key) if window is not None else 0
+
+    def check_component(self, component: Any, cost: int = 1) -> Optional[str]:
+        """对组件当前的用户与会话检查配额，超限时返回提示文本"""
+        platform, chat_id, user_id = component._get_chat_identity()
+        blocked = self.acquire(platform, chat_id, user_id, cost)
+        if blocked is None:
+            return None
+        scope, wait = blocked
+        window = self._windows[scope]
+        if math.isinf(wait):
+            logger.info(f"{component.log_prefix} 本次 {cost} 张超过{scope}配额上限 {window.limit}")
+            return (f"⏳ 本次请求 {cost} 张超过了{_SCOPE_NAMES[scope]}生图上限"
+                    f"（{window.limit} 张 / {format_duration(window.window)}），请减少张数")
+        logger.info(f"{component.log_prefix} 超出{scope}配额，需等待 {wait:.0f}s")
+        return (f"⏳ {_SCOPE_NAMES[scope]}生图次数已达上限（{window.limit} 张 / {format_duration(window.window)}），"
+                f"请 {format_duration(wait)}后再试")
+
+
+# 进程内共享的配额计数
+quota_manager = QuotaManager()
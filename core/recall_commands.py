@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+"""
+撤回命令选择：按平台记住实际可用的撤回命令名与返回格式
+
+首次撤回时按 RECALL_COMMANDS 顺序逐个尝试，成功后记住该命令及其返回格式
+（bool / status / retcode），之后只发送这一条命令，并只按该格式判断结果；连续失败
+达到阈值才重新遍历完整列表。学习结果保存在 data/recall_commands.json。
+
+宿主按平台名把命令路由到适配器（每个适配器注册自己的平台名），插件侧看不到
+另外的适配器标识，因此平台名即是适配器的键。
+"""
+import json
+import os
+import time
+from typing import Any, Dict, List, Optional
+
+from src.common.logger import get_logger
+
+from . import runtime_stats
+from .storage_paths import atomic_write_text, data_path
+
+logger = get_logger("pic_auto_recall")
+
+# 依次尝试的撤回命令，兼容不同适配器
+RECALL_COMMANDS = ("DELETE_MSG", "delete_msg", "RECALL_MSG", "recall_msg")
+
+LEARNED_FILENAME = "recall_commands.json"
+
+
+def classify_recall_result(result: Any) -> Optional[str]:
+    """返回表示撤回成功的返回格式（bool/status/retcode），未成功返回 None"""
+    if isinstance(result, bool):
+        return "bool" if result else None
+    if isinstance(result, dict):
+        if str(result.get("status", "")).lower() in ("ok", "success"):
+            return "status"
+        if result.get("retcode") == 0:
+            return "retcode"
+    return None
+
+
+def matches_recall_shape(result: Any, shape: str) -> bool:
+    """按已学习的返回格式判断撤回是否成功；同时带有 status 与 retcode 的返回只看学到的那一项"""
+    if shape == "bool":
+        return result is True
+    if not isinstance(result, dict):
+        return False
+    if shape == "status":
+        return str(result.get("status", "")).lower() in ("ok", "success")
+    if shape == "retcode":
+        return result.get("retcode") == 0
+    return classify_recall_result(result) is not None
+
+
+class RecallCommandSelector:
+    """按平台记录首选撤回命令"""
+
+    def __init__(self, path: str, fallback_after: int = 3):
+        self.path = path
+        self.fallback_after = max(1, fallback_after)
+        self._learned: Dict[str, Dict[str, Any]] = {}
+        self._loaded = False
+
+    def configure(self, fallback_after: int) -> None:
+        self.fallback_after = max(1, int(fallback_after or 1))
+
+    def commands_for(self, platform: str) -> List[str]:
+        """返回本次应尝试的命令：已学习时仅首选命令，否则为完整列表"""
+        self._ensure_loaded()
+        learned = self._learned.get(self._key(platform))
+        if learned:
+            return [learned["command"]]
+        return list(RECALL_COMMANDS)
+
+    def shape_for(self, platform: str, command: str) -> Optional[str]:
+        """command 为该平台已学习的命令时返回其返回格式"""
+        self._ensure_loaded()
+        learned = self._learned.get(self._key(platform))
+        if learned and learned["command"] == command:
+            return learned["shape"]
+        return None
+
+    def record(self, platform: str, command: str, shape: Optional[str], elapsed: float) -> None:
+        """记录一次命令结果，更新每个命令的成功/失败计数与耗时"""
+        self._ensure_loaded()
+        runtime_stats.observe(f"recall.cmd.{command}", elapsed)
+        runtime_stats.incr(f"recall.cmd.{command}.{'ok' if shape else 'fail'}")
+
+        key = self._key(platform)
+        learned = self._learned.get(key)
+        if shape:
+            if not learned or learned["command"] != command or learned["shape"] != shape:
+                self._learned[key] = {"command": command, "shape": shape, "failures": 0}
+                logger.info(f"[RecallCommand] 平台 {key} 的撤回命令确定为 {command}（返回格式 {shape}）")
+                self._save()
+            elif learned["failures"]:
+                learned["failures"] = 0
+            return
+
+        if learned and learned["command"] == command:
+            learned["failures"] += 1
+            if learned["failures"] >= self.fallback_after:
+                logger.warning(
+                    f"[RecallCommand] 平台 {key} 的首选命令 {command} 连续失败 {learned['failures']} 次，"
+                    f"恢复遍历全部撤回命令"
+                )
+                del self._learned[key]
+                self._save()
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        self._ensure_loaded()
+        return {key: dict(value) for key, value in self._learned.items()}
+
+    @staticmethod
+    def _key(platform: str) -> str:
+        return (platform or "").strip().lower() or "default"
+
+    def _ensure_loaded(self) -> None:
+        if self._loaded:
+            return
+        self._loaded = True
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except Exception as exc:
+            logger.warning(f"[RecallCommand] 读取撤回命令记录失败: {exc!r}")
+            return
+        for key, value in (data or {}).items():
+            if isinstance(value, dict) and value.get("command") in RECALL_COMMANDS:
+                self._learned[key] = {"command": value["command"], "shape": value.get("shape"), "failures": 0}
+
+    def _save(self) -> None:
+        payload = {key: {"command": v["command"], "shape": v["shape"]} for key, v in self._learned.items()}
+        try:
+            atomic_write_text(self.path, json.dumps(payload, ensure_ascii=False))
+        except Exception as exc:
+            logger.warning(f"[RecallCommand] 保存撤回命令记录失败: {exc!r}")
+
+
+# 进程内共享的命令选择器
+selector = RecallCommandSelector(data_path(LEARNED_FILENAME))
+
+
+async def _send_recall_command(stream_id: str, message_id: str, platform: str, cmd: str, log_prefix: str) -> bool:
+    from src.plugin_system import send_api
+
+    started = time.monotonic()
+    shape = None
+    try:
+        result = await send_api.command_to_stream(
+            command={"name": cmd, "args": {"message_id": str(message_id)}},
+            stream_id=stream_id,
+            storage_message=False,
+            display_message="",
+        )
+        expected = selector.shape_for(platform, cmd)
+        if expected:
+            # 已学习的命令只按学到的格式判断，格式变化时按失败计数，达到阈值后重新学习
+            shape = expected if matches_recall_shape(result, expected) else None
+        else:
+            shape = classify_recall_result(result)
+    except Exception as exc:
+        logger.debug(f"{log_prefix} 尝试命令 {cmd} 失败: {exc!r}")
+    selector.record(platform, cmd, shape, time.monotonic() - started)
+    return shape is not None
+
+
+async def recall_message(stream_id: str, message_id: str, platform: str = "", log_prefix: str = "") -> bool:
+    """通过聊天流发送撤回命令，优先使用该平台已验证可用的命令"""
+    attempted = []
+    for cmd in selector.commands_for(platform):
+        attempted.append(cmd)
+        if await _send_recall_command(stream_id, message_id, platform, cmd, log_prefix):
+            return True
+
+    # 首选命令刚因连续失败被放弃时，本次立即尝试其余命令
+    for cmd in selector.commands_for(platform):
+        if cmd not in attempted and await _send_recall_command(stream_id, message_id, platform, cmd, log_prefix):
+            return True
+    return False
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""
+撤回消息匹配：图片消息识别与机器人账号映射
+
+本模块不引用宿主程序的任何模块，宿主配置与解析函数由调用方传入，
+便于在基准脚本中单独加载。
+"""
+from typing import Any, Callable, Dict, Optional, Tuple
+
+# 图片消息在文本字段中的标记："[图片"、"[image"（含 "[imageurl"）、"[picid"，以及不带括号的 "picid:"
+_BRACKET_MARKERS = ("图片", "image", "picid")
+_BARE_MARKER = "picid:"
+
+_IMAGE_TEXT_FIELDS = ("processed_plain_text", "display_message", "raw_message")
+_IMAGE_SEGMENT_TYPES = frozenset({"image", "imageurl"})
+
+
+def extract_message_field(msg: Any, field: str):
+    """兼容 DatabaseMessages 与 dict 的字段访问"""
+    if isinstance(msg, dict):
+        return msg.get(field)
+    return getattr(msg, field, None)
+
+
+def has_image_marker(text: str) -> bool:
+    """
+    单次扫描判断文本中是否含图片标记
+
+    只在 "[" 出现的位置比对括号标记，再做一次 "picid:" 子串查找；
+    实测比正则交替匹配和逐个标记的子串扫描都快。
+    """
+    find = text.find
+    pos = find("[")
+    while pos != -1:
+        if text.startswith(_BRACKET_MARKERS, pos + 1):
+            return True
+        pos = find("[", pos + 1)
+    return _BARE_MARKER in text
+
+
+def is_image_message(msg: Any) -> bool:
+    """判断消息是否为bot发送的图片"""
+    try:
+        if extract_message_field(msg, "is_picid"):
+            return True
+
+        if isinstance(msg, dict):
+            seg = msg.get("message_segment")
+            if isinstance(seg, dict):
+                seg_type = seg.get("type")
+                if seg_type in _IMAGE_SEGMENT_TYPES:
+                    return True
+                if seg_type == "seglist":
+                    for child in seg.get("data") or []:
+                        if isinstance(child, dict) and child.get("type") in _IMAGE_SEGMENT_TYPES:
+                            return True
+
+        # 三个文本字段通常内容相同，相同的只扫描一次
+        scanned = None
+        for field in _IMAGE_TEXT_FIELDS:
+            text = extract_message_field(msg, field)
+            if not isinstance(text, str) or text == scanned:
+                continue
+            if has_image_marker(text):
+                return True
+            scanned = text
+        return False
+    except Exception:
+        return False
+
+
+def build_account_map(bot_config: Any, parse_platform_accounts: Callable[[Any], Dict[str, Any]]) -> Dict[str, str]:
+    """由宿主的 bot 配置构建 平台(小写) -> 机器人账号 映射，"" 键为默认账号"""
+    account_map_raw = parse_platform_accounts(getattr(bot_config, "platforms", []) or [])
+    account_map = {
+        k.strip().lower(): str(v).strip()
+        for k, v in account_map_raw.items()
+        if v
+    }
+
+    qq_account = str(getattr(bot_config, "qq_account", "") or "").strip()
+    if qq_account:
+        account_map.setdefault("qq", qq_account)
+
+    telegram_account = str(getattr(bot_config, "telegram_account", "") or "").strip()
+    if telegram_account:
+        account_map.setdefault("telegram", telegram_account)
+        account_map.setdefault("tg", telegram_account)
+
+    account_map[""] = qq_account
+    return account_map
+
+
+class AccountMapCache:
+    """
+    缓存平台账号映射
+
+    以宿主配置对象的标识与账号字段作为指纹，配置重新加载（对象被替换或账号变化）
+    时才重建，其余查询为一次字典访问。
+    """
+
+    def __init__(self, get_global_config: Callable[[], Any],
+                 parse_platform_accounts: Callable[[Any], Dict[str, Any]]):
+        self._get_global_config = get_global_config
+        self._parse_platform_accounts = parse_platform_accounts
+        self._fingerprint: Optional[Tuple] = None
+        self._account_map: Dict[str, str] = {}
+
+    def get(self, platform: str) -> str:
+        bot_config = getattr(self._get_global_config(), "bot", None)
+        if not bot_config:
+            return ""
+
+        # 持有对象本身而非 id()，避免旧配置被回收后 id 被复用
+        fingerprint = (
+            bot_config,
+            getattr(bot_config, "platforms", None),
+            getattr(bot_config, "qq_account", None),
+            getattr(bot_config, "telegram_account", None),
+        )
+        cached = self._fingerprint
+        if (cached is None or fingerprint[0] is not cached[0] or fingerprint[1] is not cached[1]
+                or fingerprint[2:] != cached[2:]):
+            self._account_map = build_account_map(bot_config, self._parse_platform_accounts)
+            self._fingerprint = fingerprint
+
+        account_map = self._account_map
+        return account_map.get((platform or "").strip().lower(), account_map[""])
@@ -0,0 +1,376 @@
+# -*- coding: utf-8 -*-
+"""
+自动撤回调度器：进程内唯一的撤回队列
+
+所有待撤回消息按到期时间放入最小堆，由一个工作协程统一等待并执行，
+同时执行的撤回数量受限。待撤回条目写入 data/recall_journal.json，
+插件重启后重新载入并补做（已过期的立即执行）。
+
+同一聊天流中到期时间相差不超过合并窗口的撤回会合并为一批：
+尚未解析的消息ID共用一次最近消息查询，随后按发送顺序依次撤回。
+"""
+import asyncio
+import heapq
+import itertools
+import json
+import os
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from src.common.logger import get_logger
+
+from . import runtime_stats
+from .message_id_resolver import is_placeholder_id, resolver as message_resolver
+from .recall_commands import recall_message
+from .storage_paths import atomic_write_text, data_path
+
+logger = get_logger("pic_auto_recall")
+
+JOURNAL_FILENAME = "recall_journal.json"
+
+
+class RecallJob:
+    """一条待撤回记录；message_id 为空或为占位ID时在执行前解析"""
+
+    __slots__ = ("job_id", "due_at", "stream_id", "message_id", "platform",
+                 "send_timestamp", "bot_account", "log_prefix")
+
+    def __init__(self, job_id: str, due_at: float, stream_id: str, message_id: str,
+                 platform: str = "", send_timestamp: Optional[float] = None,
+                 bot_account: str = "", log_prefix: str = ""):
+        self.job_id = job_id
+        self.due_at = due_at
+        self.stream_id = stream_id
+        self.message_id = message_id
+        self.platform = platform
+        self.send_timestamp = send_timestamp
+        self.bot_account = bot_account
+        self.log_prefix = log_prefix
+
+    @property
+    def needs_resolution(self) -> bool:
+        return not self.message_id or is_placeholder_id(self.message_id)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.job_id,
+            "due_at": self.due_at,
+            "stream_id": self.stream_id,
+            "message_id": self.message_id,
+            "platform": self.platform,
+            "send_timestamp": self.send_timestamp,
+            "bot_account": self.bot_account,
+            "log_prefix": self.log_prefix,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> Optional["RecallJob"]:
+        try:
+            send_timestamp = data.get("send_timestamp")
+            return cls(
+                str(data["job_id"]),
+                float(data["due_at"]),
+                str(data["stream_id"]),
+                str(data.get("message_id") or ""),
+                str(data.get("platform") or ""),
+                float(send_timestamp) if send_timestamp is not None else None,
+                str(data.get("bot_account") or ""),
+                str(data.get("log_prefix") or ""),
+            )
+        except (KeyError, TypeError, ValueError):
+            return None
+
+
+class RecallScheduler:
+    """单工作协程 + 最小堆的撤回调度器"""
+
+    def __init__(self, journal_path: str, max_concurrency: int = 4):
+        self.journal_path = journal_path
+        self.max_concurrency = max(1, max_concurrency)
+        self.id_wait_seconds = 15.0
+        self.batch_window = 2.0
+        self.poll_attempts = 3
+        self._heap: List[Tuple[float, int, RecallJob]] = []
+        self._jobs: Dict[str, RecallJob] = {}
+        self._running: Set[asyncio.Task] = set()
+        # 正在执行批次的聊天流，及其间到期、需等待上一批完成的条目（保证同一聊天内的撤回顺序）
+        self._active_streams: Set[str] = set()
+        self._deferred: Dict[str, List[RecallJob]] = {}
+        self._seq = itertools.count()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._loaded = False
+        self._dirty = False
+
+    @property
+    def pending_count(self) -> int:
+        """尚未完成的撤回数量（含正在执行的）"""
+        return len(self._jobs)
+
+    def configure(self, max_concurrency: int, id_wait_seconds: float = 15.0,
+                  batch_window: float = 2.0, poll_attempts: int = 3) -> None:
+        self.max_concurrency = max(1, int(max_concurrency or 1))
+        self.id_wait_seconds = max(0.0, float(id_wait_seconds))
+        self.batch_window = max(0.0, float(batch_window))
+        self.poll_attempts = max(0, int(poll_attempts))
+
+    def ensure_started(self) -> None:
+        """载入日志并启动工作协程；需在事件循环中调用，可重复调用"""
+        if not self._loaded:
+            self._loaded = True
+            self._load_journal()
+        if self._worker is None or self._worker.done():
+            self._wakeup = asyncio.Event()
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+            if self._jobs:
+                logger.info(f"[RecallScheduler] 已从日志恢复 {len(self._jobs)} 条待撤回消息")
+
+    def schedule(self, stream_id: str, message_id: Optional[str], delay_seconds: float, platform: str = "",
+                 send_timestamp: Optional[float] = None, bot_account: str = "",
+                 log_prefix: str = "") -> RecallJob:
+        """加入一条待撤回消息，delay_seconds 秒后执行；message_id 可留空，执行前按发送时间解析"""
+        self.ensure_started()
+        job = RecallJob(uuid.uuid4().hex, time.time() + max(0.0, delay_seconds), stream_id,
+                        message_id or "", platform, send_timestamp, bot_account, log_prefix)
+        self._push(job)
+        self._mark_dirty()
+        return job
+
+    def stats(self) -> Dict[str, Any]:
+        """当前排队数量、撤回延迟（实际执行时间 - 计划时间）与批量合并情况"""
+        snapshot = runtime_stats.snapshot()
+        lag = snapshot["timings"].get("recall.lag", {})
+        counters = snapshot["counters"]
+        return {
+            "pending": self.pending_count,
+            "running": len(self._running),
+            "lag_avg": lag.get("avg", 0.0),
+            "lag_p95": lag.get("p95", 0.0),
+            "lag_max": lag.get("max", 0.0),
+            "batches": counters.get("recall.batches", 0),
+            "batched_jobs": counters.get("recall.batched_jobs", 0),
+            "queries_saved": counters.get("recall.batch.queries_saved", 0),
+        }
+
+    def flush_sync(self) -> int:
+        """同步写入撤回日志（含正在执行的条目），用于停止插件时，返回写入条数"""
+        self._dirty = False
+        jobs = [job.to_dict() for job in self._jobs.values()]
+        try:
+            atomic_write_text(self.journal_path, json.dumps({"jobs": jobs}, ensure_ascii=False))
+        except Exception as exc:
+            logger.warning(f"[RecallScheduler] 写入撤回日志失败: {exc!r}")
+            return 0
+        return len(jobs)
+
+    def close(self) -> int:
+        """先落盘再停止工作协程与执行中的批次，未完成的撤回在下次启动时从日志补做；返回写入条数"""
+        written = self.flush_sync() if self._loaded else 0
+        for task in [self._worker, *self._running]:
+            if task is not None and not task.done():
+                task.cancel()
+        self._worker = None
+        self._running.clear()
+        # 再次启动时重新载入日志，补回被取消批次中的条目
+        self._loaded = False
+        return written
+
+    def _push(self, job: RecallJob) -> None:
+        self._jobs[job.job_id] = job
+        heapq.heappush(self._heap, (job.due_at, next(self._seq), job))
+        runtime_stats.set_gauge("recall.pending", len(self._jobs))
+
+    def _mark_dirty(self) -> None:
+        self._dirty = True
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _wait(self, timeout: Optional[float]) -> None:
+        try:
+            if timeout is None:
+                await self._wakeup.wait()
+            else:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._wakeup.clear()
+
+    def _take_batch(self, first: RecallJob) -> List[RecallJob]:
+        """取出同一聊天流中到期时间落在合并窗口内的其他条目"""
+        limit = first.due_at + self.batch_window
+        batch = [first]
+        remaining = []
+        for entry in self._heap:
+            job = entry[2]
+            if job.stream_id == first.stream_id and job.due_at <= limit:
+                batch.append(job)
+            else:
+                remaining.append(entry)
+        if len(batch) > 1:
+            heapq.heapify(remaining)
+            self._heap = remaining
+        return batch
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                if self._dirty:
+                    self._dirty = False
+                    await self._flush_journal()
+
+                if not self._heap:
+                    await self._wait(None)
+                    continue
+
+                delay = self._heap[0][0] - time.time()
+                if delay > 0:
+                    await self._wait(delay)
+                    continue
+
+                if len(self._running) >= self.max_concurrency:
+                    await self._wait(None)
+                    continue
+
+                _, _, job = heapq.heappop(self._heap)
+                if job.stream_id in self._active_streams:
+                    self._deferred.setdefault(job.stream_id, []).append(job)
+                    continue
+
+                batch = self._deferred.pop(job.stream_id, []) + self._take_batch(job)
+                self._active_streams.add(job.stream_id)
+                task = asyncio.create_task(self._execute_batch(job.stream_id, batch))
+                self._running.add(task)
+                task.add_done_callback(self._running.discard)
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                logger.error(f"[RecallScheduler] 调度循环异常: {exc!r}")
+                await asyncio.sleep(1.0)
+
+    async def _execute_batch(self, stream_id: str, batch: List[RecallJob]) -> None:
+        now = time.time()
+        for job in batch:
+            runtime_stats.observe("recall.lag", max(0.0, now - job.due_at))
+        if len(batch) > 1:
+            runtime_stats.incr("recall.batches")
+            runtime_stats.incr("recall.batched_jobs", len(batch))
+
+        try:
+            # 按发送顺序解析与撤回，保证同一聊天内的先后次序
+            batch.sort(key=lambda job: (job.send_timestamp or job.due_at, job.due_at))
+            await self._resolve_batch(stream_id, batch)
+            for job in batch:
+                await self._recall_job(job)
+        except Exception as exc:
+            logger.error(f"[RecallScheduler] 批量撤回出错: {exc!r}")
+        finally:
+            for job in batch:
+                self._jobs.pop(job.job_id, None)
+            runtime_stats.set_gauge("recall.pending", len(self._jobs))
+            self._active_streams.discard(stream_id)
+            for job in self._deferred.pop(stream_id, []):
+                heapq.heappush(self._heap, (job.due_at, next(self._seq), job))
+            self._mark_dirty()
+
+    async def _resolve_batch(self, stream_id: str, batch: List[RecallJob]) -> None:
+        """
+        为批次中尚无正式ID的条目解析消息ID
+
+        先查消息ID索引；仍未命中时整批共用最近消息查询（最多 poll_attempts 次），
+        两次查询之间等待消息事件，总时长不超过 id_wait_seconds。
+        """
+        pending = self._lookup_pending(stream_id, [job for job in batch if job.needs_resolution])
+        polls_left = self.poll_attempts
+        deadline = time.monotonic() + self.id_wait_seconds
+
+        while pending:
+            if polls_left > 0:
+                polls_left -= 1
+                pending = self._poll_and_lookup(stream_id, pending)
+                if not pending:
+                    break
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            wait_seconds = remaining / (polls_left + 1) if polls_left else remaining
+            first = pending[0]
+            await message_resolver.wait_for(stream_id, first.send_timestamp, first.bot_account, wait_seconds)
+            pending = self._lookup_pending(stream_id, pending)
+
+        for job in pending:
+            if not job.message_id:
+                job.message_id = message_resolver.lookup(
+                    stream_id, job.send_timestamp, job.bot_account, allow_placeholder=True
+                ) or ""
+
+    @staticmethod
+    def _lookup_pending(stream_id: str, pending: List[RecallJob]) -> List[RecallJob]:
+        unresolved = []
+        for job in pending:
+            found = message_resolver.lookup(stream_id, job.send_timestamp, job.bot_account)
+            if found:
+                message_resolver.claim(stream_id, found)
+                job.message_id = found
+            else:
+                unresolved.append(job)
+        return unresolved
+
+    def _poll_and_lookup(self, stream_id: str, pending: List[RecallJob]) -> List[RecallJob]:
+        from .auto_recall_mixin import poll_recent_image_messages
+
+        try:
+            poll_recent_image_messages(stream_id, limit=max(5, len(pending) * 2))
+        except Exception as exc:
+            logger.warning(f"[RecallScheduler] 查询最近消息失败: {exc!r}")
+            return pending
+        runtime_stats.incr("recall.batch.queries")
+        if len(pending) > 1:
+            # 逐条解析时每条各需一次查询
+            runtime_stats.incr("recall.batch.queries_saved", len(pending) - 1)
+            logger.info(f"[RecallScheduler] {len(pending)} 条撤回共用一次消息查询")
+        return self._lookup_pending(stream_id, pending)
+
+    async def _recall_job(self, job: RecallJob) -> None:
+        if not job.message_id:
+            runtime_stats.incr("recall.failed")
+            logger.warning(f"{job.log_prefix} 撤回失败：未能获取消息ID")
+            return
+        try:
+            if await recall_message(job.stream_id, job.message_id, job.platform, job.log_prefix):
+                runtime_stats.incr("recall.success")
+                logger.info(f"{job.log_prefix} 消息 {job.message_id} 已成功撤回")
+            else:
+                runtime_stats.incr("recall.failed")
+                logger.warning(f"{job.log_prefix} 消息 {job.message_id} 撤回失败")
+        except Exception as exc:
+            runtime_stats.incr("recall.failed")
+            logger.error(f"{job.log_prefix} 撤回消息时出错: {exc!r}")
+
+    def _load_journal(self) -> None:
+        if not os.path.exists(self.journal_path):
+            return
+        try:
+            with open(self.journal_path, "r", encoding="utf-8") as f:
+                entries = json.load(f).get("jobs", [])
+        except Exception as exc:
+            logger.warning(f"[RecallScheduler] 读取撤回日志失败: {exc!r}")
+            return
+        for entry in entries:
+            job = RecallJob.from_dict(entry) if isinstance(entry, dict) else None
+            if job and job.job_id not in self._jobs:
+                self._push(job)
+
+    async def _flush_journal(self) -> None:
+        payload = json.dumps(
+            {"jobs": [job.to_dict() for job in self._jobs.values()]},
+            ensure_ascii=False,
+        )
+        try:
+            await asyncio.to_thread(atomic_write_text, self.journal_path, payload)
+        except Exception as exc:
+            logger.warning(f"[RecallScheduler] 写入撤回日志失败: {exc!r}")
+
+
+# 进程内共享的调度器实例
+scheduler = RecallScheduler(data_path(JOURNAL_FILENAME))
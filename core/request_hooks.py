@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+"""
+生图组件 execute 的请求级钩子：由外到内依次为按需剖析、追踪、流量记录、指标历史与准入登记的释放
+"""
+from .admission import admission_request
+from .metrics_history import record_metrics
+from .request_profiler import profile_request
+from .tracing import trace_request
+from .traffic_recorder import record_traffic
+
+# 外层的钩子先执行，剖析包含其余钩子的开销
+_HOOKS = (profile_request, trace_request, record_traffic, record_metrics, admission_request)
+
+
+def instrument_execute(entry: str):
+    """按 _HOOKS 的顺序装饰组件的 execute，entry 为入口名（nai / nai0 / action）"""
+
+    def decorator(execute):
+        for hook in reversed(_HOOKS):
+            execute = hook(entry)(execute)
+        return execute
+
+    return decorator
@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+"""
+按需性能剖析：管理员用 /nai prof 布置后，对之后 N 个匹配会话或入口的生图请求采集 cProfile
+
+剖析覆盖整个 execute（包括提示词生成 LLM、上游请求、发送与撤回计划中的 await），
+结果以 pstats 文件写入 data/profiles/（超过 keep_files 时删除最旧的），
+并把总耗时与耗时最高的函数摘要发回布置命令所在的会话。
+cProfile 按线程挂钩，同一时间只剖析一个请求；剖析期间事件循环上并发执行的其他请求也会计入。
+"""
+import cProfile
+import functools
+import itertools
+import os
+import pstats
+import time
+from typing import Any, List, Optional, Tuple
+
+from src.common.logger import get_logger
+
+from .plugin_settings import ProfilingSettings, plugin_settings
+from .storage_paths import data_path
+
+logger = get_logger("nai_pic_plugin")
+
+PROFILE_DIR = "profiles"
+ENTRIES = ("nai", "nai0", "action")
+
+_THIS_FILE = os.path.abspath(__file__)
+_PLUGIN_DIR = os.path.dirname(os.path.dirname(_THIS_FILE))
+
+
+class ProfileArm:
+    """一次布置：剩余次数、匹配条件与回报的会话"""
+
+    def __init__(self, count: int, entry: Optional[str], chat_key: Optional[str],
+                 reply_stream_id: Optional[str], expires_at: float):
+        self.total = count
+        self.remaining = count
+        self.entry = entry
+        self.chat_key = chat_key
+        self.reply_stream_id = reply_stream_id
+        self.expires_at = expires_at
+
+    @property
+    def target(self) -> str:
+        parts = [part for part in (self.entry, self.chat_key) if part]
+        return " ".join(parts) or "全部请求"
+
+    def matches(self, entry: str, chat_key: str) -> bool:
+        return (self.entry is None or self.entry == entry) and (self.chat_key is None or self.chat_key == chat_key)
+
+
+def _function_label(func: Tuple[str, int, str]) -> str:
+    filename, line, name = func
+    if filename == "~":
+        return name
+    if filename.startswith(_PLUGIN_DIR):
+        filename = os.path.relpath(filename, _PLUGIN_DIR)
+    else:
+        filename = os.path.basename(filename)
+    return f"{filename}:{line}({name})"
+
+
+def _is_idle_wait(func: Tuple[str, int, str]) -> bool:
+    """事件循环等待 I/O 的时间（select/epoll）不是 CPU 开销，摘要中不列出"""
+    return func[0] == "~" and "select" in func[2]
+
+
+def summarize(stats: pstats.Stats, top: int) -> List[str]:
+    """返回插件内累计耗时最高与全局自身耗时最高的函数行"""
+    entries = stats.stats  # type: ignore[attr-defined]
+    own = sorted(
+        (item for item in entries.items() if item[0][0].startswith(_PLUGIN_DIR) and item[0][0] != _THIS_FILE),
+        key=lambda item: item[1][3], reverse=True,
+    )
+    self_time = sorted(
+        (item for item in entries.items() if not _is_idle_wait(item[0])),
+        key=lambda item: item[1][2], reverse=True,
+    )
+    lines = ["累计耗时（插件内）："]
+    lines.extend(f"  {ct:.3f}s ×{nc} {_function_label(func)}" for func, (_, nc, _, ct, _) in own[:top])
+    lines.append("自身耗时（不含等待 I/O）：")
+    lines.extend(f"  {tt:.3f}s ×{nc} {_function_label(func)}" for func, (_, nc, tt, _, _) in self_time[:top])
+    return lines
+
+
+class RequestProfiler:
+    """进程内的剖析布置与文件管理"""
+
+    def __init__(self):
+        self.captures = 0
+        self._arm: Optional[ProfileArm] = None
+        self._busy = False
+        self._sequence = itertools.count(1)
+
+    @property
+    def settings(self) -> Optional[ProfilingSettings]:
+        current = plugin_settings.current
+        return current.profiling if current is not None else None
+
+    @property
+    def armed(self) -> Optional[ProfileArm]:
+        arm = self._arm
+        if arm is not None and time.monotonic() > arm.expires_at:
+            logger.info(f"[RequestProfiler] 剖析布置已过期（{arm.target}，剩余 {arm.remaining} 次）")
+            self._arm = arm = None
+        return arm
+
+    def arm(self, count: int, entry: Optional[str], chat_key: Optional[str],
+            reply_stream_id: Optional[str]) -> ProfileArm:
+        settings = self.settings or ProfilingSettings()
+        count = max(1, min(count, settings.max_requests))
+        expires_at = time.monotonic() + max(1, settings.expire_minutes) * 60
+        self._arm = ProfileArm(count, entry, chat_key, reply_stream_id, expires_at)
+        logger.info(f"[RequestProfiler] 已布置剖析：{self._arm.target}，{count} 次")
+        return self._arm
+
+    def disarm(self) -> Optional[ProfileArm]:
+        arm, self._arm = self.armed, None
+        return arm
+
+    def claim(self, entry: str, chat_key: str) -> Optional[ProfileArm]:
+        """匹配时占用一次剖析；已有请求在剖析中时不占用，留给之后的请求"""
+        arm = self.armed
+        if arm is None or self._busy or not arm.matches(entry, chat_key):
+            return None
+        arm.remaining -= 1
+        if arm.remaining <= 0:
+            self._arm = None
+        self._busy = True
+        return arm
+
+    def release(self) -> None:
+        self._busy = False
+
+    def save(self, stats: pstats.Stats, entry: str) -> Optional[str]:
+        """写入 pstats 文件并删除超出保留数量的旧文件，返回相对于 data 目录的路径"""
+        settings = self.settings or ProfilingSettings()
+        directory = data_path(PROFILE_DIR, create_dir=True)
+        filename = f"{time.strftime('%Y%m%d-%H%M%S')}_{entry}_{next(self._sequence)}.pstats"
+        try:
+            os.makedirs(directory, exist_ok=True)
+            stats.dump_stats(os.path.join(directory, filename))
+            files = sorted(
+                (item for item in os.scandir(directory) if item.name.endswith(".pstats")),
+                key=lambda item: item.stat().st_mtime,
+            )
+            for item in files[:max(0, len(files) - max(1, settings.keep_files))]:
+                os.remove(item.path)
+        except OSError as exc:
+            logger.warning(f"[RequestProfiler] 写入剖析文件失败: {exc!r}")
+            return None
+        self.captures += 1
+        return f"{PROFILE_DIR}/{filename}"
+
+    async def report(self, arm: ProfileArm, profiler: cProfile.Profile, entry: str, chat_key: str,
+                     elapsed: float, cpu: float, result: Any) -> None:
+        stats = pstats.Stats(profiler)
+        path = self.save(stats, entry)
+        settings = self.settings or ProfilingSettings()
+        if not isinstance(result, tuple) or not result:
+            outcome = "异常"
+        else:
+            outcome = "成功" if result[0] else "失败"
+        index = arm.total - arm.remaining
+        total_calls = stats.total_calls  # type: ignore[attr-defined]
+        lines = [
+            f"📊 性能剖析 {entry} {chat_key}（{index}/{arm.total}）",
+            f"总耗时 {elapsed:.2f}s（进程 CPU {cpu:.2f}s），函数调用 {total_calls} 次，结果：{outcome}",
+        ]
+        lines.extend(summarize(stats, max(1, settings.top_functions)))
+        lines.append(f"文件：data/{path}" if path else "文件写入失败，详见日志")
+        if arm.remaining <= 0:
+            lines.append("✅ 本次布置的剖析已全部完成")
+        text = "\n".join(lines)
+        logger.info(f"[RequestProfiler] {text}")
+
+        if not arm.reply_stream_id:
+            return
+        from src.plugin_system import send_api
+
+        try:
+            await send_api.text_to_stream(text, arm.reply_stream_id, storage_message=False)
+        except Exception as exc:
+            logger.warning(f"[RequestProfiler] 发送剖析摘要失败: {exc!r}")
+
+
+# 进程内共享的剖析器
+request_profiler = RequestProfiler()
+
+
+def profile_request(entry: str):
+    """装饰组件的 execute：有匹配的剖析布置时用 cProfile 包住整个 execute"""
+
+    def decorator(execute):
+        @functools.wraps(execute)
+        async def wrapper(self, *args, **kwargs):
+            if request_profiler.armed is None:
+                return await execute(self, *args, **kwargs)
+            platform, chat_id, _ = self._get_chat_identity()
+            chat_key = f"{platform}:{chat_id}"
+            arm = request_profiler.claim(entry, chat_key)
+            if arm is None:
+                return await execute(self, *args, **kwargs)
+
+            profiler = cProfile.Profile()
+            result = None
+            started, cpu_started = time.monotonic(), time.process_time()
+            profiler.enable()
+            try:
+                result = await execute(self, *args, **kwargs)
+                return result
+            finally:
+                profiler.disable()
+                request_profiler.release()
+                try:
+                    await request_profiler.report(arm, profiler, entry, chat_key, time.monotonic() - started,
+                                                  time.process_time() - cpu_started, result)
+                except Exception as exc:
+                    logger.warning(f"[RequestProfiler] 生成剖析摘要失败: {exc!r}")
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""
+运行时统计：进程内的计数器与耗时采样
+"""
+import threading
+from collections import deque
+from typing import Any, Deque, Dict
+
+_MAX_SAMPLES = 512
+
+_lock = threading.Lock()
+_counters: Dict[str, int] = {}
+_timings: Dict[str, "_TimingStat"] = {}
+_gauges: Dict[str, float] = {}
+
+
+class _TimingStat:
+    __slots__ = ("count", "total", "max", "samples")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.samples: Deque[float] = deque(maxlen=_MAX_SAMPLES)
+
+    def add(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        self.samples.append(seconds)
+
+    def summary(self) -> Dict[str, float]:
+        ordered = sorted(self.samples)
+        p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] if ordered else 0.0
+        return {
+            "count": self.count,
+            "avg": self.total / self.count if self.count else 0.0,
+            "p95": p95,
+            "max": self.max,
+        }
+
+
+def incr(name: str, amount: int = 1):
+    """累加计数器"""
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + amount
+
+
+def observe(name: str, seconds: float):
+    """记录一次耗时（秒）"""
+    with _lock:
+        stat = _timings.get(name)
+        if stat is None:
+            stat = _timings[name] = _TimingStat()
+        stat.add(seconds)
+
+
+def set_gauge(name: str, value: float):
+    """设置瞬时值（如当前排队数量）"""
+    with _lock:
+        _gauges[name] = value
+
+
+def get_counter(name: str) -> int:
+    return _counters.get(name, 0)
+
+
+def snapshot() -> Dict[str, Any]:
+    """返回当前所有统计的快照"""
+    with _lock:
+        return {
+            "counters": dict(_counters),
+            "gauges": dict(_gauges),
+            "timings": {name: stat.summary() for name, stat in _timings.items()},
+        }
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+"""
+插件数据目录：持久化文件统一放在插件目录下的 data/ 中，首次写入时才创建
+"""
+import os
+
+_BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = os.path.join(_BASE_DIR, "data")
+
+
+def data_path(filename: str, create_dir: bool = False) -> str:
+    """返回数据目录下文件的绝对路径，create_dir 为真时确保目录存在"""
+    if create_dir:
+        os.makedirs(DATA_DIR, exist_ok=True)
+    return os.path.join(DATA_DIR, filename)
+
+
+def atomic_write_text(path: str, text: str, encoding: str = "utf-8") -> None:
+    """先写临时文件再替换，避免进程中断时留下半个文件"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding=encoding) as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
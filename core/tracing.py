@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+"""
+请求追踪：每次生图请求一个 trace，提示词生成、配置合并、上游请求、图片处理、发送与撤回计划为其中的 span
+
+用法：
+    with tracing.span("upstream", upstream=base_url) as span:
+        ...
+        span.set(bytes=len(data))
+
+当前 span 保存在 contextvar 中，asyncio.gather 创建的子任务自动继承父 span。
+未开启或未被采样的请求没有当前 span，span() 返回空操作对象，开销只有一次 contextvar 读取。
+结束的 span 在内存中攒批，按 OTLP/JSON（ExportTraceServiceRequest）格式每批一行写入 data 目录下的文件，
+超过大小上限时轮换为 .1 文件。
+"""
+import contextvars
+import functools
+import inspect
+import json
+import os
+import random
+import time
+from typing import Any, Dict, List, Optional
+
+from src.common.logger import get_logger
+
+from .plugin_settings import TracingSettings, plugin_settings
+from .storage_paths import data_path
+
+logger = get_logger("nai_pic_plugin")
+
+SERVICE_NAME = "nai_pic_plugin"
+
+# OTLP Span.kind / Status.code
+_KIND_INTERNAL = 1
+_KIND_SERVER = 2
+_STATUS_OK = 1
+_STATUS_ERROR = 2
+
+_current_span: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("nai_trace_span", default=None)
+
+
+def _attribute_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        # OTLP/JSON 中 int64 以字符串表示
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _attributes(values: Dict[str, Any]) -> List[Dict[str, Any]]:
+    return [{"key": key, "value": _attribute_value(value)} for key, value in values.items() if value is not None]
+
+
+class Span:
+    """一段计时区间；作为上下文管理器使用，退出时交给 tracer 导出"""
+
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "kind", "attributes",
+                 "start_ns", "end_ns", "status", "_token")
+
+    def __init__(self, trace_id: str, parent_id: Optional[str], name: str, attributes: Dict[str, Any],
+                 kind: int = _KIND_INTERNAL):
+        self.trace_id = trace_id
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.attributes = attributes
+        self.start_ns = time.time_ns()
+        self.end_ns = 0
+        self.status: Optional[Dict[str, Any]] = None
+        self._token = None
+
+    def set(self, **attributes: Any) -> "Span":
+        self.attributes.update(attributes)
+        return self
+
+    def fail(self, message: str = "") -> None:
+        self.status = {"code": _STATUS_ERROR, "message": message[:200]}
+
+    def __enter__(self) -> "Span":
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        self.end_ns = time.time_ns()
+        if exc_type is not None and self.status is None:
+            self.fail(exc_type.__name__)
+        _current_span.reset(self._token)
+        tracer.finish(self)
+        return False
+
+    def to_otlp(self) -> Dict[str, Any]:
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": _attributes(self.attributes),
+            "status": self.status or {"code": _STATUS_OK},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+class _NoopSpan:
+    """未采样时使用的空 span"""
+
+    trace_id = ""
+
+    def set(self, **attributes: Any) -> "_NoopSpan":
+        return self
+
+    def fail(self, message: str = "") -> None:
+        pass
+
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+def current_span():
+    """返回当前 span，未采样时返回空 span"""
+    return _current_span.get() or _NOOP_SPAN
+
+
+def span(name: str, **attributes: Any):
+    """在当前 trace 中开始一个子 span；没有当前 trace 时返回空 span"""
+    parent = _current_span.get()
+    if parent is None:
+        return _NOOP_SPAN
+    return Span(parent.trace_id, parent.span_id, name, attributes)
+
+
+def traced(name: str):
+    """把函数（同步或异步）的执行包在一个子 span 中"""
+
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                if _current_span.get() is None:
+                    return await func(*args, **kwargs)
+                with span(name):
+                    return await func(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _current_span.get() is None:
+                return func(*args, **kwargs)
+            with span(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+class Tracer:
+    """采样、攒批并把结束的 span 写入文件"""
+
+    def __init__(self):
+        self.exported = 0
+        self.dropped = 0
+        self._buffer: List[Dict[str, Any]] = []
+        self._last_flush = time.monotonic()
+        self._file = None
+        self._path: Optional[str] = None
+
+    @property
+    def settings(self) -> Optional[TracingSettings]:
+        current = plugin_settings.current
+        return current.tracing if current is not None else None
+
+    def start_trace(self, name: str, **attributes: Any) -> Optional[Span]:
+        """按采样率决定是否追踪本次请求，采样时返回根 span"""
+        settings = self.settings
+        if settings is None or not settings.enabled or random.random() >= settings.sample_rate:
+            return None
+        return Span(f"{random.getrandbits(128):032x}", None, name, attributes, kind=_KIND_SERVER)
+
+    def finish(self, finished: Span) -> None:
+        settings = self.settings
+        if settings is None:
+            return
+        if len(self._buffer) >= max(1, settings.batch_size) * 4:
+            # 写入持续失败时不无限堆积
+            self.dropped += 1
+            return
+        self._buffer.append(finished.to_otlp())
+        if finished.parent_id is None and (
+            len(self._buffer) >= max(1, settings.batch_size)
+            or time.monotonic() - self._last_flush >= settings.flush_interval_seconds
+        ):
+            self.flush()
+
+    def flush(self) -> None:
+        """把缓冲的 span 作为一批写入文件"""
+        self._last_flush = time.monotonic()
+        settings = self.settings
+        if not self._buffer or settings is None:
+            return
+        batch = {
+            "resourceSpans": [{
+                "resource": {"attributes": _attributes({"service.name": SERVICE_NAME})},
+                "scopeSpans": [{"scope": {"name": SERVICE_NAME}, "spans": self._buffer}],
+            }]
+        }
+        path = data_path(settings.file_name, create_dir=True)
+        try:
+            if self._file is None or self._path != path:
+                self.close()
+                self._file = open(path, "a", encoding="utf-8")
+                self._path = path
+            self._file.write(json.dumps(batch, ensure_ascii=False, separators=(",", ":")) + "\n")
+            self._file.flush()
+            self.exported += len(self._buffer)
+            self._buffer = []
+            if self._file.tell() > max(1, settings.max_file_mb) * 1024 * 1024:
+                self.close()
+                os.replace(path, f"{path}.1")
+        except OSError as exc:
+            logger.warning(f"[Tracer] 写入追踪文件失败: {exc!r}")
+
+    def close(self) -> None:
+        if self._file is not None:
+            try:
+                self._file.close()
+            except OSError:
+                pass
+            self._file = None
+            self._path = None
+
+
+# 进程内共享的 tracer
+tracer = Tracer()
+
+
+def trace_request(entry: str):
+    """装饰组件的 execute：采样时为本次请求建立根 span，结果写入 outcome 属性"""
+
+    def decorator(execute):
+        @functools.wraps(execute)
+        async def wrapper(self, *args, **kwargs):
+            root = tracer.start_trace(f"nai.{entry}", entry=entry)
+            if root is None:
+                return await execute(self, *args, **kwargs)
+            platform, chat_id, _ = self._get_chat_identity()
+            root.set(**{"chat.key": f"{platform}:{chat_id}"})
+            with root:
+                result = await execute(self, *args, **kwargs)
+                if isinstance(result, tuple) and result and not result[0]:
+                    root.set(outcome="failed")
+                    root.fail(str(result[1] or ""))
+                else:
+                    root.set(outcome="ok")
+            logger.debug(f"{self.log_prefix} trace {root.trace_id} {(root.end_ns - root.start_ns) / 1e6:.0f}ms")
+            return result
+
+        return wrapper
+
+    return decorator
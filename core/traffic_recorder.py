@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+"""
+流量记录：开启后把每次生图请求写成一行匿名化的 JSON，供 devtools/replay.py 回放
+
+每条记录包含入口（nai / nai0 / action）、会话与用户哈希、请求形态（普通 / 草图 / 批量 / 重绘、
+描述长度）、合并后的上游参数（去掉密钥，提示词只记录长度）、各次上游调用耗时、结果与总耗时。
+不记录提示词与描述原文。会话和用户以加盐 HMAC 表示，盐未配置时每次启动随机生成。
+"""
+import functools
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import time
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+
+from src.common.logger import get_logger
+
+from .config_watcher import is_sensitive_key
+from .image_command_mixin import BATCH_PREFIX_PATTERN, FAST_PREFIX_PATTERN
+from .plugin_settings import TrafficRecordSettings, plugin_settings
+from .storage_paths import data_path
+
+logger = get_logger("nai_pic_plugin")
+
+RECORD_VERSION = 1
+
+# 上游参数中的文本只记录长度
+_TEXT_PARAMS = ("tag", "artist", "negative")
+_MAX_PARAM_TEXT = 64
+
+
+def _sanitize_params(params: Mapping[str, Any]) -> Dict[str, Any]:
+    clean = {}
+    for key, value in params.items():
+        if key in _TEXT_PARAMS:
+            clean[f"{key}_chars"] = len(str(value))
+        elif key == "token" or is_sensitive_key(key):
+            continue
+        elif isinstance(value, (bool, int, float)):
+            clean[key] = value
+        elif isinstance(value, str) and len(value) <= _MAX_PARAM_TEXT:
+            clean[key] = value
+    return clean
+
+
+def _request_shape(entry: str, component: Any) -> Tuple[str, int, int, Dict[str, Any]]:
+    """返回 (mode, batch, 描述长度, 入口相关的附加字段)"""
+    if entry == "action":
+        action_data = getattr(component, "action_data", None) or {}
+        description = str(action_data.get("description") or "").strip()
+        extra = {
+            "size": str(action_data.get("size") or "").strip(),
+            "selfie": str(action_data.get("selfie_mode", "")).strip().lower() in {"true", "1", "yes", "y", "on"},
+        }
+        return "normal", 1, len(description), extra
+
+    groups = getattr(component, "matched_groups", None) or {}
+    text = str(groups.get("tags" if entry == "nai0" else "description") or "").strip()
+    if entry == "nai" and text.lower() == "refine":
+        return "refine", 1, 0, {}
+    mode, batch = "normal", 1
+    fast_match = FAST_PREFIX_PATTERN.match(text)
+    if fast_match:
+        mode, text = "fast", fast_match.group("rest").strip()
+    batch_match = BATCH_PREFIX_PATTERN.match(text)
+    if batch_match:
+        mode, batch, text = "batch", int(batch_match.group("count")), batch_match.group("rest").strip()
+    extra = {"selfie": "自拍" in text or "selfie" in text.lower()} if entry == "nai" else {}
+    return mode, batch, len(text), extra
+
+
+class TrafficRecord:
+    """一次请求的记录，上游调用由 NaiWebClient 追加"""
+
+    def __init__(self, entry: str, component: Any):
+        self.entry = entry
+        self.component = component
+        self.ts = time.time()
+        self.started = time.monotonic()
+        self.params: Optional[Dict[str, Any]] = None
+        self.generations: List[Tuple[float, bool]] = []
+
+    def add_generation(self, params: Mapping[str, Any], elapsed: float, success: bool) -> None:
+        if self.params is None:
+            self.params = _sanitize_params(params)
+        self.generations.append((round(elapsed, 3), success))
+
+    def finish(self, result: Any, hash_id) -> Dict[str, Any]:
+        platform, chat_id, user_id = "", "", ""
+        identity = getattr(self.component, "_get_chat_identity", None)
+        if identity is not None:
+            try:
+                platform, chat_id, user_id = identity()
+            except Exception:
+                pass
+        mode, batch, request_chars, extra = _request_shape(self.entry, self.component)
+
+        if not isinstance(result, tuple) or not result:
+            outcome, reason = "error", "异常"
+        elif result[0]:
+            outcome, reason = "ok", ""
+        else:
+            # 只保留原因的类别（冒号前的部分），不记录上游返回的原文
+            outcome, reason = "failed", str(result[1] or "").split(":", 1)[0][:40]
+
+        record = {
+            "v": RECORD_VERSION,
+            "ts": round(self.ts, 3),
+            "entry": self.entry,
+            "platform": platform,
+            "chat": hash_id(f"{platform}:{chat_id}") if chat_id else "",
+            "user": hash_id(f"{platform}:{user_id}") if user_id else "",
+            "mode": mode,
+            "batch": batch,
+            "request_chars": request_chars,
+            "params": self.params or {},
+            "upstream": [elapsed for elapsed, _ in self.generations],
+            "upstream_failures": sum(1 for _, success in self.generations if not success),
+            "outcome": outcome,
+            "reason": reason,
+            "latency": round(time.monotonic() - self.started, 3),
+        }
+        record.update(extra)
+        return record
+
+
+class TrafficRecorder:
+    """追加写入记录文件，超过大小上限时轮换"""
+
+    def __init__(self):
+        self.records = 0
+        self._file = None
+        self._path: Optional[str] = None
+        self._process_salt = secrets.token_hex(16)
+
+    @property
+    def settings(self) -> Optional[TrafficRecordSettings]:
+        current = plugin_settings.current
+        return current.traffic_record if current is not None else None
+
+    @property
+    def enabled(self) -> bool:
+        settings = self.settings
+        return settings is not None and settings.enabled
+
+    def hash_id(self, value: str) -> str:
+        settings = self.settings
+        salt = (settings.salt if settings is not None else "") or self._process_salt
+        return hmac.new(salt.encode("utf-8"), value.encode("utf-8"), hashlib.sha256).hexdigest()[:16]
+
+    def write(self, record: Dict[str, Any]) -> None:
+        settings = self.settings
+        if settings is None:
+            return
+        path = data_path(settings.file_name, create_dir=True)
+        try:
+            if self._file is None or self._path != path:
+                self.close()
+                self._file = open(path, "a", encoding="utf-8")
+                self._path = path
+            self._file.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n")
+            self._file.flush()
+            self.records += 1
+            if self._file.tell() > max(1, settings.max_file_mb) * 1024 * 1024:
+                self.close()
+                os.replace(path, f"{path}.1")
+        except OSError as exc:
+            logger.warning(f"[TrafficRecorder] 写入流量记录失败: {exc!r}")
+
+    def close(self) -> None:
+        if self._file is not None:
+            try:
+                self._file.close()
+            except OSError:
+                pass
+            self._file = None
+            self._path = None
+
+
+# 进程内共享的流量记录器
+traffic_recorder = TrafficRecorder()
+
+
+def record_traffic(entry: str):
+    """装饰组件的 execute：开启记录时为本次请求建立 TrafficRecord，结束后写入"""
+
+    def decorator(execute):
+        @functools.wraps(execute)
+        async def wrapper(self, *args, **kwargs):
+            if not traffic_recorder.enabled:
+                return await execute(self, *args, **kwargs)
+            record = self._traffic_record = TrafficRecord(entry, self)
+            result = None
+            try:
+                result = await execute(self, *args, **kwargs)
+                return result
+            finally:
+                self._traffic_record = None
+                try:
+                    traffic_recorder.write(record.finish(result, traffic_recorder.hash_id))
+                except Exception as exc:
+                    logger.warning(f"[TrafficRecorder] 生成流量记录失败: {exc!r}")
+
+        return wrapper
+
+    return decorator
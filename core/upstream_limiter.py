@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+"""
+上游并发预算：按 base_url 限制同时进行的生图请求数（model.max_concurrency 为 0 时不限制），
+并记录上游耗时的 EWMA 供准入控制估算等待时间
+
+开启 [adaptive_concurrency] 时并发上限按 AIMD 自动调整：以 model.max_concurrency 为初值（不限制时以 max_limit 为初值），
+并发槽用满时每成功完成"上限"次调用加 1；上游返回 429/5xx、网络超时，或短期耗时 EWMA
+超过基线耗时的 latency_tolerance 倍时乘以 backoff_ratio（每个耗时周期最多减一次）。
+耗时 EWMA 与基线只取成功调用的耗时；基线取观测到的较低耗时并缓慢上浮，上游整体变慢后能够重新标定。上限的变化记录在 history 中。
+"""
+import asyncio
+import re
+import time
+from collections import deque
+from typing import Deque, Dict, Optional, Tuple
+
+from src.common.logger import get_logger
+
+from . import runtime_stats
+from .plugin_settings import AdaptiveConcurrencySettings, plugin_settings
+
+logger = get_logger("nai_pic_plugin")
+
+_limiters: Dict[str, "UpstreamLimiter"] = {}
+
+# 上游耗时 EWMA 的平滑系数
+_LATENCY_ALPHA = 0.2
+# 基线耗时高于新样本时直接下调，低于时按该系数缓慢上浮
+_BASELINE_DRIFT = 0.02
+# 保留的上限变化记录数
+_HISTORY_SIZE = 32
+
+_OVERLOAD_PATTERN = re.compile(r"^(?:HTTP (?:429|5\d\d)\b|网络请求失败)")
+
+
+def is_overload(success: bool, result: str) -> bool:
+    """上游限流（429）、服务端错误（5xx）或网络超时视为过载信号"""
+    return not success and bool(_OVERLOAD_PATTERN.match(result or ""))
+
+
+def format_limit(limit: int) -> str:
+    return str(limit) if limit > 0 else "不限"
+
+
+class UpstreamLimiter:
+    """单个上游的并发限制器；上限可以在运行中调整（0 为不限制），等待者按先来先得获得并发槽"""
+
+    def __init__(self, base_url: str, max_concurrency: int):
+        self.base_url = base_url
+        self.configured = max(0, int(max_concurrency or 0))
+        self.limit = self._clamp(self.configured, self.policy)
+        self.in_flight = 0
+        self.waiting = 0
+        self.latency_ewma: Optional[float] = None
+        self.last_observed = 0.0
+        self.baseline_latency: Optional[float] = None
+        # (时间戳, 新上限, 原因)
+        self.history: Deque[Tuple[float, int, str]] = deque([(time.time(), self.limit, "初始")], maxlen=_HISTORY_SIZE)
+        runtime_stats.set_gauge("upstream.limit", self.limit)
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._successes = 0
+        self._last_decrease = 0.0
+
+    @property
+    def policy(self) -> Optional[AdaptiveConcurrencySettings]:
+        current = plugin_settings.current
+        if current is None or not current.adaptive_concurrency.enabled:
+            return None
+        return current.adaptive_concurrency
+
+    async def __aenter__(self):
+        if self._has_slot() and not self._waiters:
+            self.in_flight += 1
+            return self
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append(future)
+        self.waiting += 1
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # 已经分到并发槽时被取消，交给下一个等待者
+                self.in_flight -= 1
+                self._wake()
+            else:
+                try:
+                    self._waiters.remove(future)
+                except ValueError:
+                    pass
+            raise
+        finally:
+            self.waiting -= 1
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.in_flight -= 1
+        self._wake()
+        return False
+
+    def _has_slot(self) -> bool:
+        return self.limit <= 0 or self.in_flight < self.limit
+
+    def _wake(self) -> None:
+        while self._waiters and self._has_slot():
+            future = self._waiters.popleft()
+            if not future.done():
+                self.in_flight += 1
+                future.set_result(None)
+
+    def _set_limit(self, limit: int, reason: str) -> None:
+        if limit == self.limit:
+            return
+        logger.info(f"[UpstreamLimiter] {self.base_url} 并发上限 {format_limit(self.limit)} -> {format_limit(limit)}（{reason}）")
+        self.limit = limit
+        self._successes = 0
+        self.history.append((time.time(), limit, reason))
+        runtime_stats.set_gauge("upstream.limit", limit)
+        self._wake()
+
+    def configure(self, max_concurrency: int) -> None:
+        """配置的并发数变化时以新值为准；未开启自动调整时上限固定为配置值"""
+        configured = max(0, int(max_concurrency or 0))
+        policy = self.policy
+        if configured != self.configured:
+            self.configured = configured
+            self._set_limit(self._clamp(configured, policy), "配置变化")
+        elif policy is None:
+            self._set_limit(configured, "固定上限")
+        else:
+            self._set_limit(self._clamp(self.limit, policy), "范围变化")
+
+    @staticmethod
+    def _clamp(limit: int, policy: Optional[AdaptiveConcurrencySettings]) -> int:
+        if policy is None:
+            return limit
+        low = max(1, policy.min_limit)
+        high = max(low, policy.max_limit)
+        # 不限制时自动调整从上限的上界开始
+        return high if limit <= 0 else max(low, min(high, limit))
+
+    def observe(self, elapsed: float, success: bool = True, overloaded: bool = False) -> None:
+        """
+        记录一次上游调用占用并发槽的时间，并按策略调整上限
+
+        只有成功的调用计入耗时 EWMA、基线耗时与加性增加的计数；400/401、没有图片等快速失败
+        的耗时不代表上游的生成耗时，计入会把基线压低，随后正常耗时都被误判为过载。
+        """
+        self.last_observed = time.monotonic()
+        policy = self.policy
+        if overloaded:
+            if policy is not None:
+                self._decrease(policy, "429/5xx")
+            return
+        if not success:
+            return
+        if self.latency_ewma is None:
+            self.latency_ewma = elapsed
+        else:
+            self.latency_ewma += _LATENCY_ALPHA * (elapsed - self.latency_ewma)
+
+        if policy is None:
+            return
+        if self.baseline_latency is None or elapsed < self.baseline_latency:
+            self.baseline_latency = elapsed
+        else:
+            self.baseline_latency += _BASELINE_DRIFT * (elapsed - self.baseline_latency)
+
+        if self.latency_ewma > policy.latency_tolerance * self.baseline_latency:
+            self._decrease(policy, "耗时上升")
+        elif self.in_flight + self.waiting >= self.limit:
+            # 只有并发槽用满时的成功才说明上游能承受当前上限
+            self._successes += 1
+            if self._successes >= self.limit:
+                self._set_limit(self._clamp(self.limit + 1, policy), "加性增加")
+                self._successes = 0
+
+    def _decrease(self, policy: AdaptiveConcurrencySettings, reason: str) -> None:
+        now = time.monotonic()
+        # 同一批在途请求的过载信号只减一次
+        if now - self._last_decrease < (self.latency_ewma or 0.0):
+            return
+        self._last_decrease = now
+        self._set_limit(self._clamp(int(self.limit * policy.backoff_ratio), policy), reason)
+
+    @property
+    def throughput(self) -> Optional[float]:
+        """并发槽占满时每秒完成的调用数；不限制并发时为 None"""
+        if not self.latency_ewma or self.limit <= 0:
+            return None
+        return self.limit / self.latency_ewma
+
+    def estimate_wait(self, ahead: int, cost: int = 1) -> Optional[float]:
+        """前面还有 ahead 次调用时，新请求的 cost 次调用全部完成还需的秒数；没有耗时样本时返回 None"""
+        if self.latency_ewma is None:
+            return None
+        throughput = self.throughput
+        if throughput is None:
+            # 不限制并发时不会排队
+            return self.latency_ewma
+        queued = max(0, ahead + cost - self.limit)
+        return queued / throughput + self.latency_ewma
+
+
+def get_upstream_limiter(base_url: str, max_concurrency: int) -> UpstreamLimiter:
+    """获取上游对应的限制器，并按当前配置校正并发上限"""
+    key = (base_url or "").rstrip("/")
+    limiter = _limiters.get(key)
+    if limiter is None:
+        limiter = _limiters[key] = UpstreamLimiter(key, max_concurrency)
+    limiter.configure(max_concurrency)
+    return limiter
+
+
+def find_upstream_limiter(base_url: str) -> Optional[UpstreamLimiter]:
+    """返回已有的限制器，上游还没有被调用过时返回 None"""
+    return _limiters.get((base_url or "").rstrip("/"))
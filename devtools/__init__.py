@@ -0,0 +1,11 @@
+# -*- coding: utf-8 -*-
+"""
+离线开发工具：脱离 MaiBot 在进程内运行插件组件，用于剖析与压测
+
+- fake_host: 宿主 src.* 接口的轻量替身（BaseAction / BaseCommand / send_* / llm_api /
+  message_api / send_api / get_config），各接口延迟可注入
+- fake_upstream: 本地 NovelAI Web 代理替身，可设置响应延迟、图片大小与失败率
+- loadgen: 负载生成器，并发执行 /nai、/nai0 与动作组件并统计延迟分布
+
+本目录不会被宿主加载，插件运行时也不依赖它。
+"""
@@ -0,0 +1,592 @@
+# -*- coding: utf-8 -*-
+"""
+宿主替身：在 sys.modules 中注册插件用到的 src.* 模块，使组件可以脱离 MaiBot 在进程内运行
+
+用法：
+    from devtools import fake_host
+    host = fake_host.install(fake_host.HostLatencies(llm=0.3, send_image=0.05))
+    loaded = fake_host.load_plugin({"model": {"base_url": "http://127.0.0.1:8080"}})
+    command = fake_host.create_command(loaded.components["NaiDrawCommand"], "/nai 初音未来", loaded.plugin.config)
+    await command.execute()
+
+只覆盖插件实际调用的接口，签名与宿主一致，返回值取宿主的常见形态。发送的消息记录在
+FakeHost 中；图片消息会分配消息ID、写入最近消息并触发 AFTER_SEND 事件，因此自动撤回的
+消息ID解析与撤回命令也能完整运行。必须在导入插件之前调用 install()。
+
+插件的 data/ 与 generated_images/ 默认指向临时目录（见 load_plugin），压测与回放
+不会覆盖插件目录中已学习的撤回命令、撤回日志与指标历史。
+"""
+import asyncio
+import enum
+import importlib
+import importlib.util
+import itertools
+import logging
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+import types
+from collections import Counter, deque
+from dataclasses import dataclass, field
+from typing import Any, Callable, Deque, Dict, List, Mapping, Optional
+
+_REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PACKAGE_NAME = "nai_pic_plugin"
+
+_IMAGE_TYPES = {"image", "imageurl", "emoji"}
+# 替身适配器能执行的撤回命令，其余命令返回 False（与只支持部分命令的适配器相同）
+_DEFAULT_RECALL_COMMANDS = ("DELETE_MSG",)
+_message_ids = itertools.count(1)
+
+
+@dataclass
+class HostLatencies:
+    """各宿主接口的模拟耗时（秒），jitter 为上下浮动的比例"""
+
+    send_text: float = 0.0
+    send_image: float = 0.0
+    send_command: float = 0.0
+    llm: float = 0.0
+    message_api: float = 0.0
+    jitter: float = 0.0
+
+
+@dataclass
+class SentMessage:
+    stream_id: str
+    message_type: str
+    content: str
+    message_id: str
+    time: float
+
+
+class FakeHost:
+    """记录组件对宿主接口的调用，并按 HostLatencies 模拟耗时"""
+
+    def __init__(self, latencies: Optional[HostLatencies] = None, bot_account: str = "10000",
+                 seed: Optional[int] = None, history: int = 1000):
+        self.latencies = latencies or HostLatencies()
+        self.bot_account = bot_account
+        self.global_config = types.SimpleNamespace(
+            bot=types.SimpleNamespace(platforms=[], qq_account=bot_account, telegram_account="")
+        )
+        self.models: Dict[str, Any] = {
+            "planner": types.SimpleNamespace(name="planner"),
+            "replyer": types.SimpleNamespace(name="replyer"),
+        }
+        self.llm_response: Callable[[str], str] = lambda prompt: "1girl, solo, smile, looking at viewer, cherry blossoms"
+        self.llm_failure_rate = 0.0
+        self.recall_commands = set(_DEFAULT_RECALL_COMMANDS)
+        self.calls: Counter = Counter()
+        self.sent: Deque[SentMessage] = deque(maxlen=history)
+        self.recalled: List[str] = []
+        self.event_handlers: Dict[Any, List[Any]] = {}
+        self._recent: Dict[str, Deque[Dict[str, Any]]] = {}
+        self._rng = random.Random(seed)
+
+    def _scaled(self, seconds: float) -> float:
+        jitter = self.latencies.jitter
+        if seconds > 0 and jitter:
+            seconds *= 1 + self._rng.uniform(-jitter, jitter)
+        return max(0.0, seconds)
+
+    async def _delay(self, seconds: float) -> None:
+        seconds = self._scaled(seconds)
+        if seconds:
+            await asyncio.sleep(seconds)
+
+    async def deliver(self, stream_id: str, message_type: str, content: Any, storage_message: bool = True) -> bool:
+        """组件发送消息；图片消息写入最近消息并触发 AFTER_SEND 事件"""
+        is_image = message_type in _IMAGE_TYPES
+        self.calls[f"send.{message_type}"] += 1
+        await self._delay(self.latencies.send_image if is_image else self.latencies.send_text)
+
+        message_id = str(next(_message_ids))
+        now = time.time()
+        text = content if isinstance(content, str) else repr(content)
+        self.sent.append(SentMessage(stream_id, message_type, text if len(text) <= 120 else f"{text[:117]}...",
+                                     message_id, now))
+        if is_image and storage_message:
+            record = {
+                "message_id": message_id,
+                "time": now,
+                "user_id": self.bot_account,
+                "is_picid": True,
+                "message_segment": {"type": message_type, "data": ""},
+                "processed_plain_text": "[图片]",
+            }
+            self._recent.setdefault(stream_id, deque(maxlen=50)).append(record)
+            await self.dispatch(EventType.AFTER_SEND, types.SimpleNamespace(
+                stream_id=stream_id,
+                message_segments=[{"type": message_type, "data": ""}],
+                message_base_info={"message_id": message_id, "time": now, "user_id": self.bot_account},
+            ))
+        return True
+
+    async def run_command(self, command: Mapping[str, Any], stream_id: str) -> bool:
+        """适配器命令：支持的撤回命令删除对应的最近消息"""
+        name = command.get("name", "")
+        self.calls[f"command.{name}"] += 1
+        await self._delay(self.latencies.send_command)
+        if name not in self.recall_commands:
+            return False
+        message_id = str((command.get("args") or {}).get("message_id", ""))
+        recent = self._recent.get(stream_id, ())
+        for record in list(recent):
+            if record["message_id"] == message_id:
+                recent.remove(record)
+        self.recalled.append(message_id)
+        return True
+
+    async def generate(self, prompt: str, model_config: Any) -> tuple:
+        self.calls["llm.generate_with_model"] += 1
+        await self._delay(self.latencies.llm)
+        model_name = getattr(model_config, "name", "")
+        if self.llm_failure_rate and self._rng.random() < self.llm_failure_rate:
+            return False, "", "", model_name
+        return True, self.llm_response(prompt), "", model_name
+
+    def recent_messages(self, chat_id: str, hours: float, limit: int, limit_mode: str) -> List[Dict[str, Any]]:
+        """同步接口（宿主中为数据库查询），耗时以阻塞方式模拟"""
+        self.calls["message_api.get_recent_messages"] += 1
+        delay = self._scaled(self.latencies.message_api)
+        if delay:
+            time.sleep(delay)
+        cutoff = time.time() - hours * 3600
+        messages = [dict(m) for m in self._recent.get(chat_id, ()) if m["time"] >= cutoff]
+        return messages[-limit:] if limit_mode == "latest" else messages[:limit]
+
+    async def dispatch(self, event_type: "EventType", message: Any = None) -> None:
+        for handler in self.event_handlers.get(event_type, ()):
+            await handler.execute(message)
+
+    async def start(self) -> None:
+        """触发 ON_START 事件（恢复撤回任务、启动配置监视等）"""
+        await self.dispatch(EventType.ON_START)
+
+    async def stop(self) -> None:
+        await self.dispatch(EventType.ON_STOP)
+
+
+_host: Optional[FakeHost] = None
+
+
+def _require_host() -> FakeHost:
+    if _host is None:
+        raise RuntimeError("宿主替身尚未安装，请先调用 fake_host.install()")
+    return _host
+
+
+def _lookup(config: Any, key: str, default: Any = None) -> Any:
+    """与宿主 get_config 相同的点分键查找"""
+    current = config
+    for part in key.split("."):
+        if isinstance(current, dict) and part in current:
+            current = current[part]
+        else:
+            return default
+    return current
+
+
+# ---- src.common.logger / src.config.config / src.chat.utils.utils ----
+
+def get_logger(name: str) -> logging.Logger:
+    return logging.getLogger(name)
+
+
+def parse_platform_accounts(platforms: List[str]) -> Dict[str, str]:
+    accounts = {}
+    for item in platforms or []:
+        platform, sep, account = str(item).partition(":")
+        if sep:
+            accounts[platform.strip()] = account.strip()
+    return accounts
+
+
+# ---- src.plugin_system.base.* ----
+
+class ActionActivationType(enum.Enum):
+    NEVER = "never"
+    ALWAYS = "always"
+    LLM_JUDGE = "llm_judge"
+    RANDOM = "random"
+    KEYWORD = "keyword"
+
+
+class ChatMode(enum.Enum):
+    FOCUS = "focus"
+    NORMAL = "normal"
+    ALL = "all"
+
+
+class EventType(enum.Enum):
+    UNKNOWN = "unknown"
+    ON_START = "on_start"
+    ON_STOP = "on_stop"
+    ON_MESSAGE = "on_message"
+    POST_LLM = "post_llm"
+    AFTER_LLM = "after_llm"
+    POST_SEND = "post_send"
+    AFTER_SEND = "after_send"
+
+
+@dataclass
+class ComponentInfo:
+    name: str
+    component_type: str
+    description: str = ""
+
+
+class ConfigField:
+    def __init__(self, type: type, default: Any, description: str = "", required: bool = False, **extra: Any):
+        self.type = type
+        self.default = default
+        self.description = description
+        self.required = required
+        self.extra = extra
+
+
+class _SenderMixin:
+    """Action / Command 共用的发送接口"""
+
+    plugin_config: Dict[str, Any]
+
+    def _stream_id(self) -> str:
+        raise NotImplementedError
+
+    def get_config(self, key: str, default: Any = None) -> Any:
+        return _lookup(self.plugin_config, key, default)
+
+    async def send_text(self, content: str, set_reply: bool = False, reply_message: Any = None,
+                        typing: bool = False, storage_message: bool = True) -> bool:
+        return await _require_host().deliver(self._stream_id(), "text", content, storage_message)
+
+    async def send_image(self, image_base64: str, set_reply: bool = False, reply_message: Any = None,
+                         storage_message: bool = True) -> bool:
+        return await _require_host().deliver(self._stream_id(), "image", image_base64, storage_message)
+
+    async def send_custom(self, message_type: str, content: Any, display_message: str = "", typing: bool = False,
+                          set_reply: bool = False, reply_message: Any = None, storage_message: bool = True) -> bool:
+        return await _require_host().deliver(self._stream_id(), message_type, content, storage_message)
+
+    async def send_command(self, command_name: str, args: Optional[Dict[str, Any]] = None,
+                           display_message: str = "", storage_message: bool = True) -> bool:
+        return await _require_host().run_command({"name": command_name, "args": args or {}}, self._stream_id())
+
+
+class BaseAction(_SenderMixin):
+    action_name = ""
+    action_description = ""
+
+    def __init__(self, action_data: Dict[str, Any], action_reasoning: str, cycle_timers: Dict[str, Any],
+                 thinking_id: str, chat_stream: Any, plugin_config: Optional[Dict[str, Any]] = None,
+                 action_message: Any = None, **kwargs: Any):
+        self.action_data = action_data
+        self.reasoning = action_reasoning
+        self.cycle_timers = cycle_timers
+        self.thinking_id = thinking_id
+        self.chat_stream = chat_stream
+        self.plugin_config = plugin_config or {}
+        self.action_message = action_message
+        self.log_prefix = f"[{chat_stream.stream_id}]"
+
+        group_info = chat_stream.group_info
+        user_info = chat_stream.user_info
+        self.platform = chat_stream.platform
+        self.chat_id = chat_stream.stream_id
+        self.is_group = group_info is not None
+        self.group_id = str(group_info.group_id) if group_info else None
+        self.user_id = str(user_info.user_id) if user_info else None
+
+    def _stream_id(self) -> str:
+        return self.chat_id
+
+    @classmethod
+    def get_action_info(cls) -> ComponentInfo:
+        return ComponentInfo(cls.action_name, "action", cls.action_description)
+
+
+class BaseCommand(_SenderMixin):
+    command_name = ""
+    command_description = ""
+    command_pattern = ""
+
+    def __init__(self, message: Any, plugin_config: Optional[Dict[str, Any]] = None):
+        self.message = message
+        self.matched_groups: Dict[str, Any] = {}
+        self.plugin_config = plugin_config or {}
+        self.log_prefix = "[Command]"
+
+    def set_matched_groups(self, groups: Dict[str, Any]) -> None:
+        self.matched_groups = groups
+
+    def _stream_id(self) -> str:
+        return self.message.chat_stream.stream_id
+
+    @classmethod
+    def get_command_info(cls) -> ComponentInfo:
+        return ComponentInfo(cls.command_name, "command", cls.command_description)
+
+
+class BaseEventHandler:
+    event_type = EventType.UNKNOWN
+    handler_name = ""
+    handler_description = ""
+    weight = 0
+    intercept_message = False
+
+    def __init__(self):
+        self.log_prefix = "[EventHandler]"
+        self.plugin_config: Dict[str, Any] = {}
+
+    def set_plugin_config(self, plugin_config: Dict[str, Any]) -> None:
+        self.plugin_config = plugin_config
+
+    def get_config(self, key: str, default: Any = None) -> Any:
+        return _lookup(self.plugin_config, key, default)
+
+    async def execute(self, message: Any):
+        raise NotImplementedError
+
+    @classmethod
+    def get_handler_info(cls) -> ComponentInfo:
+        return ComponentInfo(cls.handler_name, "event_handler", cls.handler_description)
+
+
+def default_config(schema: Mapping[str, Mapping[str, ConfigField]]) -> Dict[str, Dict[str, Any]]:
+    """按 config_schema 生成默认配置（与宿主首次生成 config.toml 的内容相同）"""
+    return {section: {key: fld.default for key, fld in fields.items()} for section, fields in schema.items()}
+
+
+def merge_config(base: Dict[str, Any], overrides: Mapping[str, Any]) -> Dict[str, Any]:
+    merged = dict(base)
+    for key, value in overrides.items():
+        if isinstance(value, Mapping) and isinstance(merged.get(key), dict):
+            merged[key] = merge_config(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+
+class BasePlugin:
+    plugin_name = ""
+    config_file_name = "config.toml"
+    config_schema: Dict[str, Dict[str, ConfigField]] = {}
+
+    def __init__(self, plugin_dir: Optional[str] = None, config: Optional[Dict[str, Any]] = None):
+        self.plugin_dir = plugin_dir or _REPO_DIR
+        self.config = config if config is not None else default_config(self.config_schema)
+
+    def get_config(self, key: str, default: Any = None) -> Any:
+        return _lookup(self.config, key, default)
+
+
+def register_plugin(cls):
+    return cls
+
+
+# ---- src.plugin_system 的 llm_api / message_api / send_api ----
+
+def _get_available_models() -> Dict[str, Any]:
+    return dict(_require_host().models)
+
+
+async def _generate_with_model(prompt: str, model_config: Any, request_type: str = "plugin.generate",
+                               temperature: Optional[float] = None, max_tokens: Optional[int] = None) -> tuple:
+    return await _require_host().generate(prompt, model_config)
+
+
+def _get_recent_messages(chat_id: str, hours: float = 24.0, limit: int = 100, limit_mode: str = "latest",
+                         filter_mai: bool = False) -> List[Dict[str, Any]]:
+    return _require_host().recent_messages(chat_id, hours, limit, limit_mode)
+
+
+async def _text_to_stream(text: str, stream_id: str, typing: bool = False, reply_to: str = "",
+                          storage_message: bool = True) -> bool:
+    return await _require_host().deliver(stream_id, "text", text, storage_message)
+
+
+async def _command_to_stream(command: Mapping[str, Any], stream_id: str, storage_message: bool = True,
+                             display_message: str = "") -> bool:
+    return await _require_host().run_command(command, stream_id)
+
+
+def _module(name: str, package: bool = False, **attrs: Any) -> types.ModuleType:
+    module = types.ModuleType(name)
+    module.__dict__.update(attrs)
+    if package:
+        module.__path__ = []
+    return module
+
+
+def _build_modules(host: FakeHost) -> List[types.ModuleType]:
+    llm_api = _module("src.plugin_system.apis.llm_api", get_available_models=_get_available_models,
+                      generate_with_model=_generate_with_model)
+    message_api = _module("src.plugin_system.apis.message_api", get_recent_messages=_get_recent_messages)
+    send_api = _module("src.plugin_system.apis.send_api", text_to_stream=_text_to_stream,
+                       command_to_stream=_command_to_stream)
+    return [
+        _module("src", package=True, __fake_host__=True),
+        _module("src.common", package=True),
+        _module("src.common.logger", get_logger=get_logger),
+        _module("src.config", package=True),
+        _module("src.config.config", global_config=host.global_config),
+        _module("src.chat", package=True),
+        _module("src.chat.utils", package=True),
+        _module("src.chat.utils.utils", parse_platform_accounts=parse_platform_accounts),
+        _module("src.plugin_system", package=True, register_plugin=register_plugin,
+                llm_api=llm_api, message_api=message_api, send_api=send_api),
+        _module("src.plugin_system.apis", package=True, llm_api=llm_api, message_api=message_api, send_api=send_api),
+        llm_api,
+        message_api,
+        send_api,
+        _module("src.plugin_system.base", package=True),
+        _module("src.plugin_system.base.base_action", BaseAction=BaseAction),
+        _module("src.plugin_system.base.base_command", BaseCommand=BaseCommand),
+        _module("src.plugin_system.base.base_events_handler", BaseEventHandler=BaseEventHandler),
+        _module("src.plugin_system.base.base_plugin", BasePlugin=BasePlugin),
+        _module("src.plugin_system.base.component_types", ComponentInfo=ComponentInfo,
+                ActionActivationType=ActionActivationType, ChatMode=ChatMode, EventType=EventType),
+        _module("src.plugin_system.base.config_types", ConfigField=ConfigField),
+    ]
+
+
+def install(latencies: Optional[HostLatencies] = None, **host_kwargs: Any) -> FakeHost:
+    """注册替身模块并返回新的 FakeHost；重复调用只替换 FakeHost，已导入的插件模块继续可用"""
+    global _host
+    existing = sys.modules.get("src")
+    if existing is not None and not getattr(existing, "__fake_host__", False):
+        raise RuntimeError("当前进程已加载真实宿主的 src 包，不能再注册替身")
+
+    _host = FakeHost(latencies, **host_kwargs)
+    if existing is None:
+        modules = _build_modules(_host)
+        for module in modules:
+            sys.modules[module.__name__] = module
+        for module in modules:
+            parent, _, child = module.__name__.rpartition(".")
+            if parent:
+                setattr(sys.modules[parent], child, module)
+    else:
+        sys.modules["src.config.config"].global_config = _host.global_config
+    return _host
+
+
+@dataclass
+class LoadedPlugin:
+    package: types.ModuleType
+    plugin: Any
+    components: Dict[str, type] = field(default_factory=dict)
+    data_dir: str = ""
+
+
+def _redirect_storage(data_dir: str) -> None:
+    """在其余模块导入之前把数据目录与图片输出目录指向 data_dir"""
+    storage_paths = importlib.import_module(f"{PACKAGE_NAME}.core.storage_paths")
+    storage_paths.DATA_DIR = os.path.join(data_dir, "data")
+    image_url_helper = importlib.import_module(f"{PACKAGE_NAME}.core.image_url_helper")
+    image_url_helper._IMAGE_OUTPUT_DIR = os.path.join(data_dir, "generated_images")
+
+
+def load_plugin(overrides: Optional[Mapping[str, Any]] = None, plugin_dir: str = _REPO_DIR,
+                data_dir: Optional[str] = None) -> LoadedPlugin:
+    """
+    以 nai_pic_plugin 包名导入插件并注册组件
+
+    配置为 config_schema 的默认值合并 overrides，不读取插件目录下的 config.toml。
+    事件处理器实例注册到 FakeHost，由 deliver / start / stop 触发。
+    插件的 data/ 与 generated_images/ 放在 data_dir 下（默认新建临时目录）；
+    数据路径在首次导入时确定，同一进程内再次调用时沿用第一次的目录。
+    """
+    host = _require_host()
+    package = sys.modules.get(PACKAGE_NAME)
+    if package is None:
+        spec = importlib.util.spec_from_file_location(
+            PACKAGE_NAME, os.path.join(plugin_dir, "__init__.py"), submodule_search_locations=[plugin_dir]
+        )
+        package = importlib.util.module_from_spec(spec)
+        sys.modules[PACKAGE_NAME] = package
+        _redirect_storage(data_dir or tempfile.mkdtemp(prefix="nai_fake_host_"))
+        spec.loader.exec_module(package)
+
+    plugin_cls = importlib.import_module(f"{PACKAGE_NAME}.plugin").NaiPicPlugin
+    config = merge_config(default_config(plugin_cls.config_schema), overrides or {})
+    plugin = plugin_cls(plugin_dir=plugin_dir, config=config)
+
+    storage_paths = importlib.import_module(f"{PACKAGE_NAME}.core.storage_paths")
+    loaded = LoadedPlugin(package, plugin, data_dir=os.path.dirname(storage_paths.DATA_DIR))
+    host.event_handlers.clear()
+    for _, component_cls in plugin.get_plugin_components():
+        loaded.components[component_cls.__name__] = component_cls
+        if issubclass(component_cls, BaseEventHandler):
+            handler = component_cls()
+            handler.set_plugin_config(plugin.config)
+            host.event_handlers.setdefault(component_cls.event_type, []).append(handler)
+    return loaded
+
+
+# ---- 消息与组件构造 ----
+
+def make_chat_stream(platform: str = "qq", group_id: Optional[str] = "10001", user_id: str = "20001") -> Any:
+    """群聊（group_id 为空时为私聊）的聊天流；stream_id 在宿主中为哈希，这里只需唯一"""
+    group_info = types.SimpleNamespace(group_id=group_id, group_name=f"group_{group_id}") if group_id else None
+    user_info = types.SimpleNamespace(user_id=user_id, user_nickname=f"user_{user_id}")
+    return types.SimpleNamespace(
+        stream_id=f"{platform}:{group_id}" if group_id else f"{platform}:private:{user_id}",
+        platform=platform,
+        group_info=group_info,
+        user_info=user_info,
+    )
+
+
+def make_message(text: str, chat_stream: Any = None) -> Any:
+    """命令组件收到的 MessageRecv"""
+    stream = chat_stream or make_chat_stream()
+    message_info = types.SimpleNamespace(
+        platform=stream.platform,
+        group_info=stream.group_info,
+        user_info=stream.user_info,
+        message_id=str(next(_message_ids)),
+        time=time.time(),
+    )
+    return types.SimpleNamespace(message_info=message_info, chat_stream=stream,
+                                 processed_plain_text=text, raw_message=text)
+
+
+def make_action_message(chat_stream: Any, text: str = "") -> Any:
+    """Planner 触发动作时附带的 DatabaseMessages"""
+    chat_info = types.SimpleNamespace(
+        platform=chat_stream.platform,
+        group_info=chat_stream.group_info,
+        user_info=chat_stream.user_info,
+        stream_id=chat_stream.stream_id,
+    )
+    return types.SimpleNamespace(message_id=str(next(_message_ids)), time=time.time(), chat_info=chat_info,
+                                 user_info=chat_stream.user_info, processed_plain_text=text)
+
+
+def create_command(command_cls: type, text: str, plugin_config: Dict[str, Any], chat_stream: Any = None) -> Any:
+    """按 command_pattern 匹配文本并构造命令组件，不匹配时抛出 ValueError"""
+    match = re.match(command_cls.command_pattern, text)
+    if match is None:
+        raise ValueError(f"{command_cls.__name__} 不匹配: {text!r}")
+    command = command_cls(make_message(text, chat_stream), plugin_config)
+    command.set_matched_groups(match.groupdict())
+    return command
+
+
+def create_action(action_cls: type, action_data: Mapping[str, Any], plugin_config: Dict[str, Any],
+                  chat_stream: Any = None, reasoning: str = "") -> Any:
+    stream = chat_stream or make_chat_stream()
+    return action_cls(
+        action_data=dict(action_data),
+        action_reasoning=reasoning,
+        cycle_timers={},
+        thinking_id=f"tid_{next(_message_ids)}",
+        chat_stream=stream,
+        plugin_config=plugin_config,
+        action_message=make_action_message(stream, action_data.get("description", "")),
+    )
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+上游替身：本地的 NovelAI Web 代理（std.loliyc.com 风格），供 fake_host / loadgen 使用
+
+GET 任意路径返回一张 PNG（或 response="url" 时返回带图片链接的 JSON），
+延迟、图片大小与失败率可设置，并统计请求数与同时处理的最大请求数。
+设置 capacity 时，同时处理的请求超过该数量后新请求很快返回 429，模拟共享代理的限流。
+只依赖标准库，在后台线程中运行。
+"""
+import random
+import struct
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+
+def make_png(payload_kb: int, seed: int = 0) -> bytes:
+    """生成约 payload_kb 大小的有效 PNG；像素为随机数据，不会被压缩变小"""
+    width = 256
+    height = max(1, payload_kb * 1024 // (width * 3))
+    rng = random.Random(seed)
+    raw = b"".join(b"\x00" + rng.randbytes(width * 3) for _ in range(height))
+
+    def chunk(tag: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xFFFFFFFF)
+
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(raw, 1)) + chunk(b"IEND", b"")
+
+
+class FakeUpstream:
+    """在 127.0.0.1 的随机端口上运行的上游替身"""
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, payload_kb: int = 256,
+                 failure_rate: float = 0.0, response: str = "png", seed: Optional[int] = None,
+                 capacity: int = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.response = response
+        self.capacity = capacity
+        self.image = make_png(payload_kb)
+        self.requests = 0
+        self.failures = 0
+        self.throttled = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server: Optional[ThreadingHTTPServer] = None
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeUpstream":
+        upstream = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                upstream._handle(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-upstream", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def _handle(self, request: BaseHTTPRequestHandler) -> None:
+        with self._lock:
+            self.requests += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            delay = self.latency * (1 + self._rng.uniform(-self.jitter, self.jitter)) if self.jitter else self.latency
+            failed = bool(self.failure_rate) and self._rng.random() < self.failure_rate
+            if failed:
+                self.failures += 1
+            throttled = bool(self.capacity) and self.in_flight > self.capacity
+            if throttled:
+                self.throttled += 1
+                delay *= 0.1
+        try:
+            if delay > 0:
+                time.sleep(delay)
+            if throttled:
+                self._reply(request, 429, "text/plain", b"too many requests")
+            elif failed:
+                self._reply(request, 503, "text/plain", b"upstream overloaded")
+            elif self.response == "url":
+                body = f'{{"url": "https://images.invalid/{self.requests}.png"}}'.encode()
+                self._reply(request, 200, "application/json", body)
+            else:
+                self._reply(request, 200, "image/png", self.image)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+    @staticmethod
+    def _reply(request: BaseHTTPRequestHandler, status: int, content_type: str, body: bytes) -> None:
+        request.send_response(status)
+        request.send_header("Content-Type", content_type)
+        request.send_header("Content-Length", str(len(body)))
+        request.end_headers()
+        request.wfile.write(body)
@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+"""
+负载生成器：在宿主替身中并发执行插件组件，统计端到端延迟分布与各接口调用次数
+
+用法：python -m devtools.loadgen（或 python devtools/loadgen.py）[--scenario mixed] [--requests 200] [--concurrency 20]
+                                 [--upstream-latency 0.5] [--llm-latency 0.3] [--recall-delay 1]
+场景：draw（/nai 描述）、nai0（/nai0 标签）、action（Planner 触发的动作）、mixed（三者轮流）。
+上游为本地 HTTP 替身，请求经过 NaiWebClient 的真实网络路径；插件数据与生成的图片写入临时目录，
+不影响插件目录中的 data/ 与 generated_images/。
+--profile 时用 cProfile 记录整个运行过程并输出累计耗时最高的函数。
+"""
+import argparse
+import asyncio
+import cProfile
+import importlib
+import json
+import logging
+import os
+import pstats
+import sys
+import time
+from collections import Counter
+from typing import Any, Dict, List
+
+if __package__ in (None, ""):
+    # 直接以脚本运行时把仓库根目录加入导入路径
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from devtools import fake_host  # noqa: E402
+from devtools.fake_upstream import FakeUpstream  # noqa: E402
+
+_SCENARIOS = ("draw", "nai0", "action")
+_DESCRIPTIONS = ("初音未来，制服，樱花", "猫娘在窗边看书", "雨夜的城市街道", "海边的白裙少女")
+_TAGS = ("1girl, solo, smile", "1girl, cat ears, reading, window", "city, night, rain", "1girl, beach, white dress")
+
+
+def percentile(ordered: List[float], ratio: float) -> float:
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(len(ordered) * ratio))]
+
+
+def _build_component(scenario: str, index: int, loaded: fake_host.LoadedPlugin, stream: Any):
+    config = loaded.plugin.config
+    if scenario == "draw":
+        text = f"/nai {_DESCRIPTIONS[index % len(_DESCRIPTIONS)]}"
+        return fake_host.create_command(loaded.components["NaiDrawCommand"], text, config, stream)
+    if scenario == "nai0":
+        text = f"/nai0 {_TAGS[index % len(_TAGS)]}"
+        return fake_host.create_command(loaded.components["Nai0DrawCommand"], text, config, stream)
+    action_data = {"description": _DESCRIPTIONS[index % len(_DESCRIPTIONS)], "size": "", "selfie_mode": False}
+    return fake_host.create_action(loaded.components["NaiPicAction"], action_data, config, stream)
+
+
+def _limit_history(base_url: str) -> List[tuple]:
+    """返回上游并发上限的变化记录，时间为相对第一条记录的秒数"""
+    upstream_limiter = importlib.import_module(f"{fake_host.PACKAGE_NAME}.core.upstream_limiter")
+    limiter = upstream_limiter.find_upstream_limiter(base_url)
+    if limiter is None:
+        return []
+    started = limiter.history[0][0]
+    return [(ts - started, limit, reason) for ts, limit, reason in limiter.history]
+
+
+async def run_load(args: argparse.Namespace) -> Dict[str, Any]:
+    host = fake_host.install(fake_host.HostLatencies(
+        send_text=args.send_latency,
+        send_image=args.send_latency,
+        send_command=args.command_latency,
+        llm=args.llm_latency,
+        message_api=args.message_api_latency,
+        jitter=args.jitter,
+    ), seed=args.seed)
+    upstream = FakeUpstream(args.upstream_latency, args.jitter, args.payload_kb, args.failure_rate,
+                            args.response, seed=args.seed, capacity=args.upstream_capacity).start()
+    recall_enabled = args.recall_delay >= 0
+    loaded = fake_host.load_plugin({
+        "model": {"base_url": upstream.base_url, "api_key": "loadgen", "max_concurrency": args.upstream_concurrency},
+        "auto_recall": {"enabled": recall_enabled, "delay_seconds": max(0, args.recall_delay)},
+        "chat_state": {"persist": False},
+        "config_reload": {"enabled": False},
+        "adaptive_concurrency": {"enabled": args.adaptive},
+    })
+    await host.start()
+
+    streams = [fake_host.make_chat_stream(group_id=str(10001 + i), user_id=str(20001 + i)) for i in range(args.chats)]
+    scenarios = _SCENARIOS if args.scenario == "mixed" else (args.scenario,)
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies: Dict[str, List[float]] = {name: [] for name in scenarios}
+    outcomes: Counter = Counter()
+
+    async def one(index: int) -> None:
+        scenario = scenarios[index % len(scenarios)]
+        async with semaphore:
+            component = _build_component(scenario, index, loaded, streams[index % len(streams)])
+            started = time.perf_counter()
+            try:
+                result = await component.execute()
+                outcomes[f"{scenario}.{'ok' if result[0] else 'failed'}"] += 1
+            except Exception as exc:
+                outcomes[f"{scenario}.error.{type(exc).__name__}"] += 1
+            latencies[scenario].append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(args.requests)))
+    elapsed = time.perf_counter() - started
+
+    recall_scheduler = importlib.import_module(f"{fake_host.PACKAGE_NAME}.core.recall_scheduler").scheduler
+    if recall_enabled:
+        deadline = time.monotonic() + args.recall_delay + args.drain_timeout
+        while recall_scheduler.pending_count and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+    await host.stop()
+    limit_history = _limit_history(upstream.base_url)
+    upstream.stop()
+
+    runtime_stats = importlib.import_module(f"{fake_host.PACKAGE_NAME}.core.runtime_stats")
+    report = {
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "elapsed_seconds": elapsed,
+        "throughput_rps": args.requests / elapsed if elapsed else 0.0,
+        "outcomes": dict(outcomes),
+        "latency": {},
+        "upstream": {"requests": upstream.requests, "failures": upstream.failures, "throttled": upstream.throttled,
+                     "max_in_flight": upstream.max_in_flight, "limit_history": limit_history},
+        "host_calls": dict(host.calls),
+        "recalled": len(host.recalled),
+        "recall_pending": recall_scheduler.pending_count,
+        "runtime_stats": runtime_stats.snapshot(),
+    }
+    for scenario, samples in latencies.items():
+        ordered = sorted(samples)
+        report["latency"][scenario] = {
+            "count": len(ordered),
+            "p50": percentile(ordered, 0.50),
+            "p95": percentile(ordered, 0.95),
+            "p99": percentile(ordered, 0.99),
+            "max": ordered[-1] if ordered else 0.0,
+        }
+    return report
+
+
+def _print_report(report: Dict[str, Any]) -> None:
+    print(f"{report['requests']} 个请求，并发 {report['concurrency']}，耗时 {report['elapsed_seconds']:.2f}s，"
+          f"吞吐 {report['throughput_rps']:.1f} req/s")
+    print()
+    print(f"{'scenario':<10} {'count':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for scenario, stat in report["latency"].items():
+        print(f"{scenario:<10} {stat['count']:>6} {stat['p50'] * 1000:>9.1f} {stat['p95'] * 1000:>9.1f} "
+              f"{stat['p99'] * 1000:>9.1f} {stat['max'] * 1000:>9.1f}")
+    print()
+    print("结果:", ", ".join(f"{key}={value}" for key, value in sorted(report["outcomes"].items())))
+    upstream = report["upstream"]
+    print(f"上游: 请求 {upstream['requests']}，失败 {upstream['failures']}，限流 {upstream['throttled']}，"
+          f"最大并发 {upstream['max_in_flight']}")
+    if len(upstream["limit_history"]) > 1:
+        print("并发上限:", " -> ".join(f"{limit}({reason} +{offset:.1f}s)" for offset, limit, reason in upstream["limit_history"]))
+    print("宿主接口:", ", ".join(f"{key}={value}" for key, value in sorted(report["host_calls"].items())))
+    print(f"自动撤回: 已撤回 {report['recalled']}，未完成 {report['recall_pending']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="插件组件负载生成器（宿主替身）")
+    parser.add_argument("--scenario", choices=_SCENARIOS + ("mixed",), default="mixed")
+    parser.add_argument("--requests", type=int, default=200, help="总请求数")
+    parser.add_argument("--concurrency", type=int, default=20, help="同时执行的请求数")
+    parser.add_argument("--chats", type=int, default=8, help="请求分布的群聊数量")
+    parser.add_argument("--upstream-latency", type=float, default=0.5, help="上游生图耗时（秒）")
+    parser.add_argument("--upstream-concurrency", type=int, default=2, help="model.max_concurrency")
+    parser.add_argument("--payload-kb", type=int, default=256, help="上游返回的图片大小（KB）")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="上游返回 503 的比例")
+    parser.add_argument("--upstream-capacity", type=int, default=0, help="上游同时处理超过该数量时返回 429，0 为不限制")
+    parser.add_argument("--adaptive", action="store_true", help="开启 [adaptive_concurrency] 自动调整并发上限")
+    parser.add_argument("--response", choices=("png", "url"), default="png", help="上游返回图片或图片链接")
+    parser.add_argument("--llm-latency", type=float, default=0.3, help="提示词生成 LLM 耗时（秒）")
+    parser.add_argument("--send-latency", type=float, default=0.02, help="发送消息耗时（秒）")
+    parser.add_argument("--command-latency", type=float, default=0.05, help="适配器命令（撤回）耗时（秒）")
+    parser.add_argument("--message-api-latency", type=float, default=0.01, help="查询最近消息耗时（秒）")
+    parser.add_argument("--jitter", type=float, default=0.2, help="各耗时的上下浮动比例")
+    parser.add_argument("--recall-delay", type=int, default=-1, help="自动撤回延迟（秒），负数为不启用")
+    parser.add_argument("--drain-timeout", type=float, default=30.0, help="结束后等待撤回完成的最长时间（秒）")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--profile", action="store_true", help="用 cProfile 记录运行过程")
+    parser.add_argument("--json", action="store_true", help="以 JSON 输出完整报告")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    profiler = cProfile.Profile() if args.profile else None
+    if profiler is not None:
+        profiler.enable()
+    report = asyncio.run(run_load(args))
+    if profiler is not None:
+        profiler.disable()
+
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        _print_report(report)
+    if profiler is not None:
+        print()
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(25)
+
+
+if __name__ == "__main__":
+    main()
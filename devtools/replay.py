@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+"""
+流量回放：把 traffic_record 记录的请求按原来的时间间隔（可加速）送回组件的 execute
+
+用法：python -m devtools.replay（或 python devtools/replay.py）data/traffic.jsonl [--speedup 10] [--upstream-latency 3.5] [--limit 1000]
+组件运行在 fake_host 中，上游为本地替身。描述与标签按记录的长度合成，会话/用户哈希映射为
+替身中的群聊与用户，草图 / 批量 / 重绘按记录的形态还原。上游耗时默认取记录中上游调用耗时的
+中位数，失败率取记录中上游调用失败的比例；默认模型取记录中出现最多的模型。
+加速只压缩请求之间的间隔，单个请求的耗时保持不变，用于评估容量相关改动在真实负载下的表现。
+结束后对比记录与回放中各入口的延迟分布与结果。
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import statistics
+import sys
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+if __package__ in (None, ""):
+    # 直接以脚本运行时把仓库根目录加入导入路径
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from devtools import fake_host  # noqa: E402
+from devtools.fake_upstream import FakeUpstream  # noqa: E402
+from devtools.loadgen import percentile  # noqa: E402
+
+_ENTRIES = ("nai", "nai0", "action")
+_DESCRIPTION_UNIT = "樱花树下的少女，"
+_TAG_UNIT = "1girl, solo, smile, "
+
+
+def load_records(path: str, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    """读取记录文件，跳过无法解析或版本不符的行，按时间排序"""
+    records = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if record.get("v") == 1 and record.get("entry") in _ENTRIES:
+                records.append(record)
+    records.sort(key=lambda record: record["ts"])
+    return records[:limit] if limit else records
+
+
+def _synthetic_text(entry: str, chars: int) -> str:
+    unit = _TAG_UNIT if entry == "nai0" else _DESCRIPTION_UNIT
+    text = (unit * (max(1, chars) // len(unit) + 1))[:max(1, chars)]
+    return text.strip(", ") or unit.strip(", ")
+
+
+def _command_text(record: Dict[str, Any]) -> str:
+    entry = record["entry"]
+    mode = record.get("mode", "normal")
+    if mode == "refine":
+        return "/nai refine"
+    body = _synthetic_text(entry, record.get("request_chars", 0))
+    if record.get("selfie"):
+        body = f"自拍，{body}"
+    if mode == "batch":
+        body = f"x{record.get('batch', 2)} {body}"
+    elif mode == "fast":
+        body = f"fast {body}"
+    return f"/{entry} {body}"
+
+
+class _Streams:
+    """把记录中的会话/用户哈希映射为替身中的聊天流"""
+
+    def __init__(self):
+        self._groups: Dict[str, str] = {}
+        self._users: Dict[str, str] = {}
+
+    def get(self, record: Dict[str, Any]) -> Any:
+        group_id = self._groups.setdefault(record.get("chat") or "-", str(10001 + len(self._groups)))
+        user_id = self._users.setdefault(record.get("user") or "-", str(20001 + len(self._users)))
+        return fake_host.make_chat_stream(platform=record.get("platform") or "qq", group_id=group_id, user_id=user_id)
+
+
+def _build_component(record: Dict[str, Any], loaded: fake_host.LoadedPlugin, stream: Any):
+    config = loaded.plugin.config
+    entry = record["entry"]
+    if entry == "action":
+        action_data = {
+            "description": _synthetic_text(entry, record.get("request_chars", 0)),
+            "size": record.get("size", ""),
+            "selfie_mode": bool(record.get("selfie")),
+        }
+        return fake_host.create_action(loaded.components["NaiPicAction"], action_data, config, stream)
+    command_cls = loaded.components["Nai0DrawCommand" if entry == "nai0" else "NaiDrawCommand"]
+    return fake_host.create_command(command_cls, _command_text(record), config, stream)
+
+
+def _recorded_upstream(records: List[Dict[str, Any]]) -> tuple:
+    """返回记录中上游调用耗时的中位数与失败比例"""
+    samples = [elapsed for record in records for elapsed in record.get("upstream", ())]
+    failures = sum(record.get("upstream_failures", 0) for record in records)
+    if not samples:
+        return 0.5, 0.0
+    return statistics.median(samples), failures / len(samples)
+
+
+def _latency_summary(samples: List[float]) -> Dict[str, float]:
+    ordered = sorted(samples)
+    return {"count": len(ordered), "p50": percentile(ordered, 0.50), "p95": percentile(ordered, 0.95)}
+
+
+async def run_replay(args: argparse.Namespace) -> Dict[str, Any]:
+    records = load_records(args.path, args.limit)
+    if not records:
+        raise SystemExit(f"{args.path} 中没有可回放的记录")
+
+    median_latency, failure_rate = _recorded_upstream(records)
+    upstream_latency = median_latency if args.upstream_latency is None else args.upstream_latency
+    failure_rate = failure_rate if args.failure_rate is None else args.failure_rate
+    models = Counter(record.get("params", {}).get("model") for record in records)
+    models.pop(None, None)
+
+    host = fake_host.install(fake_host.HostLatencies(
+        send_text=args.send_latency,
+        send_image=args.send_latency,
+        llm=args.llm_latency,
+        jitter=args.jitter,
+    ), seed=args.seed)
+    upstream = FakeUpstream(upstream_latency, args.jitter, args.payload_kb, failure_rate, seed=args.seed).start()
+    model_overrides = {"base_url": upstream.base_url, "api_key": "replay", "max_concurrency": args.upstream_concurrency}
+    if models:
+        model_overrides["default_model"] = models.most_common(1)[0][0]
+    loaded = fake_host.load_plugin({
+        "model": model_overrides,
+        "chat_state": {"persist": False},
+        "config_reload": {"enabled": False},
+        "traffic_record": {"enabled": False},
+    })
+    await host.start()
+
+    streams = _Streams()
+    replayed: Dict[str, List[float]] = {entry: [] for entry in _ENTRIES}
+    outcomes: Counter = Counter()
+    max_lag = 0.0
+    first_ts = records[0]["ts"]
+    loop_started = time.monotonic()
+
+    async def one(record: Dict[str, Any]) -> None:
+        nonlocal max_lag
+        due = (record["ts"] - first_ts) / args.speedup
+        delay = due - (time.monotonic() - loop_started)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        max_lag = max(max_lag, time.monotonic() - loop_started - due)
+        component = _build_component(record, loaded, streams.get(record))
+        started = time.perf_counter()
+        try:
+            result = await component.execute()
+            outcomes[f"{record['entry']}.{'ok' if result[0] else 'failed'}"] += 1
+        except Exception as exc:
+            outcomes[f"{record['entry']}.error.{type(exc).__name__}"] += 1
+        replayed[record["entry"]].append(time.perf_counter() - started)
+
+    await asyncio.gather(*(one(record) for record in records))
+    elapsed = time.monotonic() - loop_started
+    await host.stop()
+    upstream.stop()
+
+    return {
+        "records": len(records),
+        "speedup": args.speedup,
+        "recorded_seconds": records[-1]["ts"] - first_ts,
+        "replay_seconds": elapsed,
+        "max_start_lag": max_lag,
+        "upstream_latency": upstream_latency,
+        "upstream_failure_rate": failure_rate,
+        "upstream_max_in_flight": upstream.max_in_flight,
+        "recorded_outcomes": dict(Counter(f"{r['entry']}.{r.get('outcome', '?')}" for r in records)),
+        "replay_outcomes": dict(outcomes),
+        "latency": {
+            entry: {
+                "recorded": _latency_summary([r.get("latency", 0.0) for r in records if r["entry"] == entry]),
+                "replay": _latency_summary(samples),
+            }
+            for entry, samples in replayed.items() if samples
+        },
+    }
+
+
+def _print_report(report: Dict[str, Any]) -> None:
+    print(f"回放 {report['records']} 条记录（{report['speedup']}x）：记录时长 {report['recorded_seconds']:.1f}s，"
+          f"回放耗时 {report['replay_seconds']:.1f}s，最大启动延迟 {report['max_start_lag'] * 1000:.0f}ms")
+    print(f"上游替身：耗时 {report['upstream_latency']:.2f}s，失败率 {report['upstream_failure_rate']:.1%}，"
+          f"最大并发 {report['upstream_max_in_flight']}")
+    print()
+    print(f"{'entry':<8} {'count':>6} {'rec p50':>9} {'rec p95':>9} {'p50':>9} {'p95':>9}  (秒)")
+    for entry, stat in report["latency"].items():
+        recorded, replay = stat["recorded"], stat["replay"]
+        print(f"{entry:<8} {replay['count']:>6} {recorded['p50']:>9.2f} {recorded['p95']:>9.2f} "
+              f"{replay['p50']:>9.2f} {replay['p95']:>9.2f}")
+    print()
+    print("记录结果:", ", ".join(f"{k}={v}" for k, v in sorted(report["recorded_outcomes"].items())))
+    print("回放结果:", ", ".join(f"{k}={v}" for k, v in sorted(report["replay_outcomes"].items())))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="回放 traffic_record 记录的生图请求")
+    parser.add_argument("path", help="记录文件（插件 data 目录下的 traffic.jsonl）")
+    parser.add_argument("--speedup", type=float, default=1.0, help="请求间隔压缩倍数")
+    parser.add_argument("--limit", type=int, default=None, help="最多回放的记录数")
+    parser.add_argument("--upstream-latency", type=float, default=None, help="上游耗时（秒），默认取记录的中位数")
+    parser.add_argument("--failure-rate", type=float, default=None, help="上游失败率，默认取记录中的比例")
+    parser.add_argument("--upstream-concurrency", type=int, default=2, help="model.max_concurrency")
+    parser.add_argument("--payload-kb", type=int, default=256, help="上游返回的图片大小（KB）")
+    parser.add_argument("--llm-latency", type=float, default=0.3, help="提示词生成 LLM 耗时（秒）")
+    parser.add_argument("--send-latency", type=float, default=0.02, help="发送消息耗时（秒）")
+    parser.add_argument("--jitter", type=float, default=0.2, help="各耗时的上下浮动比例")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--json", action="store_true", help="以 JSON 输出完整报告")
+    args = parser.parse_args()
+    if args.speedup <= 0:
+        parser.error("--speedup 必须大于 0")
+
+    logging.basicConfig(level=logging.WARNING)
+    report = asyncio.run(run_replay(args))
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        _print_report(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,12 +4,11 @@ from src.plugin_system.base.base_plugin import BasePlugin
 from src.plugin_system.base.component_types import ComponentInfo
 from src.plugin_system import register_plugin
 from src.plugin_system.base.config_types import ConfigField
+from src.common.logger import get_logger
 
-from .core.nai_pic_action import NaiPicAction
-from .core.nai_recall_command import NaiRecallControlCommand
-from .core.nai_draw_command import NaiDrawCommand
-from .core.nai_0_draw_command import Nai0DrawCommand
-from .core.nai_admin_command import NaiAdminControlCommand
+from .core.plugin_settings import plugin_settings
+
+logger = get_logger("nai_pic_plugin")
 
 
 @register_plugin
@@ -33,8 +32,21 @@ class NaiPicPlugin(BasePlugin):
         "model_nai4": "NovelAI V4 模型专用配置（nai-diffusion-4-curated、nai-diffusion-4-full 等）",
         "model_nai4_5": "NovelAI V4.5 模型专用配置（nai-diffusion-4-5-full 等最新模型）",
         "components": "组件配置",
+        "image_postprocess": "图片后处理配置（去除元数据、按大小转码）",
+        "upscale": "本地放大配置（向上游请求小图后在本地放大到目标尺寸）",
+        "batch": "批量生成配置（/nai x4、/nai0 x4）",
         "auto_recall": "自动撤回配置",
         "admin": "管理员权限配置",
+        "chat_state": "会话设置缓存配置（模型/画师串/尺寸选择等会话级设置）",
+        "config_reload": "配置热重载（修改 config.toml 后无需重启）",
+        "traffic_record": "流量记录（匿名化的生图请求记录，用于回放压测）",
+        "tracing": "请求追踪（按采样率把每次生图的各阶段耗时以 OpenTelemetry 格式写入本地文件）",
+        "metrics_history": "指标历史（按分钟写入磁盘的请求量、延迟、错误与流量，供 /nai report 使用）",
+        "profiling": "按需性能剖析（/nai prof，管理员对指定会话或入口的后续请求采集 cProfile）",
+        "adaptive_concurrency": "自适应上游并发（按上游耗时与 429/5xx 以 AIMD 自动调整同时进行的请求数）",
+        "degradation": "负载降级（上游排队较深或耗时较高时在各模型配置节的下限内降低步数与尺寸）",
+        "admission": "准入控制（按上游排队深度与耗时 EWMA 估算等待时间，超过上限时直接拒绝新请求）",
+        "quota": "生图配额（按用户、会话与全局的滑动窗口限额，超限时在生成提示词之前拒绝）",
         "prompt_generator": "提示词生成配置",
         "prompt_fallback": "提示词生成配置（兼容旧配置名）",
     }
@@ -98,6 +110,11 @@ class NaiPicPlugin(BasePlugin):
                 default="/generate",
                 description="API 端点路径"
             ),
+            "max_concurrency": ConfigField(
+                type=int,
+                default=0,
+                description="同一上游（base_url）同时进行的生图请求上限，0 为不限制；开启 [adaptive_concurrency] 时为自动调整的初值（0 时从 max_limit 开始）"
+            ),
         },
         "model_nai3": {
             "artist_presets": ConfigField(
@@ -172,6 +189,26 @@ class NaiPicPlugin(BasePlugin):
                 type=dict,
                 default={},
                 description="NAI V3 专用额外参数"
+            ),
+            "draft_size": ConfigField(
+                type=str,
+                default="512x768",
+                description="NAI V3 快速草图模式（/nai fast）使用的图片尺寸"
+            ),
+            "draft_steps": ConfigField(
+                type=int,
+                default=12,
+                description="NAI V3 快速草图模式（/nai fast）使用的推理步数"
+            ),
+            "degrade_min_steps": ConfigField(
+                type=int,
+                default=16,
+                description="NAI V3 负载降级时推理步数的下限，0 为不降低步数"
+            ),
+            "degrade_min_scale": ConfigField(
+                type=float,
+                default=0.75,
+                description="NAI V3 负载降级时图片边长相对原尺寸的最小比例，1 为不缩小尺寸"
             )
         },
         "model_nai4": {
@@ -247,6 +284,26 @@ class NaiPicPlugin(BasePlugin):
                 type=dict,
                 default={},
                 description="NAI V4 专用额外参数"
+            ),
+            "draft_size": ConfigField(
+                type=str,
+                default="512x768",
+                description="NAI V4 快速草图模式（/nai fast）使用的图片尺寸"
+            ),
+            "draft_steps": ConfigField(
+                type=int,
+                default=12,
+                description="NAI V4 快速草图模式（/nai fast）使用的推理步数"
+            ),
+            "degrade_min_steps": ConfigField(
+                type=int,
+                default=16,
+                description="NAI V4 负载降级时推理步数的下限，0 为不降低步数"
+            ),
+            "degrade_min_scale": ConfigField(
+                type=float,
+                default=0.75,
+                description="NAI V4 负载降级时图片边长相对原尺寸的最小比例，1 为不缩小尺寸"
             )
         },
         "model_nai4_5": {
@@ -322,6 +379,26 @@ class NaiPicPlugin(BasePlugin):
                 type=dict,
                 default={},
                 description="NAI V4.5 专用额外参数"
+            ),
+            "draft_size": ConfigField(
+                type=str,
+                default="512x768",
+                description="NAI V4.5 快速草图模式（/nai fast）使用的图片尺寸"
+            ),
+            "draft_steps": ConfigField(
+                type=int,
+                default=12,
+                description="NAI V4.5 快速草图模式（/nai fast）使用的推理步数"
+            ),
+            "degrade_min_steps": ConfigField(
+                type=int,
+                default=16,
+                description="NAI V4.5 负载降级时推理步数的下限，0 为不降低步数"
+            ),
+            "degrade_min_scale": ConfigField(
+                type=float,
+                default=0.75,
+                description="NAI V4.5 负载降级时图片边长相对原尺寸的最小比例，1 为不缩小尺寸"
             )
         },
         "components": {
@@ -331,6 +408,71 @@ class NaiPicPlugin(BasePlugin):
                 description="是否显示调试信息"
             ),
         },
+        "image_postprocess": {
+            "enabled": ConfigField(
+                type=bool,
+                default=False,
+                description="是否在发送前对图片进行后处理"
+            ),
+            "strip_metadata": ConfigField(
+                type=bool,
+                default=True,
+                description="是否去除PNG中的提示词/生成参数等元数据块（不重新解码像素）"
+            ),
+            "transcode_format": ConfigField(
+                type=str,
+                default="",
+                description="超过阈值时转码的目标格式（webp/jpeg），留空则不转码"
+            ),
+            "transcode_quality": ConfigField(
+                type=int,
+                default=90,
+                description="转码质量（1-100）"
+            ),
+            "transcode_threshold_kb": ConfigField(
+                type=int,
+                default=1024,
+                description="图片超过该大小（KB）时才进行转码"
+            ),
+            "worker_processes": ConfigField(
+                type=int,
+                default=1,
+                description="图片处理（转码、放大）使用的工作进程数"
+            )
+        },
+        "upscale": {
+            "enabled": ConfigField(
+                type=bool,
+                default=False,
+                description="是否启用本地放大（需要安装 Pillow）"
+            ),
+            "presets": ConfigField(
+                type=dict,
+                default={
+                    "832x1216": "576x832",
+                    "1216x832": "832x576",
+                    "1024x1024": "704x704"
+                },
+                description="放大预设：目标尺寸（或 /nai size 的尺寸代号）-> 实际向上游请求的尺寸"
+            ),
+            "resample": ConfigField(
+                type=str,
+                default="lanczos",
+                description="放大算法（lanczos/bicubic/bilinear）"
+            )
+        },
+        "batch": {
+            "max_count": ConfigField(
+                type=int,
+                default=4,
+                description="单次批量生成的最大张数"
+            ),
+            "max_grid_side": ConfigField(
+                type=int,
+                default=2048,
+                description="拼接网格图的最长边（像素），超出时按比例缩小各格"
+            )
+        },
         "auto_recall": {
             "enabled": ConfigField(
                 type=bool,
@@ -347,6 +489,31 @@ class NaiPicPlugin(BasePlugin):
                 default=15,
                 description="等待正式消息ID的最长时间（秒）"
             ),
+            "event_wait_seconds": ConfigField(
+                type=float,
+                default=1.0,
+                description="发送后等待消息事件提供消息ID的时间（秒），超时后才查询数据库"
+            ),
+            "poll_fallback_attempts": ConfigField(
+                type=int,
+                default=3,
+                description="消息事件未提供ID时，撤回前兜底查询最近消息的最多次数（同一批撤回共用）"
+            ),
+            "max_concurrent_recalls": ConfigField(
+                type=int,
+                default=4,
+                description="同时执行的撤回数量上限，到期的撤回超出上限时排队"
+            ),
+            "command_fallback_after": ConfigField(
+                type=int,
+                default=3,
+                description="已学习的撤回命令连续失败多少次后，重新尝试全部撤回命令"
+            ),
+            "batch_window_seconds": ConfigField(
+                type=float,
+                default=2.0,
+                description="同一聊天中到期时间相差不超过该值（秒）的撤回合并为一批执行"
+            ),
             "allowed_groups": ConfigField(
                 type=list,
                 default=[],
@@ -365,6 +532,256 @@ class NaiPicPlugin(BasePlugin):
                 description="是否默认启用管理员模式（开启后仅管理员可使用 /nai 生图命令）"
             )
         },
+        "chat_state": {
+            "persist": ConfigField(
+                type=bool,
+                default=True,
+                description="是否将会话设置保存到 data/chat_settings.db，重启后自动恢复"
+            ),
+            "flush_interval_seconds": ConfigField(
+                type=float,
+                default=1.0,
+                description="会话设置变更合并写入磁盘的间隔（秒）"
+            ),
+            "max_chats": ConfigField(
+                type=int,
+                default=10000,
+                description="内存中保留会话设置的最大会话数，超出时淘汰最久未使用的会话（未开启 persist 时被淘汰会话的设置恢复为默认）"
+            ),
+            "idle_ttl_seconds": ConfigField(
+                type=int,
+                default=604800,
+                description="会话超过该时长（秒）未使用即被淘汰，0 表示不按时长淘汰（未开启 persist 时被淘汰会话的设置恢复为默认）"
+            ),
+        },
+        "config_reload": {
+            "enabled": ConfigField(
+                type=bool,
+                default=True,
+                description="是否监视 config.toml，修改后无需重启即可生效"
+            ),
+            "poll_interval_seconds": ConfigField(
+                type=float,
+                default=2.0,
+                description="检查配置文件是否被修改的间隔（秒）"
+            ),
+        },
+        "traffic_record": {
+            "enabled": ConfigField(
+                type=bool,
+                default=False,
+                description="是否记录匿名化的生图请求（入口、参数、结果与耗时，不含提示词原文），供 devtools/replay.py 回放"
+            ),
+            "file_name": ConfigField(
+                type=str,
+                default="traffic.jsonl",
+                description="记录文件名（位于插件 data 目录）"
+            ),
+            "max_file_mb": ConfigField(
+                type=int,
+                default=50,
+                description="记录文件超过该大小（MB）后轮换为 .1 文件"
+            ),
+            "salt": ConfigField(
+                type=str,
+                default="",
+                description="会话/用户哈希使用的盐；留空时每次启动随机生成，不同启动之间的记录无法关联"
+            ),
+        },
+        "tracing": {
+            "enabled": ConfigField(
+                type=bool,
+                default=False,
+                description="是否记录生图请求的追踪（提示词生成、配置合并、上游请求、图片处理、发送、撤回计划的耗时与属性）"
+            ),
+            "sample_rate": ConfigField(
+                type=float,
+                default=0.1,
+                description="追踪的请求比例（0~1），1 为全部追踪"
+            ),
+            "file_name": ConfigField(
+                type=str,
+                default="traces.jsonl",
+                description="追踪文件名（位于插件 data 目录），每行一批 OTLP/JSON 格式的 span"
+            ),
+            "batch_size": ConfigField(
+                type=int,
+                default=64,
+                description="攒够该数量的 span 后写入一批"
+            ),
+            "flush_interval_seconds": ConfigField(
+                type=float,
+                default=10.0,
+                description="距上次写入超过该时间（秒）时，请求结束即写入，不等攒满"
+            ),
+            "max_file_mb": ConfigField(
+                type=int,
+                default=50,
+                description="追踪文件超过该大小（MB）后轮换为 .1 文件"
+            ),
+        },
+        "metrics_history": {
+            "enabled": ConfigField(
+                type=bool,
+                default=True,
+                description="是否把每分钟的生图数量、延迟分布、错误类别与流量写入 data 目录下的环形文件"
+            ),
+            "file_name": ConfigField(
+                type=str,
+                default="metrics_history.bin",
+                description="指标历史文件名（位于插件 data 目录）"
+            ),
+            "retention_days": ConfigField(
+                type=int,
+                default=7,
+                description="保留天数，决定文件大小（每天约 100KB）；修改后文件会重新创建"
+            ),
+        },
+        "profiling": {
+            "enabled": ConfigField(
+                type=bool,
+                default=True,
+                description="是否允许管理员使用 /nai prof 对后续请求采集性能剖析"
+            ),
+            "max_requests": ConfigField(
+                type=int,
+                default=20,
+                description="一次 /nai prof 最多采集的请求数"
+            ),
+            "keep_files": ConfigField(
+                type=int,
+                default=30,
+                description="data/profiles 目录最多保留的剖析文件数，超出时删除最旧的"
+            ),
+            "top_functions": ConfigField(
+                type=int,
+                default=8,
+                description="回报给管理员的摘要中列出的函数数"
+            ),
+            "expire_minutes": ConfigField(
+                type=int,
+                default=60,
+                description="布置后超过该时间（分钟）仍未采满时自动取消"
+            ),
+        },
+        "quota": {
+            "enabled": ConfigField(
+                type=bool,
+                default=False,
+                description="是否启用生图配额"
+            ),
+            "user_limit": ConfigField(
+                type=int,
+                default=20,
+                description="每个用户在窗口内最多生成的图片数，0 为不限制（批量生成按张数计）"
+            ),
+            "user_window_seconds": ConfigField(
+                type=int,
+                default=3600,
+                description="用户限额的窗口长度（秒）"
+            ),
+            "chat_limit": ConfigField(
+                type=int,
+                default=60,
+                description="每个会话在窗口内最多生成的图片数，0 为不限制"
+            ),
+            "chat_window_seconds": ConfigField(
+                type=int,
+                default=3600,
+                description="会话限额的窗口长度（秒）"
+            ),
+            "global_limit": ConfigField(
+                type=int,
+                default=0,
+                description="所有会话合计在窗口内最多生成的图片数，0 为不限制"
+            ),
+            "global_window_seconds": ConfigField(
+                type=int,
+                default=60,
+                description="全局限额的窗口长度（秒）"
+            ),
+            "exempt_admins": ConfigField(
+                type=bool,
+                default=True,
+                description="admin_users 中的管理员是否不受配额限制"
+            ),
+        },
+        "adaptive_concurrency": {
+            "enabled": ConfigField(
+                type=bool,
+                default=False,
+                description="是否按上游耗时与 429/5xx 自动调整并发上限（默认关闭），关闭时固定为 model.max_concurrency"
+            ),
+            "min_limit": ConfigField(
+                type=int,
+                default=1,
+                description="并发上限的下限"
+            ),
+            "max_limit": ConfigField(
+                type=int,
+                default=8,
+                description="并发上限的上限"
+            ),
+            "latency_tolerance": ConfigField(
+                type=float,
+                default=2.5,
+                description="短期耗时超过基线耗时的该倍数时视为上游过载"
+            ),
+            "backoff_ratio": ConfigField(
+                type=float,
+                default=0.7,
+                description="过载时并发上限乘以该系数"
+            ),
+        },
+        "degradation": {
+            "enabled": ConfigField(
+                type=bool,
+                default=False,
+                description="是否在上游负载较高时降低推理步数与图片尺寸"
+            ),
+            "queue_start": ConfigField(
+                type=float,
+                default=1.0,
+                description="每个并发槽平均排队的调用数达到该值时开始降级"
+            ),
+            "queue_full": ConfigField(
+                type=float,
+                default=4.0,
+                description="排队达到该值时降到模型配置节中的下限"
+            ),
+            "latency_start_seconds": ConfigField(
+                type=float,
+                default=40.0,
+                description="上游耗时 EWMA 达到该值（秒）时开始降级"
+            ),
+            "latency_full_seconds": ConfigField(
+                type=float,
+                default=90.0,
+                description="上游耗时 EWMA 达到该值（秒）时降到下限"
+            ),
+        },
+        "admission": {
+            "enabled": ConfigField(
+                type=bool,
+                default=False,
+                description="是否启用准入控制（默认关闭；开启后排队过长的新请求会被直接拒绝）"
+            ),
+            "max_wait_seconds": ConfigField(
+                type=float,
+                default=90.0,
+                description="/nai 与自动生图的预计等待上限（秒），超过时拒绝新请求，0 为不限制"
+            ),
+            "nai0_max_wait_seconds": ConfigField(
+                type=float,
+                default=105.0,
+                description="/nai0（没有 LLM 步骤）的预计等待上限（秒），0 为不限制"
+            ),
+            "admin_max_wait_seconds": ConfigField(
+                type=float,
+                default=0.0,
+                description="管理员请求的预计等待上限（秒），0 为不限制"
+            ),
+        },
         "prompt_generator": {
             "model_name": ConfigField(
                 type=str,
@@ -413,10 +830,44 @@ class NaiPicPlugin(BasePlugin):
 
     def get_plugin_components(self) -> List[Tuple[ComponentInfo, Type]]:
         """返回插件包含的组件列表"""
+        # 组件模块在注册时才导入，只读取插件元信息 / config_schema 时不加载
+        from .core.nai_pic_action import NaiPicAction
+        from .core.nai_recall_command import NaiRecallControlCommand
+        from .core.nai_draw_command import NaiDrawCommand
+        from .core.nai_0_draw_command import Nai0DrawCommand
+        from .core.nai_admin_command import NaiAdminControlCommand
+        from .core.chat_state import attach_default_store, chat_states
+        from .core.config_watcher import config_watcher
+
+        try:
+            from .core.nai_message_event_handler import (
+                NaiChatSettingsFlushHandler,
+                NaiConfigWatchHandler,
+                NaiOutboundMessageHandler,
+                NaiRecallReplayHandler,
+            )
+        except ImportError:  # 宿主版本不支持事件处理器时，自动撤回退回为轮询解析消息ID，配置不热重载
+            NaiOutboundMessageHandler = None
+
+        # 编译配置，组件处理消息时直接读取编译结果
+        settings = plugin_settings.load(self.config, self.config_schema)
+        for warning in settings.warnings:
+            logger.warning(f"[NaiPicPlugin] 配置问题: {warning}")
+
+        chat_states.configure(settings.chat_state.max_chats, settings.chat_state.idle_ttl_seconds)
+        if settings.chat_state.persist:
+            attach_default_store(settings.chat_state.flush_interval_seconds)
+        config_watcher.attach(self)
+
         components = []
         components.append((NaiPicAction.get_action_info(), NaiPicAction))
         components.append((NaiRecallControlCommand.get_command_info(), NaiRecallControlCommand))
         components.append((NaiAdminControlCommand.get_command_info(), NaiAdminControlCommand))
         components.append((NaiDrawCommand.get_command_info(), NaiDrawCommand))
         components.append((Nai0DrawCommand.get_command_info(), Nai0DrawCommand))
+        if NaiOutboundMessageHandler is not None:
+            components.append((NaiOutboundMessageHandler.get_handler_info(), NaiOutboundMessageHandler))
+            components.append((NaiRecallReplayHandler.get_handler_info(), NaiRecallReplayHandler))
+            components.append((NaiChatSettingsFlushHandler.get_handler_info(), NaiChatSettingsFlushHandler))
+            components.append((NaiConfigWatchHandler.get_handler_info(), NaiConfigWatchHandler))
         return components